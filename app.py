@@ -1,49 +1,161 @@
 #  --- Importing Neccessary Libraries ---
 import os
-import bcrypt
+import json
+import queue
+import atexit
 import logging
-import mysql.connector
+from logging.handlers import QueueHandler, QueueListener
 import pandas as pd
 from datetime import datetime
+from matplotlib.figure import Figure
 from shiny import App, reactive, render, ui, Outputs, Inputs, Session, req
+from starlette.responses import JSONResponse
+
+import reference
+import rollups
+import schema
+from auth import authenticate, client_address
+from bulk_import import import_file
+from changes import changes, CHANGES_POLL_SECONDS
+from history_store import history_store, history_totals, ledger_periods, page_history
+from metrics import timed, with_metrics_route
+from queries import (
+    history_filters, load_history_page, load_history_totals, load_periods, period_choices, stream_history_csv
+)
+from reconciliation import read_fee_schedule, reconcile_years, summary_view, detail_view
+from transactions import record_payment, record_purchase
+from serve import with_affinity_cookie
+from write_queue import write_queue
+from workers import run_db, iterate_in_thread, shutdown as shutdown_workers
 
 
 # --- Setup Logger ---
+# Records are put on a queue by the app and written to the file and console
+# by a background listener thread, so log I/O never blocks the event loop.
 logger = logging.getLogger("ShinyAppLogger")
-logger.setLevel(logging.DEBUG)
+logger.setLevel(os.getenv("LOG_LEVEL", "DEBUG").upper())
 file_handler = logging.FileHandler("app.log")
 console_handler = logging.StreamHandler()
 formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(funcName)s - %(message)s")
 file_handler.setFormatter(formatter)
 console_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
+logger.addHandler(QueueHandler(log_queue))
+
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "5000"))
+HISTORY_CACHE = os.getenv("HISTORY_CACHE", "1") == "1"
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "0") == "1"
+HISTORY_POLL_SECONDS = float(os.getenv("HISTORY_POLL_SECONDS", "5"))
+REPORT_POLL_SECONDS = float(os.getenv("REPORT_POLL_SECONDS", "10"))
+HISTORY_PAGE_SIZE = os.getenv("HISTORY_PAGE_SIZE", "50")
+PAGE_SIZES = sorted({"25", "50", "100", "250", HISTORY_PAGE_SIZE}, key=int)
+ENROLLEE_SEARCH_DEBOUNCE_MS = int(os.getenv("ENROLLEE_SEARCH_DEBOUNCE_MS", "300"))
+
+ADD_NEW_ENROLLEE = {"value": "add_new_enrollee", "label": "➕ Add new enrollee..."}
+
+# Enrollee typeahead: selectize asks the session's search route once typing
+# pauses for ENROLLEE_SEARCH_DEBOUNCE_MS, and keeps the "add new" option
+# listed whatever has been typed
+ENROLLEE_LOAD_JS = """
+function(query, callback) {
+    $.getJSON(%s, {query: query}).done(callback).fail(function() { callback(); });
+}
+"""
+ENROLLEE_SCORE_JS = """
+function(search) {
+    var score = this.getScoreFunction(search);
+    return function(item) { return item.value === 'add_new_enrollee' ? 0.0001 : score(item); };
+}
+"""
+
+try:
+    schema.check_schema()
+except Exception:
+    logger.exception("Could not check the database schema version")
+
+# Cache invalidations made by the other workers (and the command-line
+# tools) on this host reach this one through the shared change counters
+changes.start()
+atexit.register(changes.stop)
+
+# Confirmed submissions go to the local journal and are written in batches
+if WRITE_BEHIND:
+    write_queue.start()
+    atexit.register(write_queue.stop)
+
+# Registered last so it runs first at exit: the thread pools stop taking
+# work and the bcrypt processes are shut down rather than left to linger
+atexit.register(shutdown_workers)
+
+
+def selected_id(value):
+    """
+    This function converts the value of an id-keyed select to an int, or
+    None for placeholder choices such as ``add_new_enrollee``
+    """
+    return int(value) if value and str(value).isdigit() else None
 
-purchase_pending = reactive.value(False)
-payment_pending = reactive.value(False)
+
+def enrollee_search_message(url):
+    """
+    This function builds the update for the enrollee typeahead when the
+    school changes: search the session route at ``url`` and clear the
+    selection, which belongs to the previous school
+    """
+    return {"url": url, "value": ""}
 
 
-# --- DB Connection ---
-def get_connection():
+# --- Shared History Ledger ---
+async def history_version():
     """
-    The function establishes a connection with MYSQL Database
-    with necessary logger
+    This function tops up the shared history store (a small delta query
+    at most every few seconds for the whole worker) and returns its version
     """
+    try:
+        return await run_db(history_store.refresh, heavy=True)
+    except Exception:
+        logger.exception("Error refreshing history store")
+        return history_store.version
+
+
+@reactive.poll(history_version, HISTORY_POLL_SECONDS)
+@timed("poll")
+def history_ledger():
+    return history_store.frame
+
 
+# --- Shared Item List ---
+@reactive.poll(reference.items_version, CHANGES_POLL_SECONDS)
+def item_list_version():
+    """
+    This function changes whenever an item is added, whether by this
+    session, another worker or the write-behind drain once it applies a
+    queued purchase, so every open purchase form reloads its item list
+    """
+    return reference.items_version()
+
+
+# --- Shared Report Rollups ---
+async def rollup_version():
+    """
+    This function fingerprints the rollup tables; the Reports tab reloads
+    them only when a transaction has changed them
+    """
     try:
-        conn = mysql.connector.connect(
-            host=os.getenv("MYSQL_HOST"),
-            user=os.getenv("MYSQL_USER"),
-            password=os.getenv("MYSQL_PASSWORD"),
-            database=os.getenv("MYSQL_DATABASE")
-        )
-        logger.debug("Database connection established")
-        return conn
-    except Exception as e:
-        logger.exception("Database connection error")
-        raise
+        return await run_db(rollups.rollup_version)
+    except Exception:
+        logger.exception("Error polling rollup tables")
+        return None
 
 
+@reactive.poll(rollup_version, REPORT_POLL_SECONDS)
+@timed("poll")
+async def report_rollups():
+    return await run_db(rollups.load_rollups)
+
 
 # --- UI Layout ---
 
@@ -53,7 +165,22 @@ def page_ui():
     """
 
     return ui.navset_card_tab(
-        ui.nav_panel("Task", ui.output_ui("task_form")),
+        ui.nav_panel(
+            "Task",
+            ui.output_ui("task_form"),
+
+            # Bulk import from CSV/Excel
+            ui.card(
+                ui.card_header("Bulk Import"),
+                ui.row(
+                    ui.column(4, ui.input_select("import_kind", "Record Type", ["Payment", "Purchase"])),
+                    ui.column(8, ui.input_file("import_file", "Upload CSV or Excel", accept=[".csv", ".xlsx", ".xls"]))
+                ),
+                ui.input_action_button("run_import", "Import"),
+                ui.output_ui("import_summary"),
+                ui.output_data_frame("import_errors")
+            )
+        ),
 
         ui.nav_panel(
             "History",
@@ -67,7 +194,16 @@ def page_ui():
             # Filter form
             ui.output_ui("filter_form"),
 
-            # History table
+            # History table, one page at a time
+            ui.row(
+                ui.column(3, ui.input_select("history_sort", "Sort", {"DESC": "Newest first", "ASC": "Oldest first"})),
+                ui.column(2, ui.input_select("history_page_size", "Rows per page", PAGE_SIZES, selected=HISTORY_PAGE_SIZE)),
+                ui.column(4, ui.output_text("history_page_info")),
+                ui.column(3,
+                    ui.input_action_button("history_prev", "Previous"),
+                    ui.input_action_button("history_next", "Next"),
+                ),
+            ),
             ui.row(
                 ui.column(12, ui.output_data_frame("history_table"))),
 
@@ -76,6 +212,46 @@ def page_ui():
                 ui.download_button("download_filtered_history", "Download CSV"),
                 style="position: absolute; top: 10px; right: 10px; z-index: 1000;"
             )
+        ),
+
+        ui.nav_panel(
+            "Reconciliation",
+
+            # Reconciliation options
+            ui.row(
+                ui.column(3, ui.input_select("recon_school", "Select School", ["All", "SOML Advanced", "SOML Ordinary", "EFD & Igbaradi"])),
+                ui.column(2, ui.input_numeric("recon_year_from", "From Year", datetime.now().year)),
+                ui.column(2, ui.input_numeric("recon_year_to", "To Year", datetime.now().year)),
+                ui.column(2, ui.input_select("recon_view", "View", ["Summary", "Detail"])),
+                ui.column(3, ui.input_file("fee_schedule_file", "Fee Schedule CSV (optional)", accept=[".csv"]))
+            ),
+            ui.input_checkbox("recon_outstanding_only", "Only show outstanding balances"),
+
+            # Totals and table
+            ui.output_ui("reconciliation_totals"),
+            ui.row(
+                ui.column(12, ui.output_data_frame("reconciliation_table"))),
+
+            ui.download_button("download_reconciliation", "Download CSV")
+        ),
+
+        ui.nav_panel(
+            "Reports",
+
+            # Report options
+            ui.row(
+                ui.column(3, ui.input_select("report_school", "Select School", ["All", "SOML Advanced", "SOML Ordinary", "EFD & Igbaradi"])),
+                ui.column(2, ui.input_numeric("report_year_from", "From Year", datetime.now().year - 2)),
+                ui.column(2, ui.input_numeric("report_year_to", "To Year", datetime.now().year)),
+                ui.column(5, ui.input_select("report_view", "Report", ["Monthly (year over year)", "Fees by School", "Items Purchased"]))
+            ),
+
+            # Chart and pivot table
+            ui.output_plot("report_chart"),
+            ui.row(
+                ui.column(12, ui.output_data_frame("report_table"))),
+
+            ui.download_button("download_report", "Download CSV")
         )
     )
 
@@ -91,6 +267,7 @@ def server(input: Inputs, output: Outputs, session: Session):
 
     @output
     @render.ui
+    @timed("render")
     def main_ui():
         """
         This function display the login functionality
@@ -120,78 +297,90 @@ def server(input: Inputs, output: Outputs, session: Session):
 
     @output
     @render.text
-    def login_message():
+    @reactive.event(input.login_btn)
+    @timed("render")
+    async def login_message():
         """
         This function interact with the backend and ensure that users are logged in properly
-        with all neccessaries logger
+        with all neccessaries logger. It runs only when Log In is clicked, so typing in the
+        fields does not spend login attempts.
         """
-
-        if input.login_btn() > 0:
-            email = input.login_email()
-            password = input.login_password().encode('utf-8')
-            try:
-                conn = get_connection()
-                cursor = conn.cursor(dictionary=True)
-                cursor.execute("SELECT * FROM users WHERE username = %s", (email,))
-                user = cursor.fetchone()
-                if user and bcrypt.checkpw(password, user["password_hash"].encode('utf-8')):
-                    user_session.set(user)
-                    logger.info(f"Login successful for user: {email}")
-                    return "Login successful"
-                else:
-                    logger.warning(f"Login failed for email: {email}")
-                    return "Invalid email or password"
-            except Exception as e:
-                logger.exception(f"Login exception for email: {email}")
-                return "An error occurred during login"
-            finally:
-                cursor.close()
-                conn.close()
-        return ""
+        email = input.login_email()
+        password = input.login_password().encode('utf-8')
+        try:
+            user, message = await authenticate(email, password, client_address(session.http_conn))
+            if user:
+                user_session.set(user)
+                logger.info(f"Login successful for user: {email}")
+            else:
+                logger.warning(f"Login failed for email: {email}")
+            return message
+        except Exception as e:
+            logger.exception(f"Login exception for email: {email}")
+            return "An error occurred during login"
 
     @output
     @render.text
+    @timed("render")
     def user_authenticated():
         return "true" if user_session.get() is not None else "false"
 
     @output
     @render.ui
-    def task_form():
+    @timed("render")
+    async def task_form():
         user = user_session.get()
         if user:
             logger.debug(f"Rendering task form for: {user['username']}")
+        # choices map ids to labels, so the form submits ids and the write path never looks up names
+        school_options = {str(school_id): name for school_id, name in await run_db(reference.get_schools)}
         return ui.TagList(
             ui.row(
             ui.column(6, ui.input_radio_buttons("task_type", "Select Task", ["Payment", "Purchase"])),
-            ui.column(6, ui.input_select("school_type", "School Type", ["SOML Advanced", "SOML Ordinary", "EFD & Igbaradi"]))),
+            ui.column(6, ui.input_select("school_type", "School Type", school_options))),
             ui.output_ui("task_details")
         )
     
+    @timed("route")
+    async def enrollee_search(request):
+        """
+        This function answers the enrollee typeahead with the enrollees of
+        the selected school whose names start with the typed text
+        """
+        school_id = selected_id(input.school_type()) if "school_type" in input else None
+        options = []
+        if school_id:
+            school_name = await run_db(reference.get_school_name, school_id)
+            matches = await run_db(reference.search_enrollees, school_name, request.query_params.get("query", ""))
+            options = [{"value": str(enrollee_id), "label": name} for enrollee_id, name in matches]
+        return JSONResponse(options + [ADD_NEW_ENROLLEE])
+
+    enrollee_search_url = session.dynamic_route("enrollee_search", enrollee_search)
+
     @output
     @render.ui
-    def task_details():
+    @timed("render")
+    async def task_details():
         """"""
         task = input.task_type()
         user_email = user_session.get()['username'] if user_session.get() else 'Unknown'
         
         try:
-            conn = get_connection()
-            cursor = conn.cursor(dictionary=True)
-
-            # Fetch enrollees
-            cursor.execute("SELECT enrollee_id, CONCAT(first_name, ' ', last_name) AS name FROM enrollees")
-            enrollee_options = {row["name"]: row["enrollee_id"] for row in cursor.fetchall()}
-            enrollee_options["➕ Add new enrollee..."] = "add_new_enrollee"
-
-            # Fetch items
-            cursor.execute("SELECT item_id, item_name AS item_name FROM items")
-            item_options = {row["item_name"]: row["item_id"] for row in cursor.fetchall()}
-            item_options["➕ Add new item..."] = "add_new_item"
-            item_options =list(item_options.keys())
+            # Enrollees are searched as the user types; items are few enough to list
+            items = await run_db(reference.get_items)
+            item_options = {str(item_id): item_name for item_id, item_name in items}
+            item_options["add_new_item"] = "➕ Add new item..."
 
             if task == "Payment":
                 return ui.TagList(
-                    ui.input_select("enrollee", "Select Enrollee", choices=enrollee_options),
+                    ui.input_selectize("enrollee", "Select Enrollee", choices=[], options={
+                        "placeholder": "Type a name to search...",
+                        "preload": True,
+                        "loadThrottle": ENROLLEE_SEARCH_DEBOUNCE_MS,
+                        "maxOptions": reference.ENROLLEE_SEARCH_LIMIT + 1,
+                        "load": ui.js_eval(ENROLLEE_LOAD_JS % json.dumps(enrollee_search_url)),
+                        "score": ui.js_eval(ENROLLEE_SCORE_JS),
+                    }),
                     ui.panel_conditional(
                         "input.enrollee == 'add_new_enrollee'",
                         ui.row(
@@ -237,15 +426,25 @@ def server(input: Inputs, output: Outputs, session: Session):
         except Exception as e:
             logger.exception("Error in task_details rendering")
             return ui.div("Error loading form. Please check logs.")
-        
-        finally:
-            cursor.close()
-            conn.close()
+
+    @reactive.calc
+    @timed("calc")
+    async def period_options():
+        """
+        This function lists the periods (month and year paid) present in the
+        ledger as choices for the period filter
+        """
+        if HISTORY_CACHE:
+            return period_choices(await run_db(ledger_periods, history_ledger()))
+        return period_choices(await run_db(load_periods, heavy=True))
 
     @output
     @render.ui
-    def filter_form():
-     
+    @timed("render")
+    async def filter_form():
+        # isolated so that new periods update the selects instead of resetting every filter
+        with reactive.isolate():
+            periods = await period_options()
 
         return ui.TagList(
         ui.row(
@@ -253,106 +452,98 @@ def server(input: Inputs, output: Outputs, session: Session):
         ui.column(3, ui.input_select("filter_school", "Select School", ["All", "SOML Advanced", "SOML Ordinary", "EFD & Igbaradi"])),
         ui.column(3, ui.input_select("filter_type", "Type", ["All", "Payment", "Purchase"])),
         ui.column(3, ui.input_select("filter_fee_type", "Fee Type", choices=["All", "Registration", "Feeding", "Handout"])),
-        #ui.column(2, ui.input_select("filter_period", "Filter by Period", choices=["All"]))  # dynamically updated
-
+        ),
+        ui.row(
+        ui.column(3, ui.input_select("filter_period_start", "Period From", choices=periods)),
+        ui.column(3, ui.input_select("filter_period_end", "Period To", choices=periods)),
         ))
 
     @reactive.Effect
-    def update_enrollees():
+    @timed("effect")
+    async def update_period_choices():
+        choices = await period_options()
+        with reactive.isolate():
+            for input_id in ("filter_period_start", "filter_period_end"):
+                selected = input[input_id]() if input_id in input else "All"
+                ui.update_select(input_id, choices=choices, selected=selected if selected in choices else "All")
+
+    @reactive.Effect
+    @timed("effect")
+    async def update_enrollees():
         school = input.school_type()
         try:
-            if school:
-                conn = get_connection()
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT enrollee_id, CONCAT(first_name, ' ', last_name) as name
-                    FROM enrollees
-                    WHERE school_name = %s
-                """, (school,))
-                results = cursor.fetchall()
-                enrollee_choices = [row[1] for row in results]
-                ui.update_select("enrollee", choices=enrollee_choices)
+            if selected_id(school):
+                # the typeahead clears its options and searches the new school
+                session.send_input_message("enrollee", enrollee_search_message(enrollee_search_url))
                 logger.info(f"Updated enrollee list for school: {school}")
         except Exception as e:
             logger.exception(f"Error updating enrollees for school: {school}")
-        finally:
-            cursor.close()
-            conn.close()
-
-    purchase_pending = reactive.value(False)
-    payment_pending = reactive.value(False)
-
 
     @reactive.Effect
-    def update_items():
+    @timed("effect")
+    async def update_items():
+        item_list_version()
         try:
-            conn = get_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT item_name FROM items")
-            results = cursor.fetchall()
-            item_choices = [row[0] for row in results]
+            item_choices = {str(item_id): item_name for item_id, item_name in await run_db(reference.get_items)}
+            item_choices["add_new_item"] = "➕ Add new item..."
             ui.update_select("item", choices=item_choices)
             logger.info("Updated item list")
         except Exception as e:
             logger.exception("Error updating items")
-        finally:
-            cursor.close()
-            conn.close()
-
-        payment_pending = reactive.value(False)
-        payment_submit_count = reactive.value(0)
-         
-        @reactive.Effect
-        def process_payment():
-            req(input.submit_payment())
-
-            if input.submit_payment() > payment_submit_count.get() and not payment_pending():
-                payment_pending.set(True)
-                payment_submit_count.set(input.submit_payment())
-                ui.modal_show(show_confirmation_dialog("payment"))
-
-            if input.confirm_payment() > 0 and payment_pending():
-                try:
-                    conn = get_connection()
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT enrollee_id FROM enrollees WHERE CONCAT(first_name, ' ', last_name) = %s AND school_name = %s", 
-                                (input.enrollee(), input.school_type()))
-                    enrollee_id = cursor.fetchone()
-                    cursor.execute("SELECT school_id FROM school_types WHERE school_name = %s", (input.school_type(),))
-                    school_id = cursor.fetchone()
-
-                    if enrollee_id and school_id:
-                        cursor.execute("""
-                            INSERT INTO payments (enrollee_id, fee_type, amount, month_paid, year_paid, school_id, created_at)
-                            VALUES (%s, %s, %s, %s, %s, %s, NOW())
-                        """, (enrollee_id[0], input.fee_type(), input.amount(), input.month(), input.year_paid(), school_id[0]))
-                        conn.commit()
-                        ui.notification_show("Payment successfully recorded!", type="success")
-                    else:
-                        logger.error("Invalid enrollee or school name.")
-                except Exception as e:
-                    logger.exception("Error processing payment")
-                finally:
-                    cursor.close()
-                    conn.close()
-                    ui.modal_remove()
-                    payment_pending.set(False)
-
-            if input.cancel_payment() > 0 and payment_pending():
-                payment_pending.set(False)
-                print(f"Before Cancel - payment_submit_count: {payment_submit_count.get()}")
-                payment_submit_count.set(input.submit_payment() - 1)
-                print(f"After Cancel - payment_submit_count: {payment_submit_count.get()}")
-                #payment_submit_count.set(-1)
 
+    payment_pending = reactive.value(False)
+    payment_submit_count = reactive.value(0)
+     
+    @reactive.Effect
+    @timed("effect")
+    async def process_payment():
+        req(input.submit_payment())
+
+        if input.submit_payment() > payment_submit_count.get() and not payment_pending():
+            payment_pending.set(True)
+            payment_submit_count.set(input.submit_payment())
+            ui.modal_show(show_confirmation_dialog("payment"))
+
+        if input.confirm_payment() > 0 and payment_pending():
+            try:
+                enrollee_id = selected_id(input.enrollee())
+                school_id = selected_id(input.school_type())
+                new_enrollee = None
+                if input.enrollee() == "add_new_enrollee" and school_id:
+                    first_name, last_name = input.first_name().strip(), input.last_name().strip()
+                    if first_name and last_name:
+                        school_name = await run_db(reference.get_school_name, school_id)
+                        new_enrollee = (first_name, last_name, school_name)
+
+                if (enrollee_id or new_enrollee) and school_id:
+                    submit = write_queue.submit_payment if WRITE_BEHIND else record_payment
+                    await run_db(submit, enrollee_id, input.fee_type(), input.amount(),
+                                 input.month(), input.year_paid(), school_id, new_enrollee=new_enrollee)
+                    ui.notification_show("Payment successfully recorded!", type="success")
+                else:
+                    logger.error(f"Invalid enrollee or school selection: {input.enrollee()!r}, {input.school_type()!r}")
+            except Exception as e:
+                logger.exception("Error processing payment")
+            finally:
                 ui.modal_remove()
+                payment_pending.set(False)
+
+        if input.cancel_payment() > 0 and payment_pending():
+            payment_pending.set(False)
+            print(f"Before Cancel - payment_submit_count: {payment_submit_count.get()}")
+            payment_submit_count.set(input.submit_payment() - 1)
+            print(f"After Cancel - payment_submit_count: {payment_submit_count.get()}")
+            #payment_submit_count.set(-1)
+
+            ui.modal_remove()
 
 
 
     purchase_pending = reactive.value(False)
     purchase_submit_count = reactive.value(0)
     @reactive.Effect
-    def process_purchase():
+    @timed("effect")
+    async def process_purchase():
         req(input.submit_purchase())
 
         # Detect a new submit (only when button clicked newly)
@@ -364,24 +555,22 @@ def server(input: Inputs, output: Outputs, session: Session):
         # Confirm purchase
         if input.confirm_purchase() > 0 and purchase_pending():
             try:
-                conn = get_connection()
-                cursor = conn.cursor()
-                cursor.execute("""
-                    INSERT INTO purchases (item_id, quantity, amount, school_id, month_paid, year_paid, created_at)
-                    VALUES (
-                        (SELECT item_id FROM items WHERE item_name = %s), %s, %s,
-                        (SELECT school_id FROM school_types WHERE school_name = %s), %s, %s,
-                        NOW()
-                    )
-                """, (input.item(), input.quantity(), input.amount(), input.school_type(),
-                    input.month(), input.year_paid()))
-                conn.commit()
-                ui.notification_show("Purchased Item successfully recorded!", type="success")
+                item_id = selected_id(input.item())
+                school_id = selected_id(input.school_type())
+                new_item = None
+                if input.item() == "add_new_item" and input.new_item_name().strip():
+                    new_item = input.new_item_name().strip()
+
+                if (item_id or new_item) and school_id:
+                    submit = write_queue.submit_purchase if WRITE_BEHIND else record_purchase
+                    await run_db(submit, item_id, input.quantity(), input.amount(), school_id,
+                                 input.month(), input.year_paid(), new_item=new_item)
+                    ui.notification_show("Purchased Item successfully recorded!", type="success")
+                else:
+                    logger.error(f"Invalid item or school selection: {input.item()!r}, {input.school_type()!r}")
             except Exception as e:
                 logger.exception("Error processing purchase")
             finally:
-                cursor.close()
-                conn.close()
                 ui.modal_remove()
                 purchase_pending.set(False)
 
@@ -392,6 +581,54 @@ def server(input: Inputs, output: Outputs, session: Session):
 
             ui.modal_remove()
 
+    import_result = reactive.value(None)
+
+    @reactive.Effect
+    @reactive.event(input.run_import)
+    @timed("effect")
+    async def run_bulk_import():
+        """
+        This function imports the uploaded file of payments or purchases
+        in batched transactions and keeps the per-row report for display
+        """
+        files = input.import_file()
+        if not files:
+            ui.notification_show("Choose a CSV or Excel file to import.", type="warning")
+            return
+
+        kind = "payments" if input.import_kind() == "Payment" else "purchases"
+        upload = files[0]
+        try:
+            result = await run_db(import_file, upload["datapath"], kind, filename=upload["name"], heavy=True)
+            import_result.set(result)
+            ui.notification_show(
+                f"Imported {result['inserted']} of {result['total']} {kind}.",
+                type="success" if result["rejected"] == 0 else "warning"
+            )
+        except Exception as e:
+            logger.exception(f"Error importing {kind} from {upload['name']}")
+            ui.notification_show(f"Import failed: {e}", type="error")
+
+    @output
+    @render.ui
+    @timed("render")
+    def import_summary():
+        result = import_result.get()
+        if result is None:
+            return None
+        return ui.p(
+            f"{result['inserted']} of {result['total']} {result['kind']} imported, "
+            f"{result['rejected']} rejected ({result['seconds']:.1f}s)."
+        )
+
+    @output
+    @render.data_frame
+    @timed("render")
+    def import_errors():
+        result = import_result.get()
+        req(result is not None and not result["errors"].empty)
+        return result["errors"]
+
     def show_confirmation_dialog(action):
         return ui.modal(
             f"Are you sure you want to submit this {action}?",
@@ -404,78 +641,106 @@ def server(input: Inputs, output: Outputs, session: Session):
         )
     
     @reactive.calc
-    def filtered_history_df():
-        """"""
+    @timed("calc")
+    def current_history_filters():
+        return history_filters(
+            filter_date=input.filter_date(),
+            filter_school=input.filter_school(),
+            filter_type=input.filter_type(),
+            filter_fee_type=input.filter_fee_type(),
+            filter_period_start=input.filter_period_start(),
+            filter_period_end=input.filter_period_end(),
+        )
+
+    @reactive.calc
+    @timed("calc")
+    def history_query():
+        return current_history_filters(), input.history_sort(), int(input.history_page_size())
+
+    # the cursors of the pages visited so far for one query; the last one is the current page
+    history_cursors = reactive.value((None, [None]))
+
+    def visited_cursors():
+        query, cursors = history_cursors.get()
+        return cursors if query == history_query() else [None]
+
+    @reactive.calc
+    @timed("calc")
+    async def history_page():
+        """
+        This function fetches the current page of the History table, from the
+        shared in-memory ledger or, with HISTORY_CACHE=0, with a keyset query
+        that reads only the rows of the page
+        """
+        filters, order, page_size = history_query()
+        cursor = visited_cursors()[-1]
         try:
-            logger.info("Rendering history table")
-            conn = get_connection()
-            cursor = conn.cursor(dictionary=True)
-            query = """
-                SELECT 'Payment' as Type, CONCAT(first_name, ' ', last_name) AS Name, amount AS Amount, fee_type AS Category, CONCAT(month_paid, ' ', year_paid) AS Period, created_at, school_id FROM payments p
-                JOIN enrollees e ON p.enrollee_id = e.enrollee_id
-                UNION ALL
-                SELECT 'Purchase' as Type, item_name AS Item, amount AS Amount, quantity AS Quantity, CONCAT(month_paid, ' ', year_paid) AS Period, created_at, school_id FROM purchases pu
-                JOIN items e ON pu.item_id = e.item_id
-            """
-            cursor.execute(query)
-            rows = cursor.fetchall()
-            column_names = [i[0] for i in cursor.description]
-            df = pd.DataFrame(rows, columns=column_names)
-
-            if input.filter_date():
-                start_date, end_date = input.filter_date()
-                end_date = pd.to_datetime(end_date) + pd.Timedelta(days=1)  # inclusive end
-                df['created_at'] = pd.to_datetime(df['created_at'])
-                df = df[(df['created_at'] >= pd.to_datetime(start_date)) & (df['created_at'] <= pd.to_datetime(end_date))]
-            
-            # Filter by fee_type (for Payment only)
-            if input.filter_fee_type() != "All":
-                df = df[(df['Type'] == "Payment") & (df['Category'] == input.filter_fee_type())]
-
-            if input.filter_school() != "All":
-                cursor.execute("SELECT school_id FROM school_types WHERE school_name = %s", (input.filter_school(),))
-                school_id = cursor.fetchone()['school_id']
-                df = df[df['school_id'] == school_id]
-            
-            # if input.filter_period() != "All":
-                # st_date, e_date = df['Period'].min(), df['Period'].max() #input.filter_period()
-                # e_date = pd.to_datetime(e_date) + pd.Timedelta(days=1) 
-                # df = df[(df['Period'] >= pd.to_datetime(st_date)) & (df['Period'] <= pd.to_datetime(e_date))]
-
-                # st_date, e_date = input.filter_period()
-                # e_date = pd.to_datetime(e_date) + pd.Timedelta(days=1) 
-                # #selected_period = pd.to_datetime(input.filter_period(), format="%B %Y", errors='coerce')
-                # df['Period'] = pd.to_datetime(df['Period'], format="%B %Y", errors='coerce')  # First of the month
-                # df = df[(df['Period'] >= pd.to_datetime(st_date)) & (df['Period'] <= pd.to_datetime(e_date))]
-                
-
-                #df = df[df['Period'] == selected_period]
-
-            if input.filter_type() != "All":
-                df = df[df['Type'] == input.filter_type()]
-            df = df.sort_values(by="created_at", ascending=False)
-
-            return df.drop(columns=['school_id'])
+            if HISTORY_CACHE:
+                return await run_db(page_history, history_ledger(), cursor, page_size, order, **filters)
+            return await run_db(load_history_page, cursor, page_size, order, **filters)
         except Exception as e:
-            logger.exception("Error rendering history table")
-            return pd.DataFrame()
-        finally:
-            cursor.close()
-            conn.close()
+            logger.exception("Error loading history page")
+            return pd.DataFrame(), None
 
+    @reactive.calc
+    @timed("calc")
+    async def history_summary():
+        """
+        This function counts and totals the rows matching the current filters
+        with aggregate queries, separately from the page itself
+        """
+        filters = current_history_filters()
+        try:
+            if HISTORY_CACHE:
+                return await run_db(history_totals, history_ledger(), **filters)
+            return await run_db(load_history_totals, heavy=True, **filters)
+        except Exception as e:
+            logger.exception("Error totalling history")
+            return None
 
+    @reactive.Effect
+    @reactive.event(input.history_next)
+    @timed("effect")
+    async def next_history_page():
+        _, next_cursor = await history_page()
+        if next_cursor is not None:
+            history_cursors.set((history_query(), visited_cursors() + [next_cursor]))
+
+    @reactive.Effect
+    @reactive.event(input.history_prev)
+    @timed("effect")
+    def previous_history_page():
+        cursors = visited_cursors()
+        if len(cursors) > 1:
+            history_cursors.set((history_query(), cursors[:-1]))
 
     @output
     @render.data_frame
-    def history_table():
-        return filtered_history_df()
+    @timed("render")
+    async def history_table():
+        page, _ = await history_page()
+        return page
 
+    @output
+    @render.text
+    @timed("render")
+    async def history_page_info():
+        page, _ = await history_page()
+        summary = await history_summary()
+        first = (len(visited_cursors()) - 1) * history_query()[2]
+        if summary is None:
+            return ""
+        count = summary["Payment"]["count"] + summary["Purchase"]["count"]
+        if not len(page):
+            return f"No rows of {count:,}"
+        return f"Rows {first + 1:,}–{first + len(page):,} of {count:,}"
 
     @output
     @render.ui
-    def total_payment_card():
-        df = filtered_history_df()
-        total_payment = df[df['Type'] == 'Payment']['Amount'].sum()
+    @timed("render")
+    async def total_payment_card():
+        summary = await history_summary()
+        total_payment = summary["Payment"]["amount_kobo"] / 100 if summary else 0
         return ui.card(
             ui.h4("Total Payment Made"),
             ui.h3(f"₦{total_payment:,.2f}", class_="text-success")
@@ -484,9 +749,10 @@ def server(input: Inputs, output: Outputs, session: Session):
 
     @output
     @render.ui
-    def total_purchase_card():
-        df = filtered_history_df()
-        total_purchase = df[df['Type'] == 'Purchase']['Amount'].sum()
+    @timed("render")
+    async def total_purchase_card():
+        summary = await history_summary()
+        total_purchase = summary["Purchase"]["amount_kobo"] / 100 if summary else 0
         return ui.card(
             ui.h4("Total Items Purchased Cost"),
             ui.h3(f"₦{total_purchase:,.2f}", class_="text-warning")
@@ -494,10 +760,127 @@ def server(input: Inputs, output: Outputs, session: Session):
     
     @output
     @render.download(filename="Report.csv")
-    def download_filtered_history():
-        df = filtered_history_df()
+    @timed("render")
+    async def download_filtered_history():
+        """
+        This function streams the filtered history as CSV straight from the
+        database in fixed-size chunks instead of building the whole file first
+        """
+        filters = current_history_filters()
+        async for chunk in iterate_in_thread(stream_history_csv(chunk_size=EXPORT_CHUNK_SIZE, **filters)):
+            yield chunk
+
+    @reactive.calc
+    @timed("calc")
+    async def reconciliation_result():
+        """
+        This function reconciles expected fees against recorded payments
+        for the selected school and years, using the uploaded fee schedule
+        when one is given and the fee_schedule table otherwise
+        """
+        year_from, year_to = input.recon_year_from(), input.recon_year_to()
+        req(year_from and year_to and year_from <= year_to)
+        school = None if input.recon_school() == "All" else input.recon_school()
+        files = input.fee_schedule_file()
+        try:
+            schedule = await run_db(read_fee_schedule, files[0]["datapath"]) if files else None
+            return await run_db(reconcile_years, int(year_from), int(year_to), school, schedule, heavy=True)
+        except Exception as e:
+            logger.exception("Error running reconciliation")
+            ui.notification_show(f"Reconciliation failed: {e}", type="error")
+            return None
+
+    @reactive.calc
+    @timed("calc")
+    async def reconciliation_df():
+        result = await reconciliation_result()
+        req(result is not None)
+        df = summary_view(result) if input.recon_view() == "Summary" else detail_view(result)
+        if input.recon_outstanding_only():
+            df = df[df["Outstanding"] > 0]
+        return df
+
+    @output
+    @render.ui
+    @timed("render")
+    async def reconciliation_totals():
+        result = await reconciliation_result()
+        req(result is not None)
+        totals = result[["expected", "paid", "outstanding", "overpaid"]].sum() / 100
+        return ui.row(
+            ui.column(3, ui.card(ui.h4("Expected"), ui.h3(f"₦{totals['expected']:,.2f}"))),
+            ui.column(3, ui.card(ui.h4("Paid"), ui.h3(f"₦{totals['paid']:,.2f}", class_="text-success"))),
+            ui.column(3, ui.card(ui.h4("Outstanding"), ui.h3(f"₦{totals['outstanding']:,.2f}", class_="text-danger"))),
+            ui.column(3, ui.card(ui.h4("Overpaid"), ui.h3(f"₦{totals['overpaid']:,.2f}", class_="text-warning")))
+        )
+
+    @output
+    @render.data_frame
+    @timed("render")
+    async def reconciliation_table():
+        return await reconciliation_df()
+
+    @output
+    @render.download(filename="Reconciliation.csv")
+    @timed("render")
+    async def download_reconciliation():
+        df = await reconciliation_df()
+        yield df.to_csv(index=False)
+
+    @reactive.calc
+    @timed("calc")
+    async def report_df():
+        """
+        This function pivots the monthly rollups (never the raw ledger) for
+        the selected school and years into the selected report
+        """
+        year_from, year_to = input.report_year_from(), input.report_year_to()
+        req(year_from and year_to and year_from <= year_to)
+        school = None if input.report_school() == "All" else input.report_school()
+        totals = await report_rollups()
+        payments = rollups.select_totals(totals["payments"], year_from, year_to, school)
+        purchases = rollups.select_totals(totals["purchases"], year_from, year_to, school)
+        view = input.report_view()
+        if view == "Fees by School":
+            return rollups.fees_by_school_view(payments)
+        if view == "Items Purchased":
+            return rollups.items_view(purchases)
+        return rollups.monthly_view(payments, purchases)
+
+    @output
+    @render.plot(alt="Chart of the selected report")
+    @timed("render")
+    async def report_chart():
+        df = await report_df()
+        req(len(df))
+        view = input.report_view()
+        fig = Figure(figsize=(10, 4), layout="tight")
+        ax = fig.subplots()
+        if view == "Fees by School":
+            df.set_index("School").drop(columns="Total").plot.bar(ax=ax, rot=0)
+        elif view == "Items Purchased":
+            df.set_index("Item")["Total"].iloc[::-1].plot.barh(ax=ax, legend=True)
+        else:
+            df.set_index("Month").plot(ax=ax, marker="o")
+            ax.set_xticks(range(12), [month[:3] for month in df["Month"]])
+        ax.set_ylabel("Amount (₦)")
+        ax.legend(loc="center left", bbox_to_anchor=(1, 0.5))
+        ax.yaxis.set_major_formatter("{x:,.0f}")
+        return fig
+
+    @output
+    @render.data_frame
+    @timed("render")
+    async def report_table():
+        return await report_df()
+
+    @output
+    @render.download(filename="Report Summary.csv")
+    @timed("render")
+    async def download_report():
+        df = await report_df()
         yield df.to_csv(index=False)
 
 
 
-app = App(app_ui, server)
\ No newline at end of file
+app = with_metrics_route(with_affinity_cookie(App(app_ui, server)))
\ No newline at end of file
@@ -0,0 +1,656 @@
+#  --- Parquet Archive of Closed Years ---
+import os
+import sys
+import time
+import uuid
+import logging
+import argparse
+import threading
+from datetime import date
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from changes import changes
+from db import get_connection
+from metrics import registry
+from reference import MONTHS
+
+
+logger = logging.getLogger("ShinyAppLogger")
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_MANIFEST_SECONDS = float(os.getenv("ARCHIVE_MANIFEST_SECONDS", "5"))
+ARCHIVE_DELETE_CHUNK = 1000
+
+# ledger table -> (Type, primary key, snapshot query). Names are resolved at
+# archiving time, so a later rename does not reach the archived rows.
+LEDGERS = {
+    "payments": ("Payment", "payment_id", """
+        SELECT p.payment_id, p.enrollee_id, CONCAT(e.first_name, ' ', e.last_name), p.fee_type, p.amount,
+               p.month_paid, p.year_paid, p.created_at, p.school_id, st.school_name
+        FROM payments p
+        JOIN enrollees e ON p.enrollee_id = e.enrollee_id
+        JOIN school_types st ON st.school_id = p.school_id
+        WHERE p.year_paid = %s
+    """),
+    "purchases": ("Purchase", "purchase_id", """
+        SELECT pu.purchase_id, pu.item_id, i.item_name, pu.quantity, pu.amount,
+               pu.month_paid, pu.year_paid, pu.created_at, pu.school_id, st.school_name
+        FROM purchases pu
+        JOIN items i ON pu.item_id = i.item_id
+        JOIN school_types st ON st.school_id = pu.school_id
+        WHERE pu.year_paid = %s
+    """),
+}
+
+SNAPSHOT_COLUMNS = ["id", "ref_id", "Name", "Category", "Amount", "month_paid", "year_paid", "created_at",
+                    "school_id", "School"]
+
+MANIFEST_SQL = """
+    SELECT path, ledger, year_paid, school_id, school_name, row_count, amount, archived_at
+    FROM archive_files
+"""
+
+MANIFEST_INSERT = """
+    INSERT INTO archive_files (path, ledger, year_paid, school_id, school_name, row_count, amount, archived_at)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, NOW())
+"""
+
+MANIFEST_COLUMNS = ["path", "ledger", "year_paid", "school_id", "school_name", "row_count", "amount", "archived_at"]
+
+# one schema for both ledgers; ref_id is the enrollee or item id and
+# Category the fee type or quantity
+ARCHIVE_SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("ref_id", pa.int64()),
+    ("Name", pa.string()),
+    ("Category", pa.string()),
+    ("amount_kobo", pa.int64()),
+    ("month_paid", pa.string()),
+    ("month", pa.int32()),
+    ("year_paid", pa.int32()),
+    ("created_at", pa.timestamp("us")),
+    ("school_id", pa.int32()),
+    ("School", pa.string()),
+])
+
+
+# --- Manifest ---
+_manifest_lock = threading.Lock()
+_manifest = {"files": [], "loaded_at": None, "warned": False}
+
+
+def manifest(max_age=None):
+    """
+    The function returns the rows of archive_files, the list of archived
+    Parquet files, as dicts, re-reading it when older than ARCHIVE_MANIFEST_SECONDS.
+    A file is only read once its row is committed, in the same transaction
+    that deletes its rows from the live tables, so no row is seen twice.
+    """
+    max_age = ARCHIVE_MANIFEST_SECONDS if max_age is None else max_age
+    with _manifest_lock:
+        loaded_at = _manifest["loaded_at"]
+        if loaded_at is not None and time.monotonic() - loaded_at < max_age:
+            return _manifest["files"]
+        try:
+            with get_connection() as conn, conn.cursor() as cursor:
+                cursor.execute(MANIFEST_SQL)
+                rows = cursor.fetchall()
+        except Exception:
+            # a database without migration 6 has nothing archived
+            if not _manifest["warned"]:
+                logger.warning("Could not read archive_files; reading the live tables only", exc_info=True)
+                _manifest["warned"] = True
+            rows = []
+        files = [dict(zip(MANIFEST_COLUMNS, row)) for row in rows]
+        for entry in files:
+            entry["year_paid"] = int(entry["year_paid"])
+        _manifest.update(files=files, loaded_at=time.monotonic())
+        return files
+
+
+def invalidate(broadcast=True):
+    """The function makes the next read re-load the manifest, here and with ``broadcast`` in the other workers."""
+    with _manifest_lock:
+        _manifest["loaded_at"] = None
+    if broadcast:
+        changes.publish("archive")
+
+
+changes.subscribe("archive", lambda: invalidate(broadcast=False))
+
+
+def version():
+    """The function returns a fingerprint of the manifest that changes whenever a year is archived."""
+    files = manifest()
+    return len(files), max((str(entry["archived_at"]) for entry in files), default=None)
+
+
+def archived():
+    """The function tells whether any rows have been archived."""
+    return len(manifest()) > 0
+
+
+def archived_years():
+    return sorted({entry["year_paid"] for entry in manifest()})
+
+
+def _files(ledger, years=(None, None), school=None):
+    """
+    The function prunes the manifest down to the files of ``ledger`` that
+    can hold rows of the ``years`` range and ``school``, the year and school
+    partitions, and returns their absolute paths.
+    """
+    first, last = years
+    return [
+        os.path.join(ARCHIVE_DIR, entry["path"]) for entry in manifest()
+        if entry["ledger"] == ledger
+        and (first is None or entry["year_paid"] >= first)
+        and (last is None or entry["year_paid"] <= last)
+        and (school is None or entry["school_name"] == school)
+    ]
+
+
+# Parquet path -> the partition as an Arrow table backed by a memory map
+_mapped = {}
+_mapped_lock = threading.Lock()
+
+
+def _mapped_table(path):
+    """
+    The function maps a partition into memory. Parquet is compressed, so
+    next to each file the archive keeps an uncompressed Arrow IPC copy that
+    is read without decoding or copying; archived files never change, so
+    the mapping is kept. A missing copy, e.g. after restoring the Parquet
+    files alone, is rebuilt from the Parquet file.
+    """
+    table = _mapped.get(path)
+    if table is not None:
+        return table
+    with _mapped_lock:
+        if path not in _mapped:
+            mapped = path[:-len(".parquet")] + ".arrow"
+            if not os.path.exists(mapped):
+                _write_mapped(pq.read_table(path, schema=ARCHIVE_SCHEMA), mapped)
+            _mapped[path] = pa.ipc.open_file(pa.memory_map(mapped)).read_all()
+        return _mapped[path]
+
+
+def _scan(ledger, expression=None, columns=None, years=(None, None), school=None):
+    """The function returns the matching rows of the pruned partitions as an Arrow table, or None."""
+    files = _files(ledger, years, school)
+    if not files:
+        return None
+    table = pa.concat_tables([_mapped_table(path) for path in files])
+    if expression is not None:
+        table = table.filter(expression)
+    return table.select(columns) if columns else table
+
+
+# --- History Filters ---
+def _sides(txn_type=None, fee_type=None):
+    """The function lists the ledgers the History filters leave in, like queries._history_sides."""
+    sides = []
+    if txn_type in (None, "Payment"):
+        sides.append("payments")
+    # the fee type filter only applies to payments
+    if txn_type in (None, "Purchase") and fee_type is None:
+        sides.append("purchases")
+    return sides
+
+
+def _expression(start_date=None, end_date=None, school=None, fee_type=None, period_start=None, period_end=None):
+    """
+    The function turns the History filters into an Arrow filter expression
+    (None for no filter) and the ``(first, last)`` year range that prunes
+    the year partitions.
+    """
+    conditions = []
+    if start_date is not None:
+        conditions.append(ds.field("created_at") >= pd.Timestamp(start_date).to_pydatetime())
+    if end_date is not None:
+        # inclusive end: everything up to midnight of the following day
+        conditions.append(ds.field("created_at") <= (pd.Timestamp(end_date) + pd.Timedelta(days=1)).to_pydatetime())
+    if school is not None:
+        conditions.append(ds.field("School") == school)
+    if fee_type is not None:
+        conditions.append(ds.field("Category") == fee_type)
+    period = ds.field("year_paid") * 12 + ds.field("month") - 1
+    if period_start is not None:
+        conditions.append(period >= period_start)
+    if period_end is not None:
+        conditions.append(period <= period_end)
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    years = (
+        period_start // 12 if period_start is not None else None,
+        period_end // 12 if period_end is not None else None,
+    )
+    return expression, years
+
+
+def _cursor_bounds(table, txn, cursor, order):
+    """
+    The function returns the ``[start, stop)`` slice of a partition, held
+    in ``(created_at, id)`` order, that comes after ``cursor`` in ``order``:
+    the same rows as _keyset_predicate, found by binary search.
+    """
+    if cursor is None:
+        return 0, table.num_rows
+    created_at, cursor_type, cursor_id = cursor
+    stamps = table.column("created_at").to_numpy()
+    stamp = np.datetime64(pd.Timestamp(created_at), "us")
+    low, high = np.searchsorted(stamps, stamp, "left"), np.searchsorted(stamps, stamp, "right")
+    if txn == cursor_type:
+        ties = table.column("id").slice(low, high - low).to_numpy()
+        split = low + int(np.searchsorted(ties, cursor_id, "left" if order == "DESC" else "right"))
+    else:
+        include_ties = (txn < cursor_type) == (order == "DESC")
+        split = (high if include_ties else low) if order == "DESC" else (low if include_ties else high)
+    return (0, int(split)) if order == "DESC" else (int(split), table.num_rows)
+
+
+def _partition_page(table, expression, start, stop, count, order):
+    """
+    The function returns up to ``count`` rows of ``[start, stop)`` matching
+    ``expression``, nearest the cursor. The filter runs on a window next
+    to the cursor that grows until it holds enough matches, so a page
+    does not filter the whole partition.
+    """
+    window = count
+    while True:
+        if order == "DESC":
+            first, last = max(start, stop - window), stop
+        else:
+            first, last = start, min(stop, start + window)
+        part = table.slice(first, last - first)
+        if expression is not None:
+            part = part.filter(expression)
+        if part.num_rows >= count or (first, last) == (start, stop):
+            return part.slice(max(part.num_rows - count, 0)) if order == "DESC" else part.slice(0, count)
+        window *= 8
+
+
+def _amounts(kobo):
+    """The function turns kobo into two-place Decimals, as MySQL returns DECIMAL(12, 2) amounts."""
+    return [Decimal(int(value)).scaleb(-2) for value in kobo]
+
+
+def _amount_text(kobo):
+    """
+    The function formats kobo as the text of two-place Decimals ("1500.00",
+    "-0.05") in Arrow, for CSV export without a Python object per row
+    """
+    whole = pc.cast(pc.divide(pc.abs(kobo), 100), pa.string())
+    cents = pc.utf8_lpad(pc.cast(pc.subtract(pc.abs(kobo), pc.multiply(pc.divide(pc.abs(kobo), 100), 100)), pa.string()), 2, "0")
+    sign = pc.if_else(pc.less(kobo, 0), "-", "")
+    return pc.binary_join_element_wise(pc.binary_join_element_wise(sign, whole, ""), cents, ".")
+
+
+def _history_frame(txn, table, as_text=False):
+    """
+    The function builds the History columns, plus id, from an Arrow table of
+    archived rows; with ``as_text`` the amounts are formatted text, as CSV writes them
+    """
+    periods = pc.binary_join_element_wise(table.column("month_paid"), pc.cast(table.column("year_paid"), pa.string()), " ")
+    kobo = table.column("amount_kobo")
+    return pd.DataFrame({
+        "Type": txn,
+        "Name": table.column("Name").to_pandas(),
+        "Amount": _amount_text(kobo).to_pandas() if as_text else _amounts(kobo.to_numpy()),
+        "Category": table.column("Category").to_pandas(),
+        "Period": periods.to_pandas(),
+        "created_at": table.column("created_at").to_pandas(),
+        "id": table.column("id").to_pandas(),
+    })
+
+
+HISTORY_READ = ["id", "Name", "Category", "amount_kobo", "month_paid", "year_paid", "created_at"]
+
+
+def history_page(cursor=None, page_size=50, order="DESC", txn_type=None, fee_type=None, **filters):
+    """
+    The function reads the archived rows of one History page: at most
+    ``page_size + 1`` rows per side after ``cursor`` in ``order``, as dicts
+    with the History columns and id like the live rows, for
+    load_history_page to merge with them
+    """
+    if not archived():
+        return []
+    order = "ASC" if order.upper() == "ASC" else "DESC"
+    expression, years = _expression(fee_type=fee_type, **filters)
+    direction = "descending" if order == "DESC" else "ascending"
+    rows = []
+    for ledger in _sides(txn_type, fee_type):
+        txn = LEDGERS[ledger][0]
+        parts = []
+        for path in _files(ledger, years, filters.get("school")):
+            table = _mapped_table(path)
+            start, stop = _cursor_bounds(table, txn, cursor, order)
+            parts.append(_partition_page(table, expression, start, stop, page_size + 1, order))
+        if not parts:
+            continue
+        table = pa.concat_tables(parts).sort_by([("created_at", direction), ("id", direction)])
+        for row in table.slice(0, page_size + 1).to_pylist():
+            rows.append({
+                "Type": txn,
+                "Name": row["Name"],
+                "Amount": Decimal(row["amount_kobo"]).scaleb(-2),
+                "Category": row["Category"],
+                "Period": f"{row['month_paid']} {row['year_paid']}",
+                "created_at": row["created_at"],
+                "id": row["id"],
+            })
+    return rows
+
+
+def _read_back(reader, expression, chunk_size):
+    """
+    The function reads the window of a partition just before the rows
+    already read and adds its matching rows to the front of the buffer.
+    The window starts small and grows, so partitions whose rows are not due
+    yet hold little.
+    """
+    start = max(reader["stop"] - reader["window"], 0)
+    part = reader["table"].slice(start, reader["stop"] - start)
+    if expression is not None:
+        part = part.filter(expression)
+    reader["buffer"] = pa.concat_tables([part.select(HISTORY_READ), reader["buffer"]])
+    reader["stop"] = start
+    reader["window"] = min(reader["window"] * 8, chunk_size)
+
+
+def iter_history(chunk_size=5000, as_text=False, txn_type=None, fee_type=None, **filters):
+    """
+    The function streams the archived rows matching the History filters,
+    newest first, as DataFrames of at most ``chunk_size`` rows with the
+    History columns and id.
+
+    Each pruned partition, held oldest first, is read backwards in growing
+    windows and the partitions are merged by timestamp: a row is yielded
+    once no unread row of any partition can be newer, so memory stays at a
+    window per partition however many rows match. Rows with equal
+    timestamps come in partition order, oldest id first.
+    """
+    if not archived():
+        return
+    expression, years = _expression(fee_type=fee_type, **filters)
+    readers = []
+    for ledger in _sides(txn_type, fee_type):
+        for path in _files(ledger, years, filters.get("school")):
+            table = _mapped_table(path)
+            readers.append({"txn": LEDGERS[ledger][0], "table": table, "stop": table.num_rows,
+                            "window": min(64, chunk_size), "buffer": table.select(HISTORY_READ).slice(0, 0)})
+
+    while True:
+        for reader in readers:
+            while reader["stop"] and not reader["buffer"].num_rows:
+                _read_back(reader, expression, chunk_size)
+        # unread rows are no newer than the oldest buffered row of their partition
+        unread = [reader for reader in readers if reader["stop"]]
+        bound = max((reader["buffer"].column("created_at")[0].value for reader in unread), default=None)
+
+        parts = []
+        for reader in readers:
+            buffer = reader["buffer"]
+            keep = 0
+            if bound is not None:
+                stamps = buffer.column("created_at").to_numpy()
+                keep = int(np.searchsorted(stamps, np.datetime64(bound, "us"), "right"))
+            if keep < buffer.num_rows:
+                parts.append(_history_frame(reader["txn"], buffer.slice(keep), as_text))
+                reader["buffer"] = buffer.slice(0, keep)
+        if parts:
+            frame = pd.concat(parts, ignore_index=True)
+            frame = frame.sort_values("created_at", ascending=False, kind="stable").reset_index(drop=True)
+            for start in range(0, len(frame), chunk_size):
+                yield frame.iloc[start:start + chunk_size].reset_index(drop=True)
+        if bound is None:
+            return
+        # rows at the bound wait until the partitions that may hold more of them have been read further
+        for reader in unread:
+            if reader["buffer"].column("created_at")[0].value == bound:
+                _read_back(reader, expression, chunk_size)
+
+
+def history_rows(txn_type=None, fee_type=None, **filters):
+    """
+    The function reads every archived row matching the History filters,
+    newest first, as a DataFrame with the History columns and id, or None.
+    """
+    frames = list(iter_history(txn_type=txn_type, fee_type=fee_type, **filters))
+    if not frames:
+        return None
+    return pd.concat(frames, ignore_index=True)
+
+
+def history_totals(txn_type=None, fee_type=None, **filters):
+    """
+    The function counts and sums the archived rows matching the History
+    filters per transaction type, reading only the amount column.
+    Returns ``{Type: {"count": rows, "amount_kobo": total}}``.
+    """
+    totals = {}
+    if not archived():
+        return totals
+    expression, years = _expression(fee_type=fee_type, **filters)
+    for ledger in _sides(txn_type, fee_type):
+        table = _scan(ledger, expression, ["amount_kobo"], years, filters.get("school"))
+        if table is None:
+            continue
+        total = pc.sum(table.column("amount_kobo")).as_py() or 0
+        totals[LEDGERS[ledger][0]] = {"count": table.num_rows, "amount_kobo": int(total)}
+    return totals
+
+
+def ledger_rows():
+    """
+    The function reads every archived row in the columns of the history
+    store's ledger query (history_store.QUERY_COLUMNS), for its full load.
+    """
+    frames = []
+    for ledger, (txn, _, _) in LEDGERS.items():
+        table = _scan(ledger, columns=[
+            "id", "Name", "amount_kobo", "Category", "month_paid", "year_paid", "created_at", "School"
+        ])
+        if table is None or not table.num_rows:
+            continue
+        frame = table.to_pandas()
+        frames.append(pd.DataFrame({
+            "Type": txn,
+            "id": frame["id"],
+            "Name": frame["Name"],
+            "Amount": frame["amount_kobo"] / 100,
+            "Category": frame["Category"],
+            "month_paid": frame["month_paid"],
+            "year_paid": frame["year_paid"],
+            "created_at": frame["created_at"],
+            "School": frame["School"],
+        }))
+    if not frames:
+        return None
+    return pd.concat(frames, ignore_index=True)
+
+
+def periods():
+    """The function returns the period keys of the archived rows."""
+    keys = set()
+    if not archived():
+        return keys
+    for ledger in LEDGERS:
+        table = _scan(ledger, ds.field("month") > 0, ["year_paid", "month"])
+        if table is not None and table.num_rows:
+            frame = table.to_pandas().drop_duplicates()
+            keys.update((frame["year_paid"] * 12 + frame["month"] - 1).tolist())
+    return keys
+
+
+def load_payments(year_from, year_to):
+    """
+    The function reads the archived payments paid for ``year_from`` to
+    ``year_to`` in the columns of reconciliation.load_payments, or None.
+    """
+    table = _scan(
+        "payments", (ds.field("year_paid") >= year_from) & (ds.field("year_paid") <= year_to),
+        ["ref_id", "Category", "month_paid", "year_paid", "amount_kobo"], (year_from, year_to),
+    )
+    if table is None or not table.num_rows:
+        return None
+    frame = table.to_pandas()
+    return pd.DataFrame({
+        "enrollee_id": frame["ref_id"],
+        "fee_type": frame["Category"],
+        "month": frame["month_paid"],
+        "year": frame["year_paid"],
+        "amount": frame["amount_kobo"] / 100,
+    })
+
+
+# --- Archiving ---
+def _snapshot(cursor, ledger, year):
+    """The function reads the live rows of one year of a ledger as an Arrow table, oldest first."""
+    cursor.execute(LEDGERS[ledger][2], (year,))
+    frame = pd.DataFrame(cursor.fetchall(), columns=SNAPSHOT_COLUMNS)
+    lookup = {name: i + 1 for i, name in enumerate(MONTHS)}
+    frame = frame.assign(
+        amount_kobo=[int((Decimal(str(amount)) * 100).to_integral_value()) for amount in frame["Amount"]],
+        month=frame["month_paid"].map(lookup).fillna(0).astype("int32"),
+        created_at=pd.to_datetime(frame["created_at"]),
+        Category=frame["Category"].where(frame["Category"].isna(), frame["Category"].astype(str)),
+    ).sort_values(["created_at", "id"], kind="stable")
+    return pa.Table.from_pandas(frame[ARCHIVE_SCHEMA.names], schema=ARCHIVE_SCHEMA, preserve_index=False)
+
+
+def _replace(temporary, path):
+    with open(temporary, "rb") as handle:
+        os.fsync(handle.fileno())
+    os.replace(temporary, path)
+
+
+def _write_mapped(table, path):
+    """The function writes the uncompressed Arrow IPC copy of a partition that reads map."""
+    # one record batch, so columns map to single arrays that numpy can view
+    with pa.OSFile(path + ".tmp", "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table.combine_chunks(), max_chunksize=max(table.num_rows, 1))
+    _replace(path + ".tmp", path)
+
+
+def _write(table, path):
+    """
+    The function writes one partition file and its mapped copy atomically,
+    reading the Parquet file back to check it first.
+    """
+    full = os.path.join(ARCHIVE_DIR, path)
+    os.makedirs(os.path.dirname(full), exist_ok=True)
+    pq.write_table(table, full + ".tmp", compression="zstd")
+    _replace(full + ".tmp", full)
+    written = pq.read_table(full, schema=ARCHIVE_SCHEMA)
+    if (written.num_rows != table.num_rows
+            or pc.sum(written.column("amount_kobo")).as_py() != pc.sum(table.column("amount_kobo")).as_py()):
+        raise RuntimeError(f"Archive file {full} does not match the rows written")
+    _write_mapped(written, full[:-len(".parquet")] + ".arrow")
+    return full
+
+
+def archive_year(conn, year):
+    """
+    The function moves the payments and purchases paid for ``year`` out of
+    the live tables into Parquet files partitioned by year and school.
+
+    The files are written and checked first; the manifest rows and the
+    deletes of exactly the archived ids then commit together, so readers
+    see each row either live or archived. Rows added for the year later
+    stay live until the year is archived again. The rollup tables keep
+    their totals. Returns ``{ledger: rows archived}``.
+    """
+    if year >= date.today().year:
+        raise ValueError(f"{year} is not closed yet: only past years can be archived")
+
+    written, counts = [], {}
+    try:
+        with conn.cursor() as cursor:
+            parts = []
+            for ledger in LEDGERS:
+                table = _snapshot(cursor, ledger, year)
+                counts[ledger] = table.num_rows
+                for school_id in pc.unique(table.column("school_id")).to_pylist():
+                    part = table.filter(pc.equal(table.column("school_id"), school_id))
+                    path = f"{ledger}/year_paid={year}/school_id={school_id}/part-{uuid.uuid4().hex}.parquet"
+                    written.append(_write(part, path))
+                    parts.append((ledger, path, part))
+
+            for ledger, path, part in parts:
+                cursor.execute(MANIFEST_INSERT, (
+                    path, ledger, year, int(part.column("school_id")[0].as_py()), part.column("School")[0].as_py(),
+                    part.num_rows, Decimal(int(pc.sum(part.column("amount_kobo")).as_py())).scaleb(-2),
+                ))
+                ids = part.column("id").to_pylist()
+                key = LEDGERS[ledger][1]
+                for start in range(0, len(ids), ARCHIVE_DELETE_CHUNK):
+                    chunk = ids[start:start + ARCHIVE_DELETE_CHUNK]
+                    cursor.execute(
+                        f"DELETE FROM {ledger} WHERE {key} IN ({', '.join(['%s'] * len(chunk))})", chunk
+                    )
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        for full in written:
+            for leftover in (full, full[:-len(".parquet")] + ".arrow"):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        raise
+    invalidate()
+    logger.info(f"Archived {year}: {counts}")
+    return counts
+
+
+# --- Metrics ---
+def _archive_metrics():
+    files = _manifest["files"]
+    yield "recon_archive_files", "Parquet files in the ledger archive.", "gauge", {(): len(files)}
+    yield "recon_archive_rows", "Ledger rows held in the archive.", "gauge", {
+        (): sum(int(entry["row_count"]) for entry in files)
+    }
+
+
+registry.add_collector(_archive_metrics)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move closed years of the ledger into the Parquet archive.")
+    parser.add_argument("command", choices=["archive", "status"])
+    parser.add_argument("years", nargs="*", type=int, help="the years to archive")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if args.command == "archive":
+        for year in args.years:
+            started = time.perf_counter()
+            with get_connection() as conn:
+                counts = archive_year(conn, year)
+            print(f"{year}: archived {counts['payments']} payments and {counts['purchases']} purchases "
+                  f"in {time.perf_counter() - started:.2f}s")
+        return 0
+
+    frame = pd.DataFrame(manifest(max_age=0), columns=MANIFEST_COLUMNS)
+    if not len(frame):
+        print(f"Nothing archived (ARCHIVE_DIR={ARCHIVE_DIR})")
+        return 0
+    frame = frame.assign(amount=pd.to_numeric(frame["amount"]), row_count=pd.to_numeric(frame["row_count"]))
+    summary = frame.pivot_table(index="year_paid", columns="ledger", values="row_count", aggfunc="sum", fill_value=0)
+    for year, row in summary.iterrows():
+        files = int((frame["year_paid"] == year).sum())
+        print(f"{year}  {files:>4} files  " + "  ".join(f"{ledger} {int(count)}" for ledger, count in row.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
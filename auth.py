@@ -0,0 +1,268 @@
+#  --- Authentication ---
+import os
+import time
+import asyncio
+import logging
+import threading
+
+from changes import changes
+from db import get_connection
+from metrics import registry
+from reference import TTLCache
+from workers import BCRYPT_PROCESSES, run_db, check_password, hash_password
+
+
+logger = logging.getLogger("ShinyAppLogger")
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "1024"))
+LOGIN_USER_BURST = int(os.getenv("LOGIN_USER_BURST", "5"))
+LOGIN_USER_PER_MINUTE = float(os.getenv("LOGIN_USER_PER_MINUTE", "5"))
+LOGIN_IP_BURST = int(os.getenv("LOGIN_IP_BURST", "60"))
+LOGIN_IP_PER_MINUTE = float(os.getenv("LOGIN_IP_PER_MINUTE", "60"))
+LOGIN_CONCURRENCY = int(os.getenv("LOGIN_CONCURRENCY", str(BCRYPT_PROCESSES)))
+LOGIN_QUEUE_TIMEOUT = float(os.getenv("LOGIN_QUEUE_TIMEOUT", "10"))
+
+LOGIN_OK = "Login successful"
+LOGIN_INVALID = "Invalid email or password"
+LOGIN_RATE_LIMITED = "Too many login attempts. Please wait a minute and try again."
+LOGIN_BUSY = "The server is busy. Please try again in a moment."
+
+# proxies whose X-Forwarded-For is trusted: nginx on the same host
+_LOCAL_PROXIES = {"127.0.0.1", "::1"}
+
+login_attempts = registry.counter(
+    "recon_login_attempts_total", "Login attempts by outcome.", labels=("outcome",)
+)
+password_rehashes = registry.counter(
+    "recon_password_rehashes_total", "Password hashes upgraded to BCRYPT_ROUNDS at login."
+)
+
+
+class TokenBuckets:
+    """
+    In-memory token buckets, one per key (a username or a client address).
+
+    A bucket holds up to ``burst`` tokens and regains ``per_minute`` tokens a
+    minute. Each attempt takes a token and is refused when none is left.
+    Buckets that have filled up again are dropped once more than
+    ``maxsize`` keys are held, so memory stays bounded.
+    """
+
+    def __init__(self, burst, per_minute, maxsize=10000):
+        self.burst = burst
+        self.rate = per_minute / 60.0
+        self.maxsize = maxsize
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _tokens(self, key, now):
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def take(self, key):
+        """The method takes a token for ``key``; returns False if the bucket is empty."""
+        now = time.monotonic()
+        with self._lock:
+            tokens = self._tokens(key, now)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return False
+            self._buckets[key] = (tokens - 1, now)
+            if len(self._buckets) > self.maxsize:
+                self._prune(now)
+            return True
+
+    def give_back(self, key):
+        now = time.monotonic()
+        with self._lock:
+            self._buckets[key] = (min(self.burst, self._tokens(key, now) + 1), now)
+
+    def _prune(self, now):
+        for key in [k for k in self._buckets if self._tokens(k, now) >= self.burst]:
+            del self._buckets[key]
+        # still too many keys (e.g. a spray of distinct names): drop the oldest
+        excess = len(self._buckets) - self.maxsize
+        if excess > 0:
+            for key in sorted(self._buckets, key=lambda k: self._buckets[k][1])[:excess]:
+                del self._buckets[key]
+
+
+_users = TTLCache(ttl=AUTH_CACHE_TTL, maxsize=AUTH_CACHE_SIZE)
+_user_buckets = TokenBuckets(LOGIN_USER_BURST, LOGIN_USER_PER_MINUTE)
+_ip_buckets = TokenBuckets(LOGIN_IP_BURST, LOGIN_IP_PER_MINUTE)
+_slots = None
+_waiting = 0
+_running = 0
+_dummy_hash = None
+
+
+#  --- User Records ---
+def _fetch_user(username):
+    with get_connection() as conn, conn.cursor(dictionary=True) as cursor:
+        cursor.execute("SELECT user_id, username, password_hash FROM users WHERE username = %s", (username,))
+        return cursor.fetchone()
+
+
+def get_user(username):
+    """
+    The function returns the user's id, username and password hash, or
+    None for an unknown username. Records are cached for AUTH_CACHE_TTL
+    seconds, unknown names included, so repeated attempts stay off the database.
+    """
+    return _users.get(username, lambda: _fetch_user(username))
+
+
+def invalidate_users(username=None, broadcast=True):
+    """
+    The function drops the cached record of ``username`` (or every cached
+    record), and with ``broadcast`` the records cached by the other workers
+    """
+    _users.invalidate(None if username is None else lambda key: key == username)
+    if broadcast:
+        changes.publish("users")
+
+
+changes.subscribe("users", lambda: invalidate_users(broadcast=False))
+
+
+def _update_hash(user_id, old_hash, new_hash):
+    # only replaces the hash that was verified, so a concurrent password change wins
+    with get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            "UPDATE users SET password_hash = %s WHERE user_id = %s AND password_hash = %s",
+            (new_hash, user_id, old_hash),
+        )
+        conn.commit()
+        return cursor.rowcount
+
+
+def hash_rounds(password_hash):
+    """The function reads the work factor of a bcrypt hash ($2b$12$...), or None if it is not one."""
+    parts = password_hash.split("$")
+    return int(parts[2]) if len(parts) > 3 and parts[2].isdigit() else None
+
+
+#  --- Login ---
+def _login_slots():
+    # the semaphore belongs to the running loop; a new loop (a benchmark's asyncio.run) gets a fresh one
+    global _slots
+    loop = asyncio.get_running_loop()
+    if _slots is None or _slots[0] is not loop:
+        _slots = (loop, asyncio.Semaphore(LOGIN_CONCURRENCY))
+    return _slots[1]
+
+
+def client_address(conn):
+    """
+    The function returns the address a login came from: the peer of the
+    websocket, or the client nginx saw when the app runs behind it
+    """
+    if conn is None or conn.client is None:
+        return None
+    peer = conn.client.host
+    forwarded = conn.headers.get("x-forwarded-for")
+    if peer in _LOCAL_PROXIES and forwarded:
+        # nginx appends the address it saw; anything before it came from the client
+        return forwarded.split(",")[-1].strip()
+    return peer
+
+
+async def _verify(password, user):
+    global _dummy_hash
+    if user is None:
+        # check against a dummy hash so unknown names take as long as wrong passwords
+        if _dummy_hash is None:
+            _dummy_hash = await hash_password(b"", BCRYPT_ROUNDS)
+        await check_password(password, _dummy_hash)
+        return False
+    return await check_password(password, user["password_hash"].encode("utf-8"))
+
+
+async def _rehash(password, user):
+    old_hash = user["password_hash"]
+    new_hash = (await hash_password(password, BCRYPT_ROUNDS)).decode("utf-8")
+    if await run_db(_update_hash, user["user_id"], old_hash, new_hash):
+        password_rehashes.inc()
+        invalidate_users(user["username"])
+        logger.info(f"Password hash of {user['username']} upgraded from {hash_rounds(old_hash)} to {BCRYPT_ROUNDS} rounds")
+
+
+async def authenticate(username, password, client=None):
+    """
+    The function checks a login and returns ``(user, message)``: the user's
+    id and username with LOGIN_OK, or None with the message to show.
+
+    Attempts are limited per username and per client address with token
+    buckets; a successful login returns its tokens, so only failures use
+    up the allowance. At most LOGIN_CONCURRENCY password checks run at
+    once and the others wait their turn in arrival order; an attempt that
+    has waited LOGIN_QUEUE_TIMEOUT seconds is turned away as busy, which
+    bounds login latency under a burst. A hash made with a work factor
+    other than BCRYPT_ROUNDS is replaced after a successful check.
+    """
+    global _waiting, _running
+    username = (username or "").strip()
+    if not username or not password:
+        login_attempts.inc("invalid")
+        return None, LOGIN_INVALID
+
+    key = username.lower()
+
+    def refund():
+        _user_buckets.give_back(key)
+        if client is not None:
+            _ip_buckets.give_back(client)
+
+    if not _user_buckets.take(key):
+        login_attempts.inc("rate_limited")
+        logger.warning(f"Login rate limit reached for user: {username}")
+        return None, LOGIN_RATE_LIMITED
+    if client is not None and not _ip_buckets.take(client):
+        _user_buckets.give_back(key)
+        login_attempts.inc("rate_limited")
+        logger.warning(f"Login rate limit reached for address: {client}")
+        return None, LOGIN_RATE_LIMITED
+
+    slots = _login_slots()
+    _waiting += 1
+    try:
+        await asyncio.wait_for(slots.acquire(), LOGIN_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        refund()
+        login_attempts.inc("busy")
+        logger.warning(f"Login of {username} waited {LOGIN_QUEUE_TIMEOUT:g}s for a password check and was turned away")
+        return None, LOGIN_BUSY
+    finally:
+        _waiting -= 1
+
+    _running += 1
+    try:
+        user = await run_db(get_user, username)
+        if not await _verify(password, user):
+            login_attempts.inc("invalid")
+            return None, LOGIN_INVALID
+        refund()
+        if hash_rounds(user["password_hash"]) != BCRYPT_ROUNDS:
+            try:
+                await _rehash(password, user)
+            except Exception:
+                logger.exception(f"Could not upgrade the password hash of {username}")
+    finally:
+        _running -= 1
+        slots.release()
+    login_attempts.inc("success")
+    return {"user_id": user["user_id"], "username": user["username"]}, LOGIN_OK
+
+
+def _auth_metrics():
+    stats = _users.stats()
+    yield "recon_auth_cache_entries", "User records held in the login cache.", "gauge", {(): stats["size"]}
+    for name in ("hits", "misses"):
+        yield f"recon_auth_cache_{name}_total", f"Login cache {name}.", "counter", {(): stats[name]}
+    yield "recon_login_waiting", "Logins waiting for a password-check slot.", "gauge", {(): _waiting}
+    yield "recon_login_running", "Password checks running in the bcrypt processes.", "gauge", {(): _running}
+
+
+registry.add_collector(_auth_metrics)
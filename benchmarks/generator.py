@@ -0,0 +1,169 @@
+#  --- Synthetic Ledger Generator ---
+"""
+Seeded generator for realistic enrollees, items, school types, users,
+payments and purchases at a configurable scale, plus loaders for the SQLite
+stand-in and for a scratch MySQL/MariaDB database.
+"""
+import logging
+from datetime import datetime
+
+import bcrypt
+import numpy as np
+import pandas as pd
+
+from reference import MONTHS, FEE_TYPES
+
+
+logger = logging.getLogger("ShinyAppLogger")
+
+SCHOOLS = ["SOML Advanced", "SOML Ordinary", "EFD & Igbaradi"]
+
+FIRST_NAMES = [
+    "Adebayo", "Chinedu", "Oluwaseun", "Ngozi", "Emeka", "Funmilayo", "Ibrahim", "Aisha", "Tunde", "Kemi",
+    "Chiamaka", "Babatunde", "Yetunde", "Ifeanyi", "Zainab", "Segun", "Bisola", "Uche", "Halima", "Damilola",
+    "Obinna", "Folake", "Musa", "Amaka", "Kunle", "Temitope", "Nkechi", "Yusuf", "Bukola", "Chukwuma",
+]
+LAST_NAMES = [
+    "Adeyemi", "Okafor", "Balogun", "Eze", "Ogunleye", "Bello", "Nwosu", "Afolabi", "Okonkwo", "Abubakar",
+    "Olawale", "Chukwu", "Adebayo", "Ibekwe", "Salami", "Onyeka", "Lawal", "Obi", "Adeleke", "Umar",
+    "Ogunbiyi", "Nnamdi", "Oyelaran", "Danjuma", "Ayodele", "Ekwueme", "Fashola", "Ikenna", "Sanni", "Uzor",
+]
+ITEM_WORDS = [
+    "Chalk", "Marker", "Exercise Book", "Textbook", "Printer Ink", "A4 Paper", "Rice", "Beans", "Palm Oil",
+    "Detergent", "Broom", "Bulb", "Diesel", "Projector Lamp", "Stapler", "Envelope", "Water", "Sugar",
+]
+
+FEE_AMOUNTS = {"Registration": (5000, 20000), "Feeding": (1500, 6000), "Handout": (500, 3000)}
+
+
+def _timestamps(rng, n, start_year, years):
+    start = pd.Timestamp(year=start_year, month=1, day=1).value // 10**9
+    end = pd.Timestamp(year=start_year + years, month=1, day=1).value // 10**9
+    seconds = np.sort(rng.integers(start, end, n))
+    return pd.to_datetime(seconds, unit="s")
+
+
+def generate(rows=100_000, seed=42, start_year=None, years=3, purchase_share=0.2, users=10):
+    """
+    The function generates a synthetic ledger with ``rows`` transactions in
+    total (payments plus purchases) spread over ``years`` years.
+    Returns a dict of DataFrames keyed by table name.
+    """
+    rng = np.random.default_rng(seed)
+    start_year = start_year or datetime.now().year - years + 1
+
+    n_purchases = int(rows * purchase_share)
+    n_payments = rows - n_purchases
+    n_enrollees = max(50, n_payments // 40)
+    n_items = max(20, min(2000, n_purchases // 200))
+
+    school_types = pd.DataFrame({"school_id": np.arange(1, len(SCHOOLS) + 1), "school_name": SCHOOLS})
+
+    enrollee_school = rng.integers(0, len(SCHOOLS), n_enrollees)
+    enrollees = pd.DataFrame({
+        "enrollee_id": np.arange(1, n_enrollees + 1),
+        "first_name": np.array(FIRST_NAMES)[rng.integers(0, len(FIRST_NAMES), n_enrollees)],
+        # suffix the surname so names stay unique within a school
+        "last_name": [
+            f"{LAST_NAMES[i % len(LAST_NAMES)]}-{i}" for i in rng.permutation(n_enrollees)
+        ],
+        "school_name": np.array(SCHOOLS)[enrollee_school],
+    })
+
+    items = pd.DataFrame({
+        "item_id": np.arange(1, n_items + 1),
+        "item_name": [f"{ITEM_WORDS[i % len(ITEM_WORDS)]} #{i + 1}" for i in range(n_items)],
+    })
+
+    password_hash = bcrypt.hashpw(b"benchmark", bcrypt.gensalt(rounds=4)).decode("utf-8")
+    user_frame = pd.DataFrame({
+        "user_id": np.arange(1, users + 1),
+        "username": [f"bursar{i}@example.com" for i in range(1, users + 1)],
+        "password_hash": password_hash,
+    })
+
+    created = _timestamps(rng, n_payments, start_year, years)
+    payer = rng.integers(0, n_enrollees, n_payments)
+    fee_type = np.array(FEE_TYPES)[rng.choice(len(FEE_TYPES), n_payments, p=[0.1, 0.6, 0.3])]
+    low = np.array([FEE_AMOUNTS[f][0] for f in FEE_TYPES])[pd.Index(FEE_TYPES).get_indexer(fee_type)]
+    high = np.array([FEE_AMOUNTS[f][1] for f in FEE_TYPES])[pd.Index(FEE_TYPES).get_indexer(fee_type)]
+    payments = pd.DataFrame({
+        "payment_id": np.arange(1, n_payments + 1),
+        "enrollee_id": payer + 1,
+        "fee_type": fee_type,
+        "amount": (rng.integers(low // 50, high // 50 + 1) * 50).astype("int64"),
+        "month_paid": np.array(MONTHS)[created.month.to_numpy() - 1],
+        "year_paid": created.year.to_numpy(),
+        "school_id": enrollee_school[payer] + 1,
+        "created_at": created,
+    })
+
+    created = _timestamps(rng, n_purchases, start_year, years)
+    purchases = pd.DataFrame({
+        "purchase_id": np.arange(1, n_purchases + 1),
+        "item_id": rng.integers(1, n_items + 1, n_purchases),
+        "quantity": rng.integers(1, 50, n_purchases).astype(str),
+        "amount": (rng.integers(10, 2000, n_purchases) * 100).astype("int64"),
+        "school_id": rng.integers(1, len(SCHOOLS) + 1, n_purchases),
+        "month_paid": np.array(MONTHS)[created.month.to_numpy() - 1],
+        "year_paid": created.year.to_numpy(),
+        "created_at": created,
+    })
+
+    schedule = pd.DataFrame(
+        [(school_id, fee, month, None, FEE_AMOUNTS[fee][0])
+         for school_id in school_types["school_id"] for fee in FEE_TYPES for month in MONTHS
+         if fee != "Registration" or month in ("January", "May", "September")],
+        columns=["school_id", "fee_type", "month_paid", "year_paid", "amount"],
+    )
+
+    return {
+        "users": user_frame,
+        "school_types": school_types,
+        "enrollees": enrollees,
+        "items": items,
+        "payments": payments,
+        "purchases": purchases,
+        "fee_schedule": schedule,
+    }
+
+
+LOAD_ORDER = ["users", "school_types", "enrollees", "items", "payments", "purchases", "fee_schedule"]
+
+
+def _records(frame):
+    columns = []
+    for name in frame.columns:
+        column = frame[name]
+        if pd.api.types.is_datetime64_any_dtype(column):
+            columns.append(column.dt.strftime("%Y-%m-%d %H:%M:%S").tolist())
+        else:
+            columns.append(column.astype(object).where(column.notna(), None).tolist())
+    return list(zip(*columns))
+
+
+def load(conn, data, chunk_size=20_000):
+    """
+    The function inserts generated tables through a DB-API style connection
+    (the stand-in or mysql.connector) in chunks, committing per chunk
+    """
+    with conn.cursor() as cursor:
+        for table in LOAD_ORDER:
+            frame = data[table]
+            columns = ", ".join(frame.columns)
+            placeholders = ", ".join(["%s"] * len(frame.columns))
+            sql = f"INSERT INTO {table} ({columns}) VALUES ({placeholders})"
+            for start in range(0, len(frame), chunk_size):
+                cursor.executemany(sql, _records(frame.iloc[start:start + chunk_size]))
+                conn.commit()
+            logger.info(f"Loaded {len(frame)} rows into {table}")
+
+
+def clear(conn):
+    """The function empties the generated tables (scratch databases only)."""
+    with conn.cursor() as cursor:
+        for table in reversed(LOAD_ORDER):
+            cursor.execute(f"DELETE FROM {table}")
+        # archived years of an earlier run would be left out of the rollup rebuild
+        cursor.execute("DELETE FROM archive_files")
+        conn.commit()
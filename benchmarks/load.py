@@ -0,0 +1,745 @@
+#  --- Load Test with Concurrent Shiny Sessions ---
+"""
+Drives many simulated clerks through the app at once, each a real Shiny
+websocket session, and writes throughput, latency percentiles per user
+action, reactive executions and SQL statements per action, and the CPU and
+memory of the app workers as JSON.
+
+    python -m benchmarks.load --sessions 50 --duration 120 --output load.json
+    python -m benchmarks.load --sessions 50 --workers 4 --think 0.5
+
+The ledger is generated and loaded as in benchmarks.run. The harness then
+starts the workers (benchmarks.load_app, on consecutive ports), spreads the
+sessions over them as nginx's affinity cookie would, and stops them at the
+end. ``--url`` drives an app that is already running instead; the CPU and
+memory of its workers are then not reported.
+
+Every clerk logs in, then repeats journeys picked at random: record a
+payment (choose a school, search an enrollee, submit, confirm), record a
+purchase, review the History tab (filter, page) or export it as CSV,
+pausing about ``--think`` seconds between actions. An action's latency
+runs from sending its input until every output it invalidated has been
+re-rendered and sent back. Before the clerks start, one session performs
+each action on the otherwise quiet app and the metrics each action moved
+are recorded as the "profile".
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import platform
+import resource
+import subprocess
+import tempfile
+import collections
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import websockets
+
+import db
+import rollups
+from reference import MONTHS, FEE_TYPES
+from metrics import METRICS_PATH
+from benchmarks import generator
+from benchmarks.run import PERCENTILES, git_commit, setup_backend
+
+
+logger = logging.getLogger("ShinyAppLogger")
+
+PASSWORD = "benchmark"
+USERS = 10
+LOAD_BASE_PORT = 8101
+ACTION_TIMEOUT = 60
+
+# outputs on each tab; the browser reports the ones on hidden tabs as hidden,
+# so the server does not render them
+TAB_OUTPUTS = {
+    "task": ["task_form", "task_details", "import_summary", "import_errors"],
+    "history": ["filter_form", "history_table", "history_page_info", "total_payment_card", "total_purchase_card"],
+    "reconciliation": ["reconciliation_totals", "reconciliation_table"],
+    "reports": ["report_chart", "report_table"],
+}
+PAGE_OUTPUTS = ["main_ui", "login_message", "user_authenticated"]
+
+# the inputs the browser binds once the main UI, the task form and the
+# History filters have rendered, with their initial values
+BOUND_INPUTS = {
+    "task_type": "Payment",
+    "fee_type": FEE_TYPES[0],
+    "month": MONTHS[0],
+    "year_paid": 0,
+    "amount": 0,
+    "enrollee": "",
+    "first_name": "",
+    "last_name": "",
+    "filter_date:shiny.date": None,
+    "filter_school": "All",
+    "filter_type": "All",
+    "filter_fee_type": "All",
+    "filter_period_start": "All",
+    "filter_period_end": "All",
+    "history_sort": "DESC",
+    "history_page_size": "50",
+    "history_next:shiny.action": 0,
+    "history_prev:shiny.action": 0,
+    "import_kind": "Payment",
+    "run_import:shiny.action": 0,
+    "recon_school": "All",
+    "recon_year_from": datetime.now().year,
+    "recon_year_to": datetime.now().year,
+    "recon_view": "Summary",
+    "recon_outstanding_only": False,
+    "report_school": "All",
+    "report_year_from": datetime.now().year - 2,
+    "report_year_to": datetime.now().year,
+}
+HISTORY_FILTERS = {
+    "filter_school": ["All", *generator.SCHOOLS],
+    "filter_type": ["All", "Payment", "Purchase"],
+    "filter_fee_type": ["All", *FEE_TYPES],
+}
+JOURNEYS = {"record_payment": 5, "record_purchase": 2, "review_history": 3, "export_history": 1}
+
+
+#  --- One Simulated Clerk ---
+class Clerk:
+    """
+    One simulated clerk: a Shiny websocket session on one worker, driven the
+    way the browser drives it. The step methods perform one user action
+    each and return once the server has sent the outputs it updated; the
+    journey methods chain steps with think time and pass each step's
+    latency to ``record``.
+    """
+
+    def __init__(self, base_url, username, rng, think=0.0, record=None):
+        self.base_url = base_url.rstrip("/") + "/"
+        self.username = username
+        self.rng = rng
+        self.think = think
+        self.record = record or (lambda action, seconds, ok: None)
+        self.session_id = None
+        self.inputs = {}
+        self.values = {}
+        self.output_errors = 0
+        self.closed = False
+        self.tab = "task"
+        self.schools = []
+        self.items = []
+        self._clicks = collections.Counter()
+        self._ws = None
+        self._reader = None
+        self._done = asyncio.Event()
+        self._tag = 0
+
+    #  --- Protocol ---
+    async def _read(self):
+        try:
+            async for raw in self._ws:
+                message = json.loads(raw)
+                if "config" in message:
+                    self.session_id = message["config"]["sessionId"]
+                self.values.update(message.get("values") or {})
+                self.output_errors += len(message.get("errors") or {})
+                if message.get("response", {}).get("tag") == self._tag:
+                    self._done.set()
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.closed = True
+            self._done.set()
+
+    async def _send(self, message):
+        # The session handles one message at a time, each followed by a full
+        # reactive flush, so the answer to a call sent right after the update
+        # arrives once every output the update invalidated has been sent
+        self._tag += 1
+        self._done.clear()
+        await self._ws.send(json.dumps(message))
+        await self._ws.send(json.dumps({"method": "loadtest_barrier", "tag": self._tag, "args": []}))
+        await asyncio.wait_for(self._done.wait(), ACTION_TIMEOUT)
+        if self.closed:
+            raise ConnectionError("The session was closed by the server")
+
+    async def update(self, inputs):
+        """
+        The method sends the inputs that differ from the session's current
+        values and waits for the outputs they update. Returns False, without a
+        round trip, when nothing changed (the browser would send nothing).
+        """
+        changed = {name: value for name, value in inputs.items() if self.inputs.get(name, ...) != value}
+        if not changed:
+            return False
+        self.inputs.update(changed)
+        await self._send({"method": "update", "data": changed})
+        return True
+
+    async def click(self, button, inputs=None):
+        self._clicks[button] += 1
+        return await self.update({**(inputs or {}), f"{button}:shiny.action": self._clicks[button]})
+
+    async def _get(self, path, read=True):
+        def fetch():
+            with urllib.request.urlopen(self.base_url + path, timeout=ACTION_TIMEOUT) as response:
+                if not read:
+                    return sum(len(chunk) for chunk in iter(lambda: response.read(1 << 16), b""))
+                return response.read()
+        return await asyncio.to_thread(fetch)
+
+    def _visibility(self, tab):
+        flags = {f".clientdata_output_{output}_hidden": False for output in PAGE_OUTPUTS}
+        for name, outputs in TAB_OUTPUTS.items():
+            flags.update({f".clientdata_output_{output}_hidden": name != tab for output in outputs})
+        return flags
+
+    #  --- Steps: one user action each ---
+    async def connect(self):
+        self._ws = await websockets.connect(
+            self.base_url.replace("http", "ws", 1) + "websocket/", max_size=None, open_timeout=ACTION_TIMEOUT
+        )
+        self.closed = False
+        self._reader = asyncio.create_task(self._read())
+        self.tab = "task"
+        self.values = {}
+        self.inputs = {
+            ".clientdata_url_search": "",
+            ".clientdata_pixelratio": 1,
+            ".clientdata_output_report_chart_width": 800,
+            ".clientdata_output_report_chart_height": 400,
+            "login_email": "",
+            "login_password": "",
+            "login_btn:shiny.action": 0,
+            **self._visibility(self.tab),
+        }
+        self._clicks = collections.Counter()
+        await self._send({"method": "init", "data": self.inputs})
+
+    async def close(self):
+        if self._ws is not None:
+            await self._ws.close()
+            if self._reader is not None:
+                await self._reader
+            self._ws = self._reader = None
+
+    async def login(self):
+        await self.click("login_btn", {"login_email": self.username, "login_password": PASSWORD})
+        if "success" not in str(self.values.get("login_message", "")).lower():
+            raise RuntimeError(f"Login failed for {self.username}: {self.values.get('login_message')!r}")
+        self.schools = _option_values(self.values.get("task_form"))
+        if not self.schools:
+            raise RuntimeError("The task form listed no schools")
+        await self.update({**BOUND_INPUTS, "school_type": self.schools[0]})
+
+    async def open_tab(self, tab):
+        if tab == self.tab:
+            return False
+        self.tab = tab
+        return await self.update(self._visibility(tab))
+
+    async def choose_task(self, task):
+        changed = await self.update({"task_type": task, "school_type": self.rng.choice(self.schools)})
+        if task == "Purchase":
+            self.items = _option_values(self.values.get("task_details"))
+        return changed
+
+    async def search_enrollee(self):
+        # what the typeahead requests after the clerk types two letters
+        query = self.rng.choice(generator.FIRST_NAMES)[:2].lower()
+        options = json.loads(await self._get(
+            f"session/{self.session_id}/dynamic_route/enrollee_search?{urllib.parse.urlencode({'query': query})}"
+        ))
+        return [option["value"] for option in options if option["value"].isdigit()]
+
+    async def submit(self, kind, inputs):
+        """The method fills in the payment or purchase form and submits it, which opens the confirmation."""
+        low, high = generator.FEE_AMOUNTS.get(inputs.get("fee_type"), (500, 5000))
+        return await self.click(f"submit_{kind}", {
+            "amount": self.rng.randrange(low, high, 100),
+            "month": self.rng.choice(MONTHS),
+            "year_paid": datetime.now().year,
+            **inputs,
+        })
+
+    async def confirm(self, kind):
+        return await self.click(f"confirm_{kind}")
+
+    async def filter_history(self):
+        name = self.rng.choice(list(HISTORY_FILTERS))
+        choices = [value for value in HISTORY_FILTERS[name] if value != self.inputs.get(name)]
+        return await self.update({name: self.rng.choice(choices)})
+
+    async def next_page(self):
+        return await self.click("history_next")
+
+    async def export_csv(self):
+        return await self._get(f"session/{self.session_id}/download/download_filtered_history?w=", read=False)
+
+    #  --- Journeys ---
+    async def act(self, action, step):
+        """The method runs one step, records its latency, then pauses for the think time."""
+        started = time.perf_counter()
+        try:
+            result = await step
+        except Exception:
+            self.record(action, time.perf_counter() - started, False)
+            raise
+        if result is not False:
+            self.record(action, time.perf_counter() - started, True)
+        if self.think:
+            await asyncio.sleep(self.rng.uniform(0, 2 * self.think))
+        return result
+
+    async def start(self):
+        await self.act("connect", self.connect())
+        await self.act("login", self.login())
+
+    async def record_payment(self):
+        await self.act("open_tab", self.open_tab("task"))
+        await self.act("choose_task", self.choose_task("Payment"))
+        enrollees = await self.act("search_enrollee", self.search_enrollee())
+        if not enrollees:
+            return
+        await self.act("submit_payment", self.submit("payment", {
+            "enrollee": self.rng.choice(enrollees), "fee_type": self.rng.choice(FEE_TYPES),
+        }))
+        await self.act("confirm_payment", self.confirm("payment"))
+
+    async def record_purchase(self):
+        await self.act("open_tab", self.open_tab("task"))
+        await self.act("choose_task", self.choose_task("Purchase"))
+        if not self.items:
+            return
+        await self.act("submit_purchase", self.submit("purchase", {
+            "item": self.rng.choice(self.items), "quantity": str(self.rng.randint(1, 5)),
+        }))
+        await self.act("confirm_purchase", self.confirm("purchase"))
+
+    async def review_history(self):
+        await self.act("open_tab", self.open_tab("history"))
+        await self.act("filter_history", self.filter_history())
+        await self.act("next_page", self.next_page())
+        await self.act("next_page", self.next_page())
+
+    async def export_history(self):
+        await self.act("open_tab", self.open_tab("history"))
+        await self.act("filter_history", self.filter_history())
+        await self.act("export_csv", self.export_csv())
+
+    async def run(self, deadline):
+        """
+        The method logs in and repeats random journeys until ``deadline``
+        (event-loop time). A journey that fails reloads the session, as a
+        clerk would reload the page. Returns the number of failed journeys.
+        """
+        loop = asyncio.get_running_loop()
+        names, weights = list(JOURNEYS), list(JOURNEYS.values())
+        failures = 0
+        started = False
+        while loop.time() < deadline:
+            try:
+                if not started:
+                    await self.start()
+                    started = True
+                await getattr(self, self.rng.choices(names, weights)[0])()
+            except Exception as e:
+                failures += 1
+                logger.debug(f"Journey failed for {self.username}: {e!r}")
+                started = False
+                await self.close()
+        await self.close()
+        return failures
+
+
+def _option_values(output):
+    # the numeric option values (school or item ids) of a rendered select
+    html = output.get("html", "") if isinstance(output, dict) else ""
+    return list(dict.fromkeys(re.findall(r'<option value="(\d+)"', html)))
+
+
+#  --- Metrics and Worker Resources ---
+_SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)$')
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def parse_metrics(text):
+    """The function parses Prometheus text into {(name, labels): value}."""
+    samples = {}
+    for line in text.splitlines():
+        match = _SAMPLE.match(line)
+        if match and not line.startswith("#"):
+            name, labels, value = match.groups()
+            samples[(name, tuple(sorted(_LABEL.findall(labels or ""))))] = float(value)
+    return samples
+
+
+async def scrape(urls):
+    """The function adds up the metrics of every worker."""
+    def fetch(url):
+        with urllib.request.urlopen(url.rstrip("/") + METRICS_PATH, timeout=ACTION_TIMEOUT) as response:
+            return parse_metrics(response.read().decode("utf-8"))
+
+    total = collections.Counter()
+    for samples in await asyncio.gather(*(asyncio.to_thread(fetch, url) for url in urls)):
+        total.update(samples)
+    return total
+
+
+def summarize_metrics(before, after, actions=1, top=15):
+    """
+    The function turns two scrapes into reactive executions (renders, calcs,
+    effects, routes) and SQL statements, in total and per action
+    """
+    delta = {key: after[key] - before.get(key, 0) for key in after}
+    reactive, statements, rows = collections.Counter(), collections.Counter(), 0
+    for (name, labels), value in delta.items():
+        labels = dict(labels)
+        if name == "recon_reactive_seconds_count" and value:
+            reactive[(labels["kind"], labels["name"])] += value
+        elif name == "recon_sql_statement_seconds_count" and value:
+            statements[labels["statement"]] += value
+        elif name == "recon_sql_rows_total":
+            rows += value
+    by_kind = collections.Counter()
+    for (kind, _), value in reactive.items():
+        by_kind[kind] += value
+    actions = max(actions, 1)
+    return {
+        "reactive_executions": sum(reactive.values()),
+        "reactive_executions_per_action": sum(reactive.values()) / actions,
+        "reactive_by_kind": dict(by_kind),
+        "reactive_by_name": {f"{kind}:{name}": n for (kind, name), n in reactive.most_common(top)},
+        "sql_statements": sum(statements.values()),
+        "sql_statements_per_action": sum(statements.values()) / actions,
+        "sql_rows": rows,
+        "sql_by_statement": dict(statements.most_common(top)),
+    }
+
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def _process_tree(pid):
+    # the worker and its children (the password-check processes)
+    parents = collections.defaultdict(list)
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    parents[int(f.read().rsplit(")", 1)[1].split()[1])].append(int(entry))
+            except (OSError, IndexError):
+                continue
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(parents.get(current, ()))
+    return tree
+
+
+def _cpu_and_rss(pids):
+    cpu, rss = 0.0, 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+            with open(f"/proc/{pid}/status") as f:
+                rss += next(int(line.split()[1]) * 1024 for line in f if line.startswith("VmRSS:"))
+        except (OSError, StopIteration):
+            continue
+    return cpu, rss
+
+
+class WorkerMonitor:
+    """Samples the CPU time and resident memory of the worker processes (Linux only)."""
+
+    def __init__(self, pids, interval=1.0):
+        self.pids = pids
+        self.interval = interval
+        self.available = os.path.isdir("/proc")
+        self._start = {}
+        self._peak = collections.Counter()
+        self._last = {}
+
+    def _sample(self):
+        for pid in self.pids:
+            cpu, rss = _cpu_and_rss(_process_tree(pid))
+            self._last[pid] = (cpu, rss)
+            self._peak[pid] = max(self._peak[pid], rss)
+
+    async def watch(self, stop):
+        if not self.available:
+            return
+        self._sample()
+        self._start = dict(self._last)
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._sample()
+
+    def report(self, elapsed):
+        if not self.available or not self._start:
+            return None
+        workers = []
+        for worker, pid in enumerate(self.pids):
+            cpu = self._last[pid][0] - self._start[pid][0]
+            workers.append({
+                "worker": worker,
+                "cpu_seconds": cpu,
+                "cpu_percent": 100 * cpu / elapsed if elapsed else None,
+                "rss_start_bytes": self._start[pid][1],
+                "rss_end_bytes": self._last[pid][1],
+                "rss_peak_bytes": self._peak[pid],
+            })
+        return workers
+
+
+#  --- Workers ---
+def start_workers(workers, base_port, env, run_dir):
+    """
+    The function starts the app workers on consecutive ports, in ``run_dir``
+    so their logs, journals and change counters stay out of the source tree,
+    and waits until each answers. Returns (processes, urls).
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {**os.environ, **env, "PYTHONPATH": os.pathsep.join(filter(None, [root, os.getenv("PYTHONPATH")]))}
+    processes, urls = [], []
+    for worker in range(workers):
+        port = base_port + worker
+        with open(os.path.join(run_dir, f"worker-{worker}.log"), "ab") as log:
+            processes.append(subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "benchmarks.load_app:app",
+                 "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+                cwd=run_dir, env={**env, "WORKER_ID": str(worker)}, stdout=log, stderr=subprocess.STDOUT,
+            ))
+        urls.append(f"http://127.0.0.1:{port}/")
+
+    deadline = time.monotonic() + 120
+    for process, url in zip(processes, urls):
+        while True:
+            if process.poll() is not None:
+                stop_workers(processes)
+                raise SystemExit(f"The worker at {url} exited with status {process.returncode}")
+            try:
+                urllib.request.urlopen(url, timeout=5).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    stop_workers(processes)
+                    raise SystemExit(f"The worker at {url} did not start")
+                time.sleep(0.5)
+    return processes, urls
+
+
+def stop_workers(processes):
+    for process in processes:
+        if process.poll() is None:
+            process.terminate()
+    for process in processes:
+        try:
+            process.wait(15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+#  --- Load Run ---
+def latency_summary(samples, elapsed):
+    """The function summarizes one action's (seconds, ok) samples like benchmarks.run does."""
+    ms = np.array([seconds for seconds, ok in samples if ok]) * 1000
+    result = {
+        "count": len(samples),
+        "errors": sum(1 for _, ok in samples if not ok),
+        "per_second": len(ms) / elapsed if elapsed else None,
+    }
+    if len(ms):
+        result.update({"mean_ms": float(ms.mean()), "min_ms": float(ms.min()), "max_ms": float(ms.max())})
+        for p in PERCENTILES:
+            result[f"p{p}_ms"] = float(np.percentile(ms, p))
+    return result
+
+
+async def profile_actions(url):
+    """
+    The function runs each user action once in a single session on the
+    quiet app and records the reactive executions and SQL statements it
+    caused. Background polls that fall inside an action are counted too.
+    """
+    clerk = Clerk(url, "bursar1@example.com", random.Random(0))
+    profile = {}
+
+    async def measure(action, step):
+        before = await scrape([url])
+        result = await step
+        profile[action] = summarize_metrics(before, await scrape([url]))
+        return result
+
+    try:
+        await measure("connect", clerk.connect())
+        await measure("login", clerk.login())
+        await measure("choose_task", clerk.choose_task("Payment"))
+        enrollees = await measure("search_enrollee", clerk.search_enrollee())
+        if enrollees:
+            await measure("submit_payment", clerk.submit("payment", {"enrollee": enrollees[0], "fee_type": "Feeding"}))
+            await measure("confirm_payment", clerk.confirm("payment"))
+        await measure("choose_task", clerk.choose_task("Purchase"))
+        if clerk.items:
+            await measure("submit_purchase", clerk.submit("purchase", {
+                "item": clerk.items[0], "quantity": "1",
+            }))
+            await measure("confirm_purchase", clerk.confirm("purchase"))
+        await measure("open_tab", clerk.open_tab("history"))
+        await measure("filter_history", clerk.filter_history())
+        await measure("next_page", clerk.next_page())
+        await measure("export_csv", clerk.export_csv())
+    finally:
+        await clerk.close()
+    return profile
+
+
+async def run_load(urls, sessions, duration, ramp, think, seed, pids=()):
+    """
+    The function starts ``sessions`` clerks spread over ``urls``, staggered
+    over ``ramp`` seconds, lets them work until ``duration`` seconds after
+    the last one started, and returns the load section of the report.
+    """
+    samples = collections.defaultdict(list)
+    journeys = collections.Counter()
+
+    def record(action, seconds, ok):
+        samples[action].append((seconds, ok))
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + ramp + duration
+    monitor = WorkerMonitor(list(pids))
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(monitor.watch(stop))
+
+    async def work(number):
+        await asyncio.sleep(ramp * number / sessions)
+        username = f"bursar{number % USERS + 1}@example.com"
+        clerk = Clerk(urls[number % len(urls)], username, random.Random(seed + number), think, record)
+        journeys[number] = await clerk.run(deadline)
+
+    before = await scrape(urls)
+    client_before = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.perf_counter()
+    await asyncio.gather(*(work(number) for number in range(sessions)))
+    elapsed = time.perf_counter() - started
+    client_after = resource.getrusage(resource.RUSAGE_SELF)
+    stop.set()
+    await watcher
+    after = await scrape(urls)
+
+    actions = sum(1 for values in samples.values() for _, ok in values if ok)
+    errors = sum(1 for values in samples.values() for _, ok in values if not ok)
+    return {
+        "elapsed_s": elapsed,
+        "throughput": {
+            "actions": actions,
+            "actions_per_second": actions / elapsed,
+            "errors": errors,
+            "failed_journeys": sum(journeys.values()),
+        },
+        "actions": {action: latency_summary(values, elapsed) for action, values in sorted(samples.items())},
+        "metrics": summarize_metrics(before, after, actions),
+        "workers": monitor.report(elapsed),
+        "client_cpu_seconds": (client_after.ru_utime + client_after.ru_stime)
+                              - (client_before.ru_utime + client_before.ru_stime),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the reconciliation app with concurrent Shiny sessions.")
+    parser.add_argument("--sessions", type=int, default=20, help="simulated clerks (default: %(default)s)")
+    parser.add_argument("--duration", type=float, default=60, help="seconds of load after the ramp-up (default: %(default)s)")
+    parser.add_argument("--ramp", type=float, default=10, help="seconds over which the clerks log in (default: %(default)s)")
+    parser.add_argument("--think", type=float, default=1.0, help="mean pause between a clerk's actions, 0 for none")
+    parser.add_argument("--workers", type=int, default=1, help="app workers to start (default: %(default)s)")
+    parser.add_argument("--base-port", type=int, default=LOAD_BASE_PORT)
+    parser.add_argument("--url", action="append", help="drive this running app (repeat for several workers)")
+    parser.add_argument("--no-profile", action="store_true", help="skip the per-action profile")
+    parser.add_argument("--rows", type=int, default=100_000, help="transactions to generate (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--backend", choices=["sqlite", "mysql"], default="sqlite")
+    parser.add_argument("--db-path", help="SQLite file to use (default: a temporary file)")
+    parser.add_argument("--skip-load", action="store_true", help="reuse the data already in the database")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    logging.getLogger("ShinyAppLogger").setLevel(logging.INFO)
+
+    processes, urls, target = [], args.url, None
+    if not urls:
+        data = generator.generate(rows=args.rows, seed=args.seed, years=args.years)
+        target = setup_backend(args, data)
+        if not args.skip_load:
+            started = time.perf_counter()
+            with db.get_connection() as conn:
+                if args.backend == "mysql":
+                    generator.clear(conn)
+                generator.load(conn, data)
+                rollups.rebuild(conn)
+            logger.info(f"Loaded ledger into {target} in {time.perf_counter() - started:.1f}s")
+        env = {"BENCH_STANDIN_DB": target} if args.backend == "sqlite" else {"MYSQL_DATABASE": target}
+        processes, urls = start_workers(args.workers, args.base_port, env, tempfile.mkdtemp(prefix="recon-load-"))
+        logger.info(f"Started {args.workers} worker(s) at {', '.join(urls)}")
+
+    try:
+        profile = None
+        if not args.no_profile:
+            profile = asyncio.run(profile_actions(urls[0]))
+            logger.info("Profiled each action in a single session")
+        logger.info(f"Running {args.sessions} sessions for {args.duration:.0f}s after a {args.ramp:.0f}s ramp-up")
+        load = asyncio.run(run_load(
+            urls, args.sessions, args.duration, args.ramp, args.think, args.seed, [p.pid for p in processes]
+        ))
+    finally:
+        stop_workers(processes)
+
+    throughput = load["throughput"]
+    logger.info(
+        f"{throughput['actions']} actions at {throughput['actions_per_second']:.1f}/s, "
+        f"{throughput['errors']} errors, {load['metrics']['reactive_executions_per_action']:.1f} reactive "
+        f"executions and {load['metrics']['sql_statements_per_action']:.1f} SQL statements per action"
+    )
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "backend": args.backend if target else "external",
+            "rows": args.rows if target else None,
+            "seed": args.seed,
+            "sessions": args.sessions,
+            "workers": len(urls),
+            "duration_s": args.duration,
+            "ramp_s": args.ramp,
+            "think_s": args.think,
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+        },
+        "profile": profile,
+        **load,
+    }
+    text = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
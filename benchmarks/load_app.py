@@ -0,0 +1,22 @@
+#  --- App Entry Point for Load Tests ---
+"""
+The app as benchmarks.load starts it in each worker process:
+
+    python -m uvicorn benchmarks.load_app:app --port 8001
+
+With BENCH_STANDIN_DB set, the app reads and writes that SQLite stand-in
+file; otherwise it uses the MYSQL_* settings like the real app.
+"""
+import os
+
+import db
+from benchmarks import standin
+
+
+BENCH_STANDIN_DB = os.getenv("BENCH_STANDIN_DB")
+
+if BENCH_STANDIN_DB:
+    # must happen before the app module opens its first connection
+    db.configure_pool(connect=lambda: standin.connect(BENCH_STANDIN_DB))
+
+from app import app
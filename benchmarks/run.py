@@ -0,0 +1,447 @@
+#  --- Benchmark Runner for the App's Data Paths ---
+"""
+Times the app's hot data paths against a generated ledger and writes latency
+percentiles and peak memory as JSON, so runs can be compared across commits.
+
+    python -m benchmarks.run --rows 100000 --output bench.json
+    python -m benchmarks.run --backend mysql --rows 1000000 --only history
+
+The default backend is the embedded SQLite stand-in. ``--backend mysql``
+loads into the scratch database named by BENCH_MYSQL_DATABASE (never
+MYSQL_DATABASE) using the other MYSQL_* settings, migrating it first.
+"""
+import os
+import gc
+import sys
+import json
+import time
+import logging
+import asyncio
+import argparse
+import platform
+import itertools
+import subprocess
+import tempfile
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import db
+import auth
+import archive
+import reference
+import rollups
+import schema
+import bulk_import
+import transactions
+from write_queue import WriteQueue
+from queries import load_history_df, load_history_page, load_history_totals, stream_history_csv, period_key
+from history_store import HistoryStore, filter_history, history_totals, page_history
+from benchmarks import generator, standin
+
+
+logger = logging.getLogger("ShinyAppLogger")
+
+PERCENTILES = [50, 90, 95, 99]
+
+
+def measure(name, fn, repeat, warmup=1, setup=None):
+    """
+    The function times ``repeat`` calls of ``fn`` (after ``warmup`` untimed
+    calls), then makes one more call under tracemalloc for peak memory.
+    ``setup`` runs untimed before every call.
+    """
+    for _ in range(warmup):
+        if setup:
+            setup()
+        fn()
+
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        gc.collect()
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+
+    if setup:
+        setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    ms = np.array(timings) * 1000
+    result = {
+        "name": name,
+        "runs": repeat,
+        "mean_ms": float(ms.mean()),
+        "min_ms": float(ms.min()),
+        "max_ms": float(ms.max()),
+        "peak_memory_bytes": int(peak),
+    }
+    for p in PERCENTILES:
+        result[f"p{p}_ms"] = float(np.percentile(ms, p))
+    logger.info(f"{name}: p50={result['p50_ms']:.2f}ms p95={result['p95_ms']:.2f}ms peak={peak / 1e6:.1f}MB")
+    return result
+
+
+def filter_combinations(latest):
+    """The History filter combinations, named like the inputs on the History tab."""
+    dates = {"All": None, "90d": (latest.date() - timedelta(days=90), latest.date())}
+    last = period_key(latest.year, latest.month)
+    periods = {"All": None, "6m": (last - 5, last)}
+    schools = ["All", generator.SCHOOLS[0]]
+    types = ["All", "Payment", "Purchase"]
+    fee_types = ["All", "Feeding"]
+    for (date_label, date_range), (period_label, period_range), school, txn_type, fee_type in itertools.product(
+        dates.items(), periods.items(), schools, types, fee_types
+    ):
+        if date_range and period_range:
+            continue
+        name = f"date={date_label},period={period_label},school={school},type={txn_type},fee={fee_type}"
+        filters = {
+            "start_date": date_range[0] if date_range else None,
+            "end_date": date_range[1] if date_range else None,
+            "school": None if school == "All" else school,
+            "txn_type": None if txn_type == "All" else txn_type,
+            "fee_type": None if fee_type == "All" else fee_type,
+            "period_start": period_range[0] if period_range else None,
+            "period_end": period_range[1] if period_range else None,
+        }
+        yield name, filters
+
+
+def page_cursor(load, page, page_size=50, **filters):
+    """The cursor of History page ``page`` (1-based), found by paging from the first."""
+    cursor = None
+    for _ in range(page - 1):
+        _, cursor = load(cursor=cursor, page_size=page_size, **filters)
+        if cursor is None:
+            break
+    return cursor
+
+
+def login_burst(usernames, attempts, wrong_share=0.5, seed=7):
+    """
+    The function fires ``attempts`` logins at once from one address, a
+    share of them with a wrong password, and times each attempt. With the
+    rate limits and the login queue, the slowest attempt should stay
+    within LOGIN_QUEUE_TIMEOUT however large the burst.
+    """
+    rng = np.random.default_rng(seed)
+    names = [usernames[i] for i in rng.integers(len(usernames), size=attempts)]
+    wrong = rng.random(attempts) < wrong_share
+
+    async def attempt(username, password):
+        started = time.perf_counter()
+        _, message = await auth.authenticate(username, password, client="203.0.113.7")
+        return time.perf_counter() - started, message
+
+    async def burst():
+        # warm the password-check processes before the timed burst
+        await auth.authenticate(usernames[0], b"benchmark", client="192.0.2.1")
+        return await asyncio.gather(*(
+            attempt(name, b"wrong" if bad else b"benchmark") for name, bad in zip(names, wrong)
+        ))
+
+    auth.invalidate_users(broadcast=False)
+    outcomes = asyncio.run(burst())
+    ms = np.array([seconds for seconds, _ in outcomes]) * 1000
+    result = {
+        "name": f"login_burst[{attempts}]",
+        "runs": attempts,
+        "mean_ms": float(ms.mean()),
+        "min_ms": float(ms.min()),
+        "max_ms": float(ms.max()),
+        "outcomes": {message: sum(1 for _, m in outcomes if m == message) for message in {m for _, m in outcomes}},
+    }
+    for p in PERCENTILES:
+        result[f"p{p}_ms"] = float(np.percentile(ms, p))
+    logger.info(f"{result['name']}: p50={result['p50_ms']:.2f}ms p99={result['p99_ms']:.2f}ms {result['outcomes']}")
+    return result
+
+
+def task_form_options():
+    # what task_form, task_details and the typeahead's preload fetch
+    schools = reference.get_schools()
+    school_options = {str(school_id): name for school_id, name in schools}
+    item_options = {str(item_id): item_name for item_id, item_name in reference.get_items()}
+    enrollee_options = {str(enrollee_id): name for enrollee_id, name in reference.search_enrollees(schools[0][1], "")}
+    return school_options, enrollee_options, item_options
+
+
+def type_enrollee_name(school, name):
+    # one typeahead request per keystroke of the first five letters
+    for size in range(1, 6):
+        reference.search_enrollees(school, name[:size])
+
+
+def run_benchmarks(data, repeat, export_repeat, bulk_rows, only=None):
+    rng = np.random.default_rng(7)
+    results = []
+
+    def wanted(name):
+        return only is None or any(part in name for part in only)
+
+    def add(name, fn, runs=repeat, **kwargs):
+        if wanted(name):
+            results.append(measure(name, fn, runs, **kwargs))
+
+    usernames = data["users"]["username"].tolist()
+    add("login_lookup[cold]", lambda: auth.get_user(usernames[rng.integers(len(usernames))]),
+        setup=lambda: auth.invalidate_users(broadcast=False))
+    add("login_lookup[warm]", lambda: auth.get_user(usernames[rng.integers(len(usernames))]))
+    if wanted("login_burst"):
+        results.append(login_burst(usernames, attempts=200))
+
+    add("task_details_cold", task_form_options, setup=reference.invalidate_all)
+    add("task_details_warm", task_form_options)
+
+    enrollees = data["enrollees"]
+    typed = enrollees.iloc[rng.integers(len(enrollees), size=max(repeat, 1))]
+    typed = list(zip(typed["school_name"], typed["last_name"]))
+    add("enrollee_search[cold]", lambda: type_enrollee_name(*typed[rng.integers(len(typed))]),
+        setup=reference.invalidate_all)
+    add("enrollee_search[warm]", lambda: type_enrollee_name(*typed[0]))
+
+    latest = max(data["payments"]["created_at"].max(), data["purchases"]["created_at"].max())
+    combos = list(filter_combinations(latest))
+
+    for name, filters in combos:
+        add(f"history_sql[{name}]", lambda f=filters: load_history_df(**f))
+
+    store = HistoryStore(refresh_interval=0, resync_interval=float("inf"))
+    add("history_store_full_load", lambda: store._full_load(), runs=max(3, repeat // 5))
+    add("history_store_delta", lambda: store.refresh(force=True))
+    store.refresh()
+    frame = store.frame
+    if wanted("history_store_memory"):
+        size = int(frame.memory_usage(deep=True).sum())
+        results.append({
+            "name": "history_store_memory",
+            "rows": len(frame),
+            "bytes": size,
+            "bytes_per_row": size / max(len(frame), 1),
+        })
+        logger.info(f"history_store_memory: {size / max(len(frame), 1):.1f} bytes/row")
+    for name, filters in combos:
+        add(f"history_store[{name}]", lambda f=filters: filter_history(frame, **f))
+
+    def store_page(**kwargs):
+        return page_history(frame, **kwargs)
+
+    # the History table as the app renders it: the first page and a page deep into the results
+    for name, filters in combos:
+        if "date=All,period=All" not in name:
+            continue
+        for source, load in (("sql", load_history_page), ("store", store_page)):
+            add(f"history_page_{source}[first,{name}]", lambda l=load, f=filters: l(**f))
+            if wanted(f"history_page_{source}[page20,{name}]"):
+                cursor = page_cursor(load, 20, **filters)
+                add(f"history_page_{source}[page20,{name}]", lambda l=load, c=cursor, f=filters: l(cursor=c, **f))
+
+    add("totals_cards[sql]", lambda: load_history_totals())
+    add("totals_cards[store]", lambda: history_totals(frame))
+
+    # the Reports tab: its pivots come from the rollup tables, compared with grouping the raw ledger
+    first_year = int(latest.year) - 2
+    add("reports[rollup_load]", rollups.load_rollups)
+    totals = rollups.load_rollups()
+    for view, build in (
+        ("monthly", lambda p, q: rollups.monthly_view(p, q)),
+        ("fees_by_school", lambda p, q: rollups.fees_by_school_view(p)),
+        ("items", lambda p, q: rollups.items_view(q)),
+    ):
+        add(f"reports[{view}]", lambda b=build: b(
+            rollups.select_totals(totals["payments"], first_year, latest.year),
+            rollups.select_totals(totals["purchases"], first_year, latest.year),
+        ))
+    add("reports[raw_ledger_group_by]", raw_payment_totals, runs=max(3, repeat // 5))
+
+    def export():
+        size = 0
+        for chunk in stream_history_csv(chunk_size=5000):
+            size += len(chunk)
+        return size
+
+    add("csv_export", export, runs=export_repeat)
+
+    enrollees = data["enrollees"]
+    payments = data["payments"]
+
+    def single_insert():
+        row = payments.iloc[rng.integers(len(payments))]
+        transactions.record_payment(
+            int(row["enrollee_id"]), row["fee_type"], int(row["amount"]),
+            row["month_paid"], int(row["year_paid"]), int(row["school_id"])
+        )
+
+    add("insert_single_payment", single_insert)
+
+    queue = WriteQueue(os.path.join(tempfile.mkdtemp(prefix="recon-queue-"), "journal.sqlite3"))
+
+    def queue_payments(n):
+        for _ in range(n):
+            row = payments.iloc[rng.integers(len(payments))]
+            queue.submit_payment(
+                int(row["enrollee_id"]), row["fee_type"], int(row["amount"]),
+                row["month_paid"], int(row["year_paid"]), int(row["school_id"])
+            )
+
+    # the clerk-facing latency with WRITE_BEHIND=1, then the cost of writing a burst
+    add("insert_queued_payment", lambda: queue_payments(1), setup=queue.drain)
+    add("write_queue_drain[500]", queue.drain, runs=max(3, repeat // 5), setup=lambda: queue_payments(500))
+
+    sample = payments.sample(bulk_rows, random_state=1, replace=len(payments) < bulk_rows)
+    names = enrollees.set_index("enrollee_id").loc[sample["enrollee_id"]]
+    bulk_frame = pd.DataFrame({
+        "enrollee": (names["first_name"] + " " + names["last_name"]).to_numpy(),
+        "school": names["school_name"].to_numpy(),
+        "fee_type": sample["fee_type"].to_numpy(),
+        "amount": sample["amount"].astype(str).to_numpy(),
+        "month": sample["month_paid"].to_numpy(),
+        "year": sample["year_paid"].astype(str).to_numpy(),
+    })
+    add(f"insert_bulk_payments[{bulk_rows}]", lambda: bulk_import.import_frame(bulk_frame, "payments"),
+        runs=max(3, repeat // 10), warmup=0)
+
+    # last, since it moves rows out of the ledger: the closed years go to the
+    # Parquet archive and the History reads above run again over both
+    if wanted("archived"):
+        archive.ARCHIVE_DIR = tempfile.mkdtemp(prefix="recon-archive-")
+        closed = sorted(int(year) for year in payments["year_paid"].unique() if year < date.today().year)
+        started = time.perf_counter()
+        with db.get_connection() as conn:
+            for year in closed:
+                archive.archive_year(conn, year)
+        results.append({"name": "archive_years", "years": closed, "seconds": time.perf_counter() - started})
+        logger.info(f"archive_years: {closed} in {time.perf_counter() - started:.1f}s")
+
+        everything = "date=All,period=All,school=All,type=All,fee=All"
+        add(f"archived:history_page_sql[first,{everything}]", lambda: load_history_page())
+        cursor = page_cursor(load_history_page, 20)
+        add(f"archived:history_page_sql[page20,{everything}]", lambda: load_history_page(cursor=cursor))
+        add("archived:totals_cards[sql]", lambda: load_history_totals())
+        add("archived:csv_export", export, runs=export_repeat)
+        resync = HistoryStore(refresh_interval=0, resync_interval=float("inf"))
+        add("archived:history_store_full_load", lambda: resync._full_load(), runs=max(3, repeat // 5))
+
+    return results
+
+
+def raw_payment_totals():
+    # what one Reports query would cost without the rollups
+    with db.get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT school_id, fee_type, year_paid, month_paid, COUNT(*), SUM(amount)
+            FROM payments GROUP BY school_id, fee_type, year_paid, month_paid
+        """)
+        return cursor.fetchall()
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def setup_backend(args, data):
+    if args.backend == "sqlite":
+        path = args.db_path or os.path.join(tempfile.mkdtemp(prefix="recon-bench-"), "ledger.sqlite3")
+        if not args.skip_load:
+            if os.path.exists(path):
+                os.remove(path)
+            standin.create_schema(path)
+        db.configure_pool(connect=lambda: standin.connect(path), size=4, max_overflow=4)
+        return path
+
+    import mysql.connector
+
+    database = os.getenv("BENCH_MYSQL_DATABASE")
+    if not database or database == os.getenv("MYSQL_DATABASE"):
+        raise SystemExit("Set BENCH_MYSQL_DATABASE to a scratch database (not MYSQL_DATABASE) for --backend mysql")
+
+    def connect():
+        return mysql.connector.connect(
+            host=os.getenv("MYSQL_HOST"),
+            user=os.getenv("MYSQL_USER"),
+            password=os.getenv("MYSQL_PASSWORD"),
+            database=database,
+        )
+
+    db.configure_pool(connect=connect, size=4, max_overflow=4)
+    with db.get_connection() as conn:
+        schema.migrate(conn)
+    return database
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the reconciliation app's data paths.")
+    parser.add_argument("--rows", type=int, default=100_000, help="transactions to generate (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--backend", choices=["sqlite", "mysql"], default="sqlite")
+    parser.add_argument("--db-path", help="SQLite file to use (default: a temporary file)")
+    parser.add_argument("--skip-load", action="store_true", help="reuse the data already in the database")
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs per benchmark (default: %(default)s)")
+    parser.add_argument("--export-repeat", type=int, default=3)
+    parser.add_argument("--bulk-rows", type=int, default=10_000)
+    parser.add_argument("--only", action="append", help="run only benchmarks whose name contains this text")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    logging.getLogger("ShinyAppLogger").setLevel(logging.INFO)
+
+    started = time.perf_counter()
+    data = generator.generate(rows=args.rows, seed=args.seed, years=args.years)
+    logger.info(f"Generated {args.rows} transactions in {time.perf_counter() - started:.1f}s")
+
+    target = setup_backend(args, data)
+    if not args.skip_load:
+        started = time.perf_counter()
+        with db.get_connection() as conn:
+            if args.backend == "mysql":
+                generator.clear(conn)
+            generator.load(conn, data)
+            rollups.rebuild(conn)
+        logger.info(f"Loaded ledger into {target} in {time.perf_counter() - started:.1f}s")
+
+    results = run_benchmarks(data, args.repeat, args.export_repeat, args.bulk_rows, args.only)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "backend": args.backend,
+            "rows": args.rows,
+            "seed": args.seed,
+            "years": args.years,
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "pool": db.pool_stats(),
+            "reference_cache": reference.cache_stats(),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
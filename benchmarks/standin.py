@@ -0,0 +1,240 @@
+#  --- Embedded SQLite Stand-in for MySQL ---
+"""
+A small adapter that lets the app's data-access code run against an SQLite
+file when no MySQL/MariaDB server is available, for benchmarks and load tests.
+
+It mimics the parts of the mysql.connector connection and cursor API the app
+uses (``cursor(dictionary=, buffered=)``, ``%s`` placeholders, ``fetchmany``,
+``lastrowid``, ``ping``, ...), registers the MySQL functions the queries
+call (``CONCAT``, ``NOW``, ``FIELD``) and rewrites ``ON DUPLICATE KEY UPDATE``. Timings are indicative only: relative
+changes between commits are meaningful, absolute numbers are not MySQL's.
+"""
+import re
+import sqlite3
+from datetime import datetime
+from decimal import Decimal
+
+from schema import MIGRATIONS
+
+
+# The SQLite equivalent of every migration in schema.py; create_schema()
+# records them as applied. Keep the two in step.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL UNIQUE,
+    password_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS school_types (
+    school_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    school_name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS enrollees (
+    enrollee_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    first_name TEXT NOT NULL,
+    last_name TEXT NOT NULL,
+    school_name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_enrollees_school ON enrollees (school_name, last_name, first_name);
+CREATE INDEX IF NOT EXISTS idx_enrollees_school_first ON enrollees (school_name, first_name, last_name);
+CREATE TABLE IF NOT EXISTS items (
+    item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    item_name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS payments (
+    payment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    enrollee_id INTEGER NOT NULL,
+    fee_type TEXT NOT NULL,
+    amount NUMERIC NOT NULL,
+    month_paid TEXT NOT NULL,
+    year_paid INTEGER NOT NULL,
+    school_id INTEGER NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_payments_created_at ON payments (created_at);
+CREATE INDEX IF NOT EXISTS idx_payments_school_fee ON payments (school_id, fee_type);
+CREATE TABLE IF NOT EXISTS purchases (
+    purchase_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    item_id INTEGER NOT NULL,
+    quantity TEXT,
+    amount NUMERIC NOT NULL,
+    school_id INTEGER NOT NULL,
+    month_paid TEXT NOT NULL,
+    year_paid INTEGER NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_purchases_created_at ON purchases (created_at);
+CREATE TABLE IF NOT EXISTS fee_schedule (
+    school_id INTEGER NOT NULL,
+    fee_type TEXT NOT NULL,
+    month_paid TEXT NOT NULL,
+    year_paid INTEGER,
+    amount NUMERIC NOT NULL
+);
+CREATE TABLE IF NOT EXISTS payment_totals (
+    school_id INTEGER NOT NULL,
+    fee_type TEXT NOT NULL,
+    year_paid INTEGER NOT NULL,
+    month_no INTEGER NOT NULL,
+    payment_count INTEGER NOT NULL,
+    amount NUMERIC NOT NULL,
+    PRIMARY KEY (school_id, fee_type, year_paid, month_no)
+);
+CREATE TABLE IF NOT EXISTS purchase_totals (
+    item_id INTEGER NOT NULL,
+    school_id INTEGER NOT NULL,
+    year_paid INTEGER NOT NULL,
+    month_no INTEGER NOT NULL,
+    purchase_count INTEGER NOT NULL,
+    amount NUMERIC NOT NULL,
+    PRIMARY KEY (item_id, school_id, year_paid, month_no)
+);
+CREATE TABLE IF NOT EXISTS write_queue_applied (
+    submission_key TEXT NOT NULL PRIMARY KEY,
+    applied_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS archive_files (
+    path TEXT NOT NULL PRIMARY KEY,
+    ledger TEXT NOT NULL,
+    year_paid INTEGER NOT NULL,
+    school_id INTEGER NOT NULL,
+    school_name TEXT NOT NULL,
+    row_count INTEGER NOT NULL,
+    amount NUMERIC NOT NULL,
+    archived_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_archive_files_year ON archive_files (year_paid);
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    description TEXT NOT NULL,
+    applied_at TEXT NOT NULL
+);
+"""
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_adapter(datetime, lambda value: value.strftime(TIMESTAMP_FORMAT))
+
+_PLACEHOLDER = re.compile(r"%s")
+_UPSERT = re.compile(r"\bON\s+DUPLICATE\s+KEY\s+UPDATE\b", re.IGNORECASE)
+_INSERTED_VALUE = re.compile(r"\bVALUES\((\w+)\)", re.IGNORECASE)
+
+
+def _concat(*parts):
+    if any(part is None for part in parts):
+        return None
+    return "".join(str(part) for part in parts)
+
+
+def _now():
+    return datetime.now().strftime(TIMESTAMP_FORMAT)
+
+
+def _field(value, *options):
+    try:
+        return options.index(value) + 1
+    except ValueError:
+        return 0
+
+
+def translate(sql):
+    """The function rewrites the MySQL dialect used by the app into SQLite."""
+    upsert = _UPSERT.search(sql)
+    if upsert:
+        # VALUES(col) in the update list is SQLite's excluded.col
+        update = _INSERTED_VALUE.sub(r"excluded.\1", sql[upsert.end():])
+        sql = sql[:upsert.start()] + "ON CONFLICT DO UPDATE SET" + update
+    return _PLACEHOLDER.sub("?", sql)
+
+
+class StandinCursor:
+    def __init__(self, conn, dictionary=False):
+        self._cursor = conn.cursor()
+        self._dictionary = dictionary
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def execute(self, sql, params=()):
+        self._cursor.execute(translate(sql), tuple(params or ()))
+
+    def executemany(self, sql, seq_of_params):
+        self._cursor.executemany(translate(sql), [tuple(p) for p in seq_of_params])
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return dict(zip([d[0] for d in self._cursor.description], row))
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchmany(self, size=1):
+        return [self._row(r) for r in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._row(r) for r in self._cursor.fetchall()]
+
+    def close(self):
+        self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class StandinConnection:
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.create_function("CONCAT", -1, _concat, deterministic=True)
+        self._conn.create_function("NOW", 0, _now)
+        self._conn.create_function("FIELD", -1, _field, deterministic=True)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+
+    def cursor(self, dictionary=False, buffered=True):
+        return StandinCursor(self._conn, dictionary=dictionary)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        self._conn.execute("SELECT 1")
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        self._conn.close()
+
+
+def connect(path):
+    return StandinConnection(path)
+
+
+def create_schema(path):
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(SCHEMA)
+        conn.executemany(
+            "INSERT OR IGNORE INTO schema_migrations (version, description, applied_at) VALUES (?, ?, ?)",
+            [(version, description, _now()) for version, description, _ in MIGRATIONS],
+        )
+        conn.commit()
+    finally:
+        conn.close()
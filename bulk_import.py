@@ -0,0 +1,293 @@
+#  --- Bulk Import of Payments and Purchases ---
+import os
+import sys
+import logging
+import argparse
+from datetime import datetime
+from decimal import Decimal
+
+import pandas as pd
+
+import rollups
+from db import get_connection
+from history_store import history_store
+from reference import MONTHS, FEE_TYPES
+
+
+logger = logging.getLogger("ShinyAppLogger")
+
+DEFAULT_BATCH_SIZE = int(os.getenv("BULK_IMPORT_BATCH_SIZE", "1000"))
+
+REQUIRED_COLUMNS = {
+    "payments": ["enrollee", "school", "fee_type", "amount", "month", "year"],
+    "purchases": ["item", "school", "quantity", "amount", "month", "year"],
+}
+
+INSERT_SQL = {
+    "payments": """
+        INSERT INTO payments (enrollee_id, fee_type, amount, month_paid, year_paid, school_id, created_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+    """,
+    "purchases": """
+        INSERT INTO purchases (item_id, quantity, amount, school_id, month_paid, year_paid, created_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+    """,
+}
+
+# picks the rollup arguments out of an INSERT_SQL parameter tuple
+ROLLUP = {
+    "payments": (rollups.add_payments, lambda p: (p[5], p[1], p[3], p[4], p[2])),
+    "purchases": (rollups.add_purchases, lambda p: (p[0], p[3], p[4], p[5], p[2])),
+}
+
+ERROR_COLUMNS = ["row", "error"]
+
+# "inf" parses as a number; "nan" parses as missing and is caught with the blanks
+INFINITY = float("inf")
+
+
+def read_table(source, filename=None):
+    """
+    The function reads a CSV or Excel upload into a DataFrame of strings,
+    with normalised (lower-case, snake_case) column names
+    """
+    name = (filename or str(source)).lower()
+    if name.endswith((".xlsx", ".xls")):
+        df = pd.read_excel(source, dtype=str)
+    else:
+        df = pd.read_csv(source, dtype=str, skipinitialspace=True)
+    df.columns = [str(c).strip().lower().replace(" ", "_") for c in df.columns]
+    return df.fillna("")
+
+
+def validate(df, kind):
+    """
+    The function checks every row of an import in one vectorised pass.
+
+    Returns the cleaned rows that passed, plus a DataFrame of ``row``/``error``
+    pairs (``row`` is the 1-based line number in the source file, after the
+    header) for the rows that did not.
+    """
+    missing = [c for c in REQUIRED_COLUMNS[kind] if c not in df.columns]
+    if missing:
+        raise ValueError(f"Missing required column(s): {', '.join(missing)}")
+
+    clean = pd.DataFrame(index=df.index)
+    problems = []
+
+    for column in ("school", "enrollee" if kind == "payments" else "item"):
+        clean[column] = df[column].str.strip()
+        problems.append((clean[column] == "", f"{column} is required"))
+
+    amount = pd.to_numeric(df["amount"].str.replace(",", "", regex=False), errors="coerce")
+    problems.append((amount.isna() | (amount < 0) | (amount == INFINITY), "amount must be a non-negative number"))
+    clean["amount"] = df["amount"].str.replace(",", "", regex=False).str.strip()
+
+    year = pd.to_numeric(df["year"], errors="coerce")
+    problems.append((year.isna() | (year < 1900) | (year > 2100) | (year % 1 != 0), "year must be a whole year"))
+    clean["year"] = year
+
+    clean["month"] = df["month"].str.strip().str.title()
+    problems.append((~clean["month"].isin(MONTHS), "month must be a full month name"))
+
+    if kind == "payments":
+        clean["fee_type"] = df["fee_type"].str.strip().str.title()
+        problems.append((~clean["fee_type"].isin(FEE_TYPES), f"fee_type must be one of {', '.join(FEE_TYPES)}"))
+    else:
+        quantity = pd.to_numeric(df["quantity"], errors="coerce")
+        problems.append((quantity.isna() | (quantity <= 0) | (quantity == INFINITY), "quantity must be a positive number"))
+        clean["quantity"] = df["quantity"].str.strip()
+
+    if "created_at" in df.columns:
+        provided = df["created_at"].str.strip() != ""
+        created_at = pd.to_datetime(df["created_at"].where(provided), errors="coerce")
+        problems.append((provided & created_at.isna(), "created_at is not a valid date"))
+        clean["created_at"] = created_at
+    else:
+        clean["created_at"] = pd.NaT
+
+    bad = pd.Series(False, index=df.index)
+    messages = pd.Series("", index=df.index)
+    for mask, message in problems:
+        mask = mask.fillna(True)
+        messages = messages.where(~mask, messages + "; " + message)
+        bad |= mask
+
+    errors = pd.DataFrame({"row": df.index[bad] + 1, "error": messages[bad].str.lstrip("; ")})
+    return clean[~bad], errors.reset_index(drop=True)
+
+
+def _in_clause(values):
+    return ", ".join(["%s"] * len(values))
+
+
+def resolve_ids(cursor, df, kind):
+    """
+    The function maps school, enrollee and item names to their ids with one
+    query per lookup table for the whole import, rather than per row.
+    Returns the resolved rows and the unresolved ones as errors.
+    """
+    schools = sorted(df["school"].unique())
+    school_ids = pd.DataFrame(columns=["school", "school_id"])
+    if schools:
+        cursor.execute(
+            f"SELECT school_name, school_id FROM school_types WHERE school_name IN ({_in_clause(schools)})",
+            schools,
+        )
+        school_ids = pd.DataFrame(cursor.fetchall(), columns=["school", "school_id"])
+    resolved = df.reset_index().merge(school_ids, on="school", how="left")
+
+    if kind == "payments":
+        lookup = pd.DataFrame(columns=["enrollee", "school", "enrollee_id"])
+        if schools:
+            cursor.execute(f"""
+                SELECT CONCAT(first_name, ' ', last_name) AS name, school_name, enrollee_id
+                FROM enrollees
+                WHERE school_name IN ({_in_clause(schools)})
+            """, schools)
+            lookup = pd.DataFrame(cursor.fetchall(), columns=["enrollee", "school", "enrollee_id"])
+        ambiguous = lookup[lookup.duplicated(["enrollee", "school"], keep=False)][["enrollee", "school"]]
+        lookup = lookup.drop_duplicates(["enrollee", "school"], keep=False)
+        resolved = resolved.merge(lookup, on=["enrollee", "school"], how="left")
+        key, target, label = ["enrollee", "school"], "enrollee_id", "enrollee not found in school"
+        is_ambiguous = resolved.set_index(key).index.isin(ambiguous.set_index(key).index)
+    else:
+        items = sorted(df["item"].unique())
+        lookup = pd.DataFrame(columns=["item", "item_id"])
+        if items:
+            cursor.execute(f"SELECT item_name, item_id FROM items WHERE item_name IN ({_in_clause(items)})", items)
+            lookup = pd.DataFrame(cursor.fetchall(), columns=["item", "item_id"])
+        resolved = resolved.merge(lookup, on="item", how="left")
+        target, label = "item_id", "unknown item"
+        is_ambiguous = pd.Series(False, index=resolved.index).to_numpy()
+
+    no_school = resolved["school_id"].isna()
+    no_target = resolved[target].isna() & ~no_school
+    messages = pd.Series("", index=resolved.index)
+    messages[no_school] = "unknown school"
+    messages[no_target] = label
+    messages[is_ambiguous] = "enrollee name is ambiguous within school"
+
+    bad = messages != ""
+    errors = pd.DataFrame({"row": resolved.loc[bad, "index"] + 1, "error": messages[bad]})
+    return resolved[~bad].set_index("index"), errors.reset_index(drop=True)
+
+
+def build_params(df, kind, now=None):
+    """The function converts resolved rows into driver-ready parameter tuples."""
+    now = now or datetime.now().replace(microsecond=0)
+    created = [now if pd.isna(ts) else ts.to_pydatetime() for ts in df["created_at"]]
+    amounts = [Decimal(a) for a in df["amount"]]
+    years = [int(y) for y in df["year"]]
+    school_ids = [int(s) for s in df["school_id"]]
+    if kind == "payments":
+        return list(zip(
+            [int(e) for e in df["enrollee_id"]], df["fee_type"], amounts, df["month"], years, school_ids, created
+        ))
+    return list(zip(
+        [int(i) for i in df["item_id"]], df["quantity"], amounts, school_ids, df["month"], years, created
+    ))
+
+
+def insert_batches(conn, kind, rows, row_numbers, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    The function inserts ``rows`` with ``executemany`` in transactions of
+    ``batch_size`` rows, adding each batch to its rollup table in the same
+    transaction. A batch that fails is rolled back and retried row by row so
+    the offending rows can be reported. Returns ``(inserted, errors)``.
+    """
+    sql = INSERT_SQL[kind]
+    add_to_rollup, rollup_args = ROLLUP[kind]
+    inserted = 0
+    errors = []
+    with conn.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            try:
+                cursor.executemany(sql, batch)
+                add_to_rollup(cursor, [rollup_args(params) for params in batch])
+                conn.commit()
+                inserted += len(batch)
+                continue
+            except Exception:
+                conn.rollback()
+                logger.warning(f"Bulk {kind} batch starting at row {row_numbers[start]} failed; retrying row by row")
+
+            for offset, params in enumerate(batch):
+                try:
+                    cursor.execute(sql, params)
+                    add_to_rollup(cursor, [rollup_args(params)])
+                    conn.commit()
+                    inserted += 1
+                except Exception as e:
+                    conn.rollback()
+                    errors.append({"row": row_numbers[start + offset], "error": str(e)})
+    return inserted, errors
+
+
+def import_frame(df, kind, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    The function validates, resolves and inserts an import DataFrame.
+    Returns a dict with the row counts and a DataFrame of per-row errors.
+    """
+    if kind not in REQUIRED_COLUMNS:
+        raise ValueError(f"Unknown import kind: {kind}")
+
+    started = datetime.now()
+    valid, errors = validate(df, kind)
+    error_frames = [errors]
+    inserted = 0
+
+    if not valid.empty:
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                resolved, unresolved = resolve_ids(cursor, valid, kind)
+            error_frames.append(unresolved)
+            if not resolved.empty:
+                rows = build_params(resolved, kind)
+                row_numbers = [int(i) + 1 for i in resolved.index]
+                inserted, failed = insert_batches(conn, kind, rows, row_numbers, batch_size)
+                error_frames.append(pd.DataFrame(failed, columns=ERROR_COLUMNS))
+                if inserted:
+                    history_store.mark_dirty()
+
+    all_errors = pd.concat(error_frames, ignore_index=True).sort_values("row").reset_index(drop=True)
+    elapsed = (datetime.now() - started).total_seconds()
+    logger.info(f"Bulk {kind} import: {inserted} inserted, {len(all_errors)} rejected in {elapsed:.2f}s")
+    return {
+        "kind": kind,
+        "total": len(df),
+        "inserted": inserted,
+        "rejected": len(all_errors),
+        "seconds": elapsed,
+        "errors": all_errors,
+    }
+
+
+def import_file(source, kind, batch_size=DEFAULT_BATCH_SIZE, filename=None):
+    """The function imports a CSV or Excel file of payments or purchases."""
+    return import_frame(read_table(source, filename), kind, batch_size)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import payments or purchases from CSV/Excel.")
+    parser.add_argument("kind", choices=sorted(REQUIRED_COLUMNS))
+    parser.add_argument("path", help="CSV or Excel file to import")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="rows per INSERT transaction (default: %(default)s)")
+    parser.add_argument("--errors", help="write rejected rows and reasons to this CSV file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    result = import_file(args.path, args.kind, batch_size=args.batch_size)
+    print(f"{result['inserted']} of {result['total']} {args.kind} imported "
+          f"({result['rejected']} rejected) in {result['seconds']:.2f}s")
+    if args.errors and not result["errors"].empty:
+        result["errors"].to_csv(args.errors, index=False)
+    elif not result["errors"].empty:
+        print(result["errors"].head(20).to_string(index=False))
+    return 0 if result["rejected"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
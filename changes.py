@@ -0,0 +1,138 @@
+#  --- Change Notifications Shared by the Workers on a Host ---
+import os
+import sqlite3
+import logging
+import threading
+
+from metrics import registry
+
+
+logger = logging.getLogger("ShinyAppLogger")
+
+CHANGES_PATH = os.getenv("CHANGES_PATH", "changes.sqlite3")
+CHANGES_POLL_SECONDS = float(os.getenv("CHANGES_POLL_SECONDS", "1"))
+
+SCHEMA_SQL = "CREATE TABLE IF NOT EXISTS changes (topic TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+
+published_total = registry.counter(
+    "recon_changes_published_total", "Changes this process announced to the other workers.", labels=("topic",)
+)
+received_total = registry.counter(
+    "recon_changes_received_total", "Changes announced by other processes and applied here.", labels=("topic",)
+)
+
+
+class ChangeCounter:
+    """
+    Per-topic change counters in a small SQLite file shared by every
+    process on the host: the app workers and the command-line tools.
+
+    A process that changes shared data updates its own caches and bumps the
+    topic's counter with publish(). Every app worker polls the counters
+    every ``poll_interval`` seconds and runs the callbacks subscribed to the
+    topics whose counter moved, e.g. to drop its cached enrollee lists.
+    The counters are hints: if the file cannot be used, the caches still
+    expire on their own TTLs.
+    """
+
+    def __init__(self, path, poll_interval=1.0):
+        self.path = path
+        self.poll_interval = poll_interval
+        self._conn = None
+        self._seen = None
+        self._callbacks = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _connection(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # a counter lost in a power cut only delays an invalidation until the TTL
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(SCHEMA_SQL)
+            self._conn = conn
+        return self._conn
+
+    def subscribe(self, topic, callback):
+        """The method runs ``callback()`` whenever another process publishes ``topic``."""
+        self._callbacks.setdefault(topic, []).append(callback)
+
+    def publish(self, topic):
+        """
+        The method tells the other processes that ``topic`` changed. The
+        caller has already updated its own process, so this one does not
+        run its callbacks for the change.
+        """
+        try:
+            with self._lock:
+                conn = self._connection()
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.execute(
+                        "INSERT INTO changes (topic, version) VALUES (?, 1) "
+                        "ON CONFLICT (topic) DO UPDATE SET version = version + 1",
+                        (topic,),
+                    )
+                    (version,) = conn.execute("SELECT version FROM changes WHERE topic = ?", (topic,)).fetchone()
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+                if self._seen is not None:
+                    self._seen[topic] = version
+            published_total.inc(topic)
+        except Exception:
+            logger.warning(f"Could not publish a change to {topic!r} in {self.path}", exc_info=True)
+
+    def poll(self):
+        """
+        The method runs the callbacks of the topics other processes changed
+        since the last poll (the first poll only records the counters).
+        Returns those topics.
+        """
+        with self._lock:
+            versions = dict(self._connection().execute("SELECT topic, version FROM changes").fetchall())
+            if self._seen is None:
+                self._seen = versions
+                return []
+            changed = [topic for topic, version in versions.items() if self._seen.get(topic) != version]
+            self._seen.update(versions)
+
+        for topic in changed:
+            received_total.inc(topic)
+            for callback in self._callbacks.get(topic, ()):
+                try:
+                    callback()
+                except Exception:
+                    logger.exception(f"Error applying a change to {topic!r}")
+        return changed
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.poll()
+            except Exception:
+                logger.warning(f"Could not poll the change counters in {self.path}", exc_info=True)
+
+    def start(self):
+        """The method starts the background thread that polls the counters."""
+        if self._thread is None:
+            try:
+                self.poll()
+            except Exception:
+                logger.warning(f"Could not read the change counters in {self.path}", exc_info=True)
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="changes", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+
+changes = ChangeCounter(CHANGES_PATH, CHANGES_POLL_SECONDS)
@@ -0,0 +1,255 @@
+#  --- Database Access ---
+import os
+import time
+import queue
+import logging
+import threading
+from contextlib import contextmanager
+
+import mysql.connector
+
+from metrics import registry, InstrumentedConnection
+
+
+logger = logging.getLogger("ShinyAppLogger")
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes available within the timeout."""
+
+
+def mysql_connect():
+    """
+    The function opens a new raw connection with the MYSQL Database
+    using the environment configuration
+    """
+    return mysql.connector.connect(
+        host=os.getenv("MYSQL_HOST"),
+        user=os.getenv("MYSQL_USER"),
+        password=os.getenv("MYSQL_PASSWORD"),
+        database=os.getenv("MYSQL_DATABASE")
+    )
+
+
+class ConnectionPool:
+    """
+    A thread-safe pool of reusable database connections.
+
+    ``size`` connections are kept open once created; up to ``max_overflow``
+    extra connections may be opened under load and are closed again when
+    returned. Connections are health-checked on checkout and recycled after
+    ``recycle`` seconds. A thread waiting for a connection is woken when one
+    is returned or when a closed one frees room to open another.
+    """
+
+    def __init__(self, connect=mysql_connect, size=5, max_overflow=10, timeout=30.0, recycle=3600):
+        self._connect = connect
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        # notified whenever a connection is returned or one is closed
+        self._available = threading.Condition(self._lock)
+        self._created_at = {}
+        self._open = 0
+        self._in_use = 0
+        self._checkouts = 0
+        self._wait_time = 0.0
+        self._timeouts = 0
+        self._reconnects = 0
+
+    def _new_connection(self):
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._available:
+                self._open -= 1
+                self._available.notify()
+            logger.exception("Database connection error")
+            raise
+        with self._lock:
+            self._created_at[id(conn)] = time.monotonic()
+        logger.debug("Database connection established")
+        return conn
+
+    def _close(self, conn):
+        with self._available:
+            self._created_at.pop(id(conn), None)
+            self._open -= 1
+            self._available.notify()
+        try:
+            conn.close()
+        except Exception:
+            logger.debug("Ignoring error while closing connection", exc_info=True)
+
+    def _healthy(self, conn):
+        with self._lock:
+            created = self._created_at.get(id(conn), 0)
+        if self.recycle and time.monotonic() - created > self.recycle:
+            return False
+        try:
+            conn.ping(reconnect=True, attempts=1, delay=0)
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        """Check a connection out of the pool, opening or waiting for one as needed."""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        conn = None
+        with self._available:
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                    break
+                except queue.Empty:
+                    pass
+                if self._open < self.size + self.max_overflow:
+                    self._open += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(
+                        f"No database connection available after {self.timeout}s "
+                        f"(size={self.size}, max_overflow={self.max_overflow})"
+                    )
+                self._available.wait(remaining)
+        if conn is None:
+            conn = self._new_connection()
+
+        if not self._healthy(conn):
+            logger.info("Replacing stale database connection")
+            # the replacement keeps the stale connection's place, so no waiter can take it in between
+            with self._lock:
+                self._created_at.pop(id(conn), None)
+                self._reconnects += 1
+            try:
+                conn.close()
+            except Exception:
+                logger.debug("Ignoring error while closing connection", exc_info=True)
+            conn = self._new_connection()
+
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._wait_time += time.monotonic() - started
+        return conn
+
+    def release(self, conn):
+        """Return a connection to the pool, discarding it if it cannot be reset."""
+        with self._lock:
+            self._in_use -= 1
+        try:
+            conn.rollback()
+        except Exception:
+            self._close(conn)
+            return
+        with self._available:
+            try:
+                self._idle.put_nowait(conn)
+                self._available.notify()
+                return
+            except queue.Full:
+                pass
+        self._close(conn)
+
+    def dispose(self):
+        """Close every idle connection held by the pool."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._close(conn)
+
+    def stats(self):
+        """Return a snapshot of the pool counters."""
+        with self._lock:
+            checkouts = self._checkouts
+            return {
+                "size": self.size,
+                "max_overflow": self.max_overflow,
+                "open": self._open,
+                "idle": self._idle.qsize(),
+                "in_use": self._in_use,
+                "checkouts": checkouts,
+                "wait_time_total": self._wait_time,
+                "wait_time_avg": self._wait_time / checkouts if checkouts else 0.0,
+                "timeouts": self._timeouts,
+                "reconnects": self._reconnects,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    The function returns the process-wide connection pool,
+    creating it from the environment configuration on first use
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    size=int(os.getenv("MYSQL_POOL_SIZE", "5")),
+                    max_overflow=int(os.getenv("MYSQL_POOL_MAX_OVERFLOW", "10")),
+                    timeout=float(os.getenv("MYSQL_POOL_TIMEOUT", "30")),
+                    recycle=int(os.getenv("MYSQL_POOL_RECYCLE", "3600")),
+                )
+    return _pool
+
+
+def configure_pool(connect=mysql_connect, **options):
+    """
+    The function replaces the process-wide pool, e.g. to point the app
+    at a different database or change the pool limits
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.dispose()
+        _pool = ConnectionPool(connect=connect, **options)
+    return _pool
+
+
+def pool_stats():
+    return get_pool().stats()
+
+
+def _pool_metrics():
+    stats = pool_stats()
+    yield "recon_db_pool_connections", "Pooled database connections by state.", "gauge", {
+        (("state", "open"),): stats["open"],
+        (("state", "idle"),): stats["idle"],
+        (("state", "in_use"),): stats["in_use"],
+    }
+    yield "recon_db_pool_checkouts_total", "Connections checked out of the pool.", "counter", {(): stats["checkouts"]}
+    yield "recon_db_pool_wait_seconds_total", "Time spent waiting for a pooled connection.", "counter", {(): stats["wait_time_total"]}
+    yield "recon_db_pool_timeouts_total", "Checkouts that timed out waiting for a connection.", "counter", {(): stats["timeouts"]}
+    yield "recon_db_pool_reconnects_total", "Stale connections replaced on checkout.", "counter", {(): stats["reconnects"]}
+
+
+registry.add_collector(_pool_metrics)
+
+
+@contextmanager
+def get_connection():
+    """
+    The function checks a connection out of the MYSQL connection pool
+    and returns it to the pool when the block exits. Uncommitted work is
+    rolled back on return. Every statement run through it is timed for
+    the metrics endpoint.
+    """
+    pool = get_pool()
+    conn = pool.acquire()
+    try:
+        yield InstrumentedConnection(conn)
+    finally:
+        pool.release(conn)
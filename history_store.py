@@ -0,0 +1,404 @@
+#  --- Shared Incremental History Store ---
+import os
+import time
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+import archive
+from changes import changes
+from db import get_connection
+from metrics import registry
+from queries import HISTORY_COLUMNS, period_key
+from reference import MONTHS
+from reconciliation import to_kobo, month_number
+
+
+logger = logging.getLogger("ShinyAppLogger")
+
+LEDGER_SQL = """
+    SELECT 'Payment' AS Type, p.payment_id AS id, CONCAT(e.first_name, ' ', e.last_name) AS Name,
+           p.amount AS Amount, p.fee_type AS Category, p.month_paid, p.year_paid,
+           p.created_at, st.school_name AS School
+    FROM payments p
+    JOIN enrollees e ON p.enrollee_id = e.enrollee_id
+    LEFT JOIN school_types st ON st.school_id = p.school_id
+    WHERE {payment_ids}
+    UNION ALL
+    SELECT 'Purchase' AS Type, pu.purchase_id AS id, i.item_name AS Name,
+           pu.amount AS Amount, pu.quantity AS Category, pu.month_paid, pu.year_paid,
+           pu.created_at, st.school_name AS School
+    FROM purchases pu
+    JOIN items i ON pu.item_id = i.item_id
+    LEFT JOIN school_types st ON st.school_id = pu.school_id
+    WHERE {purchase_ids}
+"""
+
+# id columns the delta query filters per ledger side
+ID_COLUMNS = {"Payment": "p.payment_id", "Purchase": "pu.purchase_id"}
+
+# gap ranges held per side; the oldest are dropped beyond this
+MAX_GAPS = 1000
+
+QUERY_COLUMNS = ["Type", "id", "Name", "Amount", "Category", "month_paid", "year_paid", "created_at", "School"]
+
+LEDGER_COLUMNS = ["Type", "id", "Name", "Category", "School", "year", "month", "Period", "created_at", "amount_kobo"]
+
+# the ledger order: oldest first, ties broken by type and id
+SORT_COLUMNS = ["created_at", "Type", "id"]
+
+TYPES = pd.CategoricalDtype(["Payment", "Purchase"])
+
+# index 0 labels months the ledger could not recognise
+_MONTH_LABELS = np.array(["Unknown"] + MONTHS, dtype=object)
+
+
+def _typed(rows):
+    """
+    The function converts the ledger query rows into the compact frame the
+    store holds: categorical text, int16 year and month, datetime64
+    timestamps and integer kobo amounts (so totals never drift). The
+    "January 2024" period labels are kept as a categorical alongside.
+    """
+    year = pd.to_numeric(rows["year_paid"]).astype("int16").to_numpy()
+    month = month_number(rows["month_paid"])
+    return pd.DataFrame({
+        "Type": pd.Series(rows["Type"], dtype=TYPES),
+        "id": rows["id"].astype("int64"),
+        "Name": rows["Name"].astype("category"),
+        "Category": rows["Category"].astype(str).astype("category"),
+        "School": rows["School"].astype("category"),
+        "year": year,
+        "month": month,
+        "Period": period_labels(year, month),
+        "created_at": pd.to_datetime(rows["created_at"]),
+        "amount_kobo": to_kobo(rows["Amount"]),
+    })
+
+
+def _append(frame, new):
+    """The function appends ``new`` to ``frame``, keeping the categorical columns categorical."""
+    columns = {}
+    for name in LEDGER_COLUMNS:
+        if isinstance(frame[name].dtype, pd.CategoricalDtype) and name != "Type":
+            columns[name] = union_categoricals([frame[name], new[name]])
+        else:
+            columns[name] = pd.concat([frame[name], new[name]], ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+def period_labels(years, months):
+    """
+    The function labels periods as "January 2024", building each distinct
+    label once and returning them as a categorical
+    """
+    keys = np.asarray(years, dtype="int32") * 16 + np.asarray(months, dtype="int32")
+    if not len(keys):
+        return pd.Categorical([])
+    # periods span a narrow range of keys, so a dense lookup beats sorting the rows
+    low = keys.min()
+    present = np.zeros(keys.max() - low + 1, dtype=bool)
+    present[keys - low] = True
+    codes = (np.cumsum(present) - 1)[keys - low]
+    labels = [f"{_MONTH_LABELS[key % 16]} {key // 16}" for key in np.flatnonzero(present) + low]
+    return pd.Categorical.from_codes(codes, labels)
+
+
+def missing_ids(ids, low, high):
+    """
+    The function returns the ranges of ids between ``low`` and ``high``
+    (inclusive) that are not in the sorted array ``ids``, as (first, last) pairs
+    """
+    ids = np.asarray(ids, dtype="int64")
+    ids = ids[(ids >= low) & (ids <= high)]
+    bounds = np.concatenate([[low - 1], ids, [high + 1]])
+    jumps = np.flatnonzero(np.diff(bounds) > 1)
+    return list(zip((bounds[jumps] + 1).tolist(), (bounds[jumps + 1] - 1).tolist()))
+
+
+def ledger_periods(frame):
+    """The function returns the period keys present in a ledger frame."""
+    months = frame["month"].to_numpy()
+    keys = period_key(frame["year"].to_numpy(dtype="int32"), months.astype("int32"))
+    return np.unique(keys[months > 0]).tolist()
+
+
+class HistoryStore:
+    """
+    An in-process copy of the payments and purchases ledger shared by every
+    session in the worker.
+
+    The ledger is loaded once and then topped up with a delta query for rows
+    whose primary key is above the high-water mark of each table. Since
+    auto-increment ids can commit out of order (a 1000-row import batch can
+    commit after a single insert with a higher id), the store also keeps the
+    ranges of ids below the mark that it has not seen, and each delta
+    re-reads them. A gap still empty after ``gap_timeout`` seconds is taken
+    to be a rolled-back insert or a deleted row and no longer re-read. A
+    full reload every ``resync_interval`` seconds picks up edits and
+    deletes, and anything committed later than ``gap_timeout``. Archived years
+    are read from their Parquet files once per archive version and kept
+    typed, so a reload only queries the open years.
+    """
+
+    def __init__(self, refresh_interval=5.0, resync_interval=900.0, gap_timeout=300.0):
+        self.refresh_interval = refresh_interval
+        self.resync_interval = resync_interval
+        self.gap_timeout = gap_timeout
+        self.frame = _typed(pd.DataFrame(columns=QUERY_COLUMNS))
+        self.version = 0
+        self._marks = {"Payment": 0, "Purchase": 0}
+        # (first id, last id, monotonic time first seen) per side
+        self._gaps = {"Payment": [], "Purchase": []}
+        self._archived = None
+        self._archive_version = None
+        self._loaded_at = None
+        self._refreshed_at = 0.0
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def _query(self, marks, gaps=None):
+        clauses, params = {}, []
+        for kind, column in ID_COLUMNS.items():
+            ranges = (gaps or {}).get(kind, [])
+            clauses[kind] = " OR ".join([f"{column} > %s", *[f"{column} BETWEEN %s AND %s"] * len(ranges)])
+            params += [marks[kind], *[bound for low, high, _ in ranges for bound in (low, high)]]
+        sql = LEDGER_SQL.format(payment_ids=f"({clauses['Payment']})", purchase_ids=f"({clauses['Purchase']})")
+        with get_connection() as conn, conn.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        return _typed(pd.DataFrame(rows, columns=QUERY_COLUMNS))
+
+    def _ids(self, frame, kind):
+        return np.sort(frame.loc[frame["Type"] == kind, "id"].to_numpy())
+
+    def _track_gaps(self, new, now):
+        # before the marks move: fill the gaps ``new`` landed in, then add the
+        # ids it skipped above the old mark
+        for kind, gaps in self._gaps.items():
+            ids = self._ids(new, kind)
+            if not len(ids):
+                continue
+            kept = []
+            for low, high, seen in gaps:
+                kept += [(first, last, seen) for first, last in missing_ids(ids, low, high)]
+            mark = self._marks[kind]
+            kept += [(first, last, now) for first, last in missing_ids(ids, mark + 1, int(ids[-1]))]
+            self._gaps[kind] = kept[-MAX_GAPS:]
+
+    def _expire_gaps(self, now):
+        for kind, gaps in self._gaps.items():
+            kept = [gap for gap in gaps if now - gap[2] < self.gap_timeout]
+            if len(kept) < len(gaps):
+                logger.debug(f"History store stopped re-reading {len(gaps) - len(kept)} {kind} id gaps")
+            self._gaps[kind] = kept
+
+    def _high_water_marks(self, frame):
+        for kind in self._marks:
+            ids = frame.loc[frame["Type"] == kind, "id"]
+            if len(ids):
+                self._marks[kind] = max(self._marks[kind], int(ids.max()))
+
+    def _sorted(self, frame):
+        return frame.sort_values(SORT_COLUMNS, kind="stable").reset_index(drop=True)
+
+    def _follows(self, frame, at):
+        # whether row ``at`` sorts at or after row ``at - 1``
+        pair = frame.iloc[at - 1:at + 1]
+        return list(pair.sort_values(SORT_COLUMNS, kind="stable").index) == list(pair.index)
+
+    def _archived_rows(self):
+        version = archive.version()
+        if version != self._archive_version:
+            rows = archive.ledger_rows()
+            self._archived = None if rows is None else _typed(rows)
+            self._archive_version = version
+        return self._archived
+
+    def _full_load(self):
+        frame = self._query({"Payment": 0, "Purchase": 0})
+        archived = self._archived_rows()
+        if archived is not None:
+            frame = _append(archived, frame)
+        frame = self._sorted(frame)
+        self._marks = {"Payment": 0, "Purchase": 0}
+        self._gaps = {"Payment": [], "Purchase": []}
+        self._track_gaps(frame, time.monotonic())
+        self._high_water_marks(frame)
+        self.frame = frame
+        self._loaded_at = time.monotonic()
+        logger.info(f"History store loaded {len(frame)} rows")
+        return True
+
+    def _delta(self):
+        now = time.monotonic()
+        self._expire_gaps(now)
+        # the store holds no id above the mark or inside a gap, so every row is new
+        new = self._query(self._marks, self._gaps)
+        if new.empty:
+            return False
+
+        # the delta query is unordered: sort the new rows, and the whole
+        # frame only when they do not all come after its last row
+        new = self._sorted(new)
+        frame = _append(self.frame, new)
+        if len(self.frame) and not self._follows(frame, len(self.frame)):
+            frame = self._sorted(frame)
+        self.frame = frame
+        self._track_gaps(new, now)
+        self._high_water_marks(new)
+        logger.debug(f"History store appended {len(new)} rows")
+        return True
+
+    def mark_dirty(self, broadcast=True):
+        """
+        Ask for a delta query on the next refresh, e.g. after a commit, and
+        with ``broadcast`` in the other workers too.
+        """
+        self._dirty = True
+        if broadcast:
+            changes.publish("history")
+
+    def refresh(self, force=False):
+        """
+        The method brings the store up to date if it is due: a full load the
+        first time and every ``resync_interval``, otherwise a delta query at
+        most every ``refresh_interval`` unless marked dirty. Returns the
+        store version, which changes whenever the rows change.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._loaded_at is None or now - self._loaded_at >= self.resync_interval:
+                changed = self._full_load()
+            elif force or self._dirty or now - self._refreshed_at >= self.refresh_interval:
+                self._dirty = False
+                changed = self._delta()
+            else:
+                return self.version
+            self._refreshed_at = now
+            if changed:
+                self.version += 1
+            return self.version
+
+
+def history_mask(frame, start_date=None, end_date=None, school=None, txn_type=None, fee_type=None,
+                 period_start=None, period_end=None):
+    """
+    The function evaluates the History filters on a ledger frame and
+    returns a boolean mask of the matching rows. Text filters compare
+    categorical codes and the period filter compares integer period keys.
+    """
+    mask = np.ones(len(frame), dtype=bool)
+    if start_date is not None:
+        mask &= (frame["created_at"] >= pd.Timestamp(start_date)).to_numpy()
+    if end_date is not None:
+        # inclusive end: everything up to midnight of the following day
+        mask &= (frame["created_at"] <= pd.Timestamp(end_date) + pd.Timedelta(days=1)).to_numpy()
+    if school is not None:
+        mask &= (frame["School"] == school).to_numpy()
+    if txn_type is not None:
+        mask &= (frame["Type"] == txn_type).to_numpy()
+    if fee_type is not None:
+        mask &= ((frame["Type"] == "Payment") & (frame["Category"] == fee_type)).to_numpy()
+    if period_start is not None or period_end is not None:
+        keys = period_key(frame["year"].to_numpy(dtype="int32"), frame["month"].to_numpy(dtype="int32"))
+        if period_start is not None:
+            mask &= keys >= period_start
+        if period_end is not None:
+            mask &= keys <= period_end
+    return mask
+
+
+def _history_rows(frame, rows):
+    """Build the History columns for the ledger rows at positions ``rows``."""
+    def take(name):
+        column = frame[name]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            return pd.Categorical.from_codes(column.cat.codes.to_numpy()[rows], dtype=column.dtype)
+        return column.to_numpy()[rows]
+
+    return pd.DataFrame({
+        "Type": take("Type"),
+        "Name": take("Name"),
+        "Amount": take("amount_kobo") / 100,
+        "Category": take("Category"),
+        "Period": take("Period"),
+        "created_at": take("created_at"),
+    }, columns=HISTORY_COLUMNS)
+
+
+def filter_history(frame, **filters):
+    """
+    The function applies the History filters to a ledger frame in memory
+    and returns the History columns newest first, like build_history_query.
+    No strings are built for the rows that are dropped.
+    """
+    # newest first: the frame is held oldest first
+    return _history_rows(frame, np.flatnonzero(history_mask(frame, **filters))[::-1])
+
+
+def page_history(frame, cursor=None, page_size=50, order="DESC", **filters):
+    """
+    The function returns one page of the History table from a ledger frame,
+    like load_history_page: the rows after ``cursor``, a ``(created_at,
+    Type, id)`` key, in ``order``, and the cursor of the next page or ``None``.
+    """
+    mask = history_mask(frame, **filters)
+    if cursor is not None:
+        created_at, cursor_type, cursor_id = cursor
+        stamps = frame["created_at"].to_numpy()
+        stamp = np.datetime64(pd.Timestamp(created_at))
+        types = frame["Type"].cat.codes.to_numpy()
+        kind = TYPES.categories.get_loc(cursor_type)
+        ids = frame["id"].to_numpy()
+        if order == "DESC":
+            after = (stamps < stamp) | ((stamps == stamp) & ((types < kind) | ((types == kind) & (ids < cursor_id))))
+        else:
+            after = (stamps > stamp) | ((stamps == stamp) & ((types > kind) | ((types == kind) & (ids > cursor_id))))
+        mask &= after
+
+    # the frame is held in (created_at, Type, id) order, so a page is a slice of the matches
+    rows = np.flatnonzero(mask)
+    rows = rows[::-1][:page_size + 1] if order == "DESC" else rows[:page_size + 1]
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = (frame["created_at"].iat[last], frame["Type"].iat[last], int(frame["id"].iat[last]))
+    return _history_rows(frame, rows), next_cursor
+
+
+def history_totals(frame, **filters):
+    """
+    The function counts and sums the rows matching the History filters per
+    transaction type, like load_history_totals, in exact integer kobo.
+    """
+    mask = history_mask(frame, **filters)
+    types = frame["Type"].cat.codes.to_numpy()
+    amounts = frame["amount_kobo"].to_numpy()
+    totals = {}
+    for code, txn in enumerate(TYPES.categories):
+        rows = mask & (types == code)
+        totals[txn] = {"count": int(rows.sum()), "amount_kobo": int(amounts[rows].sum())}
+    return totals
+
+
+history_store = HistoryStore(
+    refresh_interval=float(os.getenv("HISTORY_REFRESH_SECONDS", "5")),
+    resync_interval=float(os.getenv("HISTORY_RESYNC_SECONDS", "900")),
+    gap_timeout=float(os.getenv("HISTORY_GAP_SECONDS", "300")),
+)
+changes.subscribe("history", lambda: history_store.mark_dirty(broadcast=False))
+
+
+def _store_metrics():
+    yield "recon_history_store_rows", "Rows held in the shared history ledger.", "gauge", {(): len(history_store.frame)}
+    yield "recon_history_store_version", "Version of the shared history ledger.", "gauge", {(): history_store.version}
+    gaps = {(("type", kind),): len(ranges) for kind, ranges in history_store._gaps.items()}
+    yield "recon_history_store_id_gaps", "Ranges of unseen ids the history delta re-reads.", "gauge", gaps
+
+
+registry.add_collector(_store_metrics)
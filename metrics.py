@@ -0,0 +1,328 @@
+#  --- Query and Render Instrumentation ---
+import os
+import re
+import time
+import inspect
+import functools
+import threading
+
+try:
+    from shiny.types import SilentException
+except ImportError:  # the CLI tools and benchmarks use this module without Shiny
+    SilentException = ()
+
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for k, v in pairs
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    labels = _format_labels(self.labels, label_values, ("le", _format_value(float(bound))))
+                    lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+                labels = _format_labels(self.labels, label_values, ("le", "+Inf"))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labels, label_values)
+                lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """
+    Holds the app's metrics and renders them in the Prometheus text format.
+    Collectors are callables returning ``(name, help, type, {labels: value})``
+    tuples, evaluated at scrape time for gauges such as pool statistics.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def expose(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.expose())
+        for collector in self._collectors:
+            for name, help, kind, samples in collector():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples.items():
+                    lines.append(f"{name}{_format_labels([k for k, _ in labels], [v for _, v in labels])} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+sql_seconds = registry.histogram(
+    "recon_sql_statement_seconds", "Time spent executing SQL statements.", ["statement"]
+)
+sql_rows = registry.counter(
+    "recon_sql_rows_total", "Rows fetched or affected by SQL statements.", ["statement"]
+)
+sql_errors = registry.counter(
+    "recon_sql_errors_total", "SQL statements that raised an error.", ["statement"]
+)
+reactive_seconds = registry.histogram(
+    "recon_reactive_seconds", "Execution time of render, calc and effect functions.", ["kind", "name"]
+)
+reactive_errors = registry.counter(
+    "recon_reactive_errors_total", "Render, calc and effect executions that raised an error.", ["kind", "name"]
+)
+
+
+# --- SQL Instrumentation ---
+_VERB = re.compile(r"^\s*\(?\s*(\w+)", re.IGNORECASE)
+_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|JOIN)\s+`?(\w+)`?", re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=512)
+def statement_label(sql):
+    """The function reduces a statement to ``VERB table`` for use as a metric label."""
+    verb = _VERB.match(sql)
+    table = _TABLE.search(sql)
+    return f"{verb.group(1).upper() if verb else '?'} {table.group(1).lower() if table else '-'}"
+
+
+class InstrumentedCursor:
+    """A cursor proxy that times every statement and counts the rows it returns."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._label = None
+
+    def _run(self, method, sql, params):
+        label = self._label = statement_label(sql)
+        started = time.perf_counter()
+        try:
+            return method(sql, params)
+        except Exception:
+            sql_errors.inc(label)
+            raise
+        finally:
+            sql_seconds.observe(time.perf_counter() - started, label)
+
+    def execute(self, sql, params=None):
+        result = self._run(self._cursor.execute, sql, params)
+        if not sql.lstrip().upper().startswith("SELECT") and self._cursor.rowcount and self._cursor.rowcount > 0:
+            sql_rows.inc(self._label, amount=self._cursor.rowcount)
+        return result
+
+    def executemany(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        result = self._run(self._cursor.executemany, sql, seq_of_params)
+        sql_rows.inc(self._label, amount=len(seq_of_params))
+        return result
+
+    def _count(self, rows):
+        if self._label is not None and rows:
+            sql_rows.inc(self._label, amount=len(rows))
+        return rows
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None and self._label is not None:
+            sql_rows.inc(self._label)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        return self._count(self._cursor.fetchmany(*args, **kwargs))
+
+    def fetchall(self):
+        return self._count(self._cursor.fetchall())
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+
+
+class InstrumentedConnection:
+    """A connection proxy whose cursors are instrumented."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._conn.cursor(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+# --- Reactive Instrumentation ---
+def timed(kind):
+    """
+    The decorator records the duration of a render, calc or effect function
+    (sync, async or generator) under ``recon_reactive_seconds``.
+    Place it directly above the ``def`` so Shiny sees the wrapped function.
+    """
+    def decorate(fn):
+        name = fn.__name__
+
+        def finish(started, error):
+            reactive_seconds.observe(time.perf_counter() - started, kind, name)
+            if error is not None and not isinstance(error, SilentException):
+                reactive_errors.inc(kind, name)
+
+        if inspect.isasyncgenfunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                started, error = time.perf_counter(), None
+                try:
+                    async for item in fn(*args, **kwargs):
+                        yield item
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    finish(started, error)
+        elif inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                started, error = time.perf_counter(), None
+                try:
+                    return await fn(*args, **kwargs)
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    finish(started, error)
+        elif inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                started, error = time.perf_counter(), None
+                try:
+                    yield from fn(*args, **kwargs)
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    finish(started, error)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                started, error = time.perf_counter(), None
+                try:
+                    return fn(*args, **kwargs)
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    finish(started, error)
+        return wrapper
+
+    return decorate
+
+
+# --- HTTP Route ---
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+METRICS_ALLOW_REMOTE = os.getenv("METRICS_ALLOW_REMOTE", "0") == "1"
+_LOCAL_CLIENTS = {"127.0.0.1", "::1", "localhost"}
+
+
+async def _metrics_response(scope, send):
+    client = (scope.get("client") or ("",))[0]
+    if not METRICS_ALLOW_REMOTE and client not in _LOCAL_CLIENTS:
+        status, body, content_type = 403, b"Forbidden\n", b"text/plain; charset=utf-8"
+    else:
+        status, body, content_type = 200, registry.expose().encode("utf-8"), b"text/plain; version=0.0.4; charset=utf-8"
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def with_metrics_route(asgi_app):
+    """
+    The function wraps an ASGI app so that ``METRICS_PATH`` serves the
+    Prometheus metrics (to local clients only, unless METRICS_ALLOW_REMOTE=1)
+    and every other request, websocket and lifespan event goes to ``asgi_app``
+    """
+    async def app(scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == METRICS_PATH:
+            await _metrics_response(scope, send)
+            return
+        await asgi_app(scope, receive, send)
+
+    return app
@@ -0,0 +1,432 @@
+#  --- History Query Builder ---
+import logging
+from decimal import Decimal
+
+import pandas as pd
+
+import archive
+from db import get_connection
+from reference import MONTHS
+
+
+logger = logging.getLogger("ShinyAppLogger")
+
+HISTORY_COLUMNS = ["Type", "Name", "Amount", "Category", "Period", "created_at"]
+
+PAYMENT_COLUMNS = """'Payment' AS Type, CONCAT(e.first_name, ' ', e.last_name) AS Name, p.amount AS Amount,
+           p.fee_type AS Category, CONCAT(p.month_paid, ' ', p.year_paid) AS Period, p.created_at"""
+
+PAYMENT_FROM = """
+    FROM payments p
+    JOIN enrollees e ON p.enrollee_id = e.enrollee_id"""
+
+PURCHASE_COLUMNS = """'Purchase' AS Type, i.item_name AS Name, pu.amount AS Amount,
+           pu.quantity AS Category, CONCAT(pu.month_paid, ' ', pu.year_paid) AS Period, pu.created_at"""
+
+PURCHASE_FROM = """
+    FROM purchases pu
+    JOIN items i ON pu.item_id = i.item_id"""
+
+PAYMENT_SELECT = f"\n    SELECT {PAYMENT_COLUMNS}{PAYMENT_FROM}"
+PURCHASE_SELECT = f"\n    SELECT {PURCHASE_COLUMNS}{PURCHASE_FROM}"
+
+# the keyword arguments of the History filters, see history_filters
+FILTERS = ("start_date", "end_date", "school", "txn_type", "fee_type", "period_start", "period_end")
+
+# Type -> (table alias, primary key, columns, FROM clause) for each side of the union
+SIDES = {
+    "Payment": ("p", "p.payment_id", PAYMENT_COLUMNS, PAYMENT_FROM),
+    "Purchase": ("pu", "pu.purchase_id", PURCHASE_COLUMNS, PURCHASE_FROM),
+}
+
+
+PERIODS_SQL = """
+    SELECT DISTINCT year_paid, month_paid FROM payments
+    UNION
+    SELECT DISTINCT year_paid, month_paid FROM purchases"""
+
+
+# --- Periods ---
+def period_key(year, month):
+    """
+    The function numbers the period ``month`` (1-12) of ``year`` so that
+    period ranges compare as plain integers. Works on scalars and arrays.
+    """
+    return year * 12 + month - 1
+
+
+def period_label(key):
+    """The function turns a period key back into its "January 2024" label."""
+    return f"{MONTHS[key % 12]} {key // 12}"
+
+
+def period_choices(keys):
+    """The function builds the choices of the period selects, newest first."""
+    choices = {"All": "All"}
+    choices.update((str(key), period_label(key)) for key in sorted(keys, reverse=True))
+    return choices
+
+
+def load_periods():
+    """The function returns the keys of the periods present in the ledger, archived years included."""
+    lookup = {name: i + 1 for i, name in enumerate(MONTHS)}
+    with get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(PERIODS_SQL)
+        rows = cursor.fetchall()
+    keys = {period_key(int(year), lookup[month]) for year, month in rows if month in lookup}
+    return sorted(keys | archive.periods())
+
+
+def _period_sql(alias):
+    months = ", ".join(f"'{month}'" for month in MONTHS)
+    return f"({alias}.year_paid * 12 + FIELD({alias}.month_paid, {months}) - 1)"
+
+
+# --- Filters ---
+def _is_set(value):
+    return value not in (None, "", "All")
+
+
+def history_filters(filter_date=None, filter_school="All", filter_type="All", filter_fee_type="All",
+                    filter_period_start="All", filter_period_end="All"):
+    """
+    The function normalises the History tab inputs into the keyword
+    arguments accepted by build_history_query
+    """
+    start_date = end_date = None
+    if filter_date:
+        start_date, end_date = filter_date
+    return {
+        "start_date": start_date,
+        "end_date": end_date,
+        "school": filter_school if _is_set(filter_school) else None,
+        "txn_type": filter_type if _is_set(filter_type) else None,
+        "fee_type": filter_fee_type if _is_set(filter_fee_type) else None,
+        "period_start": int(filter_period_start) if _is_set(filter_period_start) else None,
+        "period_end": int(filter_period_end) if _is_set(filter_period_end) else None,
+    }
+
+
+def _side_predicates(alias, start_date, end_date, school, period_start=None, period_end=None):
+    """Build the WHERE predicates shared by both sides of the union."""
+    joins, where, params = [], [], []
+    if start_date is not None:
+        where.append(f"{alias}.created_at >= %s")
+        params.append(pd.Timestamp(start_date).to_pydatetime())
+    if end_date is not None:
+        # inclusive end: everything up to midnight of the following day
+        where.append(f"{alias}.created_at <= %s")
+        params.append((pd.Timestamp(end_date) + pd.Timedelta(days=1)).to_pydatetime())
+    if school is not None:
+        joins.append(f"JOIN school_types st ON st.school_id = {alias}.school_id")
+        where.append("st.school_name = %s")
+        params.append(school)
+    # the year bound lets an index on year_paid narrow the rows before FIELD() runs
+    if period_start is not None:
+        where.append(f"{alias}.year_paid >= %s AND {_period_sql(alias)} >= %s")
+        params.extend([period_start // 12, period_start])
+    if period_end is not None:
+        where.append(f"{alias}.year_paid <= %s AND {_period_sql(alias)} <= %s")
+        params.extend([period_end // 12, period_end])
+    return joins, where, params
+
+
+def _compose(select, joins, where):
+    sql = select
+    if joins:
+        sql += "\n    " + "\n    ".join(joins)
+    if where:
+        sql += "\n    WHERE " + " AND ".join(where)
+    return sql
+
+
+def _history_sides(start_date=None, end_date=None, school=None, txn_type=None, fee_type=None,
+                   period_start=None, period_end=None):
+    """
+    Build ``(Type, joins, where, params)`` for each side of the union that
+    the filters leave in; a side they exclude entirely is left out.
+    """
+    sides = []
+    if txn_type in (None, "Payment"):
+        joins, where, params = _side_predicates("p", start_date, end_date, school, period_start, period_end)
+        if fee_type is not None:
+            where.append("p.fee_type = %s")
+            params.append(fee_type)
+        sides.append(("Payment", joins, where, params))
+    # the fee type filter only applies to payments, so it excludes every purchase
+    if txn_type in (None, "Purchase") and fee_type is None:
+        joins, where, params = _side_predicates("pu", start_date, end_date, school, period_start, period_end)
+        sides.append(("Purchase", joins, where, params))
+    return sides
+
+
+def build_history_query(start_date=None, end_date=None, school=None, txn_type=None, fee_type=None,
+                        period_start=None, period_end=None, order="DESC", limit=None, offset=None):
+    """
+    The function builds the parameterised history query for the given filters.
+
+    Filters are pushed into each side of the ``payments UNION ALL purchases``
+    query; a side that the filters exclude entirely is left out of the union.
+    ``period_start`` and ``period_end`` are inclusive period keys (see
+    period_key) compared against the month and year the row was paid for.
+    Returns ``(sql, params)``, or ``(None, [])`` when no row can match.
+    """
+    parts, params = [], []
+    for txn, joins, where, side_params in _history_sides(
+        start_date, end_date, school, txn_type, fee_type, period_start, period_end
+    ):
+        parts.append(_compose(PAYMENT_SELECT if txn == "Payment" else PURCHASE_SELECT, joins, where))
+        params.extend(side_params)
+
+    if not parts:
+        return None, []
+
+    sql = "\n    UNION ALL\n".join(parts)
+    sql += f"\n    ORDER BY created_at {'ASC' if order.upper() == 'ASC' else 'DESC'}"
+    if limit is not None:
+        sql += "\n    LIMIT %s"
+        params.append(int(limit))
+        if offset:
+            sql += " OFFSET %s"
+            params.append(int(offset))
+    return sql, params
+
+
+# --- Keyset Pages ---
+def _keyset_predicate(txn, cursor, order):
+    """
+    Build the predicate selecting the rows of one side that come after
+    ``cursor`` in the page order.
+
+    Pages are ordered on ``(created_at, Type, id)``, since payment and
+    purchase ids overlap. Type is constant within a side, so at equal
+    timestamps the other side's rows fall wholly before or after the cursor
+    and only the cursor's own side needs the id comparison.
+    """
+    alias, key, _, _ = SIDES[txn]
+    created_at, cursor_type, cursor_id = cursor
+    op = "<" if order == "DESC" else ">"
+    if txn == cursor_type:
+        # the first condition is a plain range, so an index on created_at can serve it
+        return (f"{alias}.created_at {op}= %s AND ({alias}.created_at {op} %s OR {key} {op} %s)",
+                [created_at, created_at, cursor_id])
+    include_ties = (txn < cursor_type) == (order == "DESC")
+    return f"{alias}.created_at {op}{'=' if include_ties else ''} %s", [created_at]
+
+
+def build_history_page(cursor=None, page_size=50, order="DESC", **filters):
+    """
+    The function builds the query for one page of the History table.
+
+    ``cursor`` is the ``(created_at, Type, id)`` of the last row of the
+    previous page (``None`` for the first page), so every page is a range
+    read from the cursor onwards instead of an OFFSET over skipped rows.
+    Each side is limited before the union, which lets both use an index on
+    ``created_at``. One extra row is fetched to tell whether a next page exists.
+    Returns ``(sql, params)``, or ``(None, [])`` when no row can match.
+    """
+    order = "ASC" if order.upper() == "ASC" else "DESC"
+    parts, params = [], []
+    for txn, joins, where, side_params in _history_sides(**filters):
+        alias, key, columns, tables = SIDES[txn]
+        if cursor is not None:
+            predicate, cursor_params = _keyset_predicate(txn, cursor, order)
+            where.append(predicate)
+            side_params.extend(cursor_params)
+        side = _compose(f"\n    SELECT {columns}, {key} AS id{tables}", joins, where)
+        side += f"\n    ORDER BY {alias}.created_at {order}, {key} {order}\n    LIMIT %s"
+        parts.append(f"SELECT * FROM ({side}\n    ) AS {alias}_page")
+        params.extend(side_params + [page_size + 1])
+
+    if not parts:
+        return None, []
+
+    sql = "\n    " + "\n    UNION ALL\n    ".join(parts)
+    sql += f"\n    ORDER BY created_at {order}, Type {order}, id {order}\n    LIMIT %s"
+    params.append(page_size + 1)
+    return sql, params
+
+
+def _merge_page(rows, archived, order):
+    """Merge the archived rows of a page into the live ones, in page order."""
+    rows = list(rows) + archived
+    rows.sort(key=lambda row: (pd.Timestamp(row["created_at"]), row["Type"], row["id"]),
+              reverse=order.upper() != "ASC")
+    return rows
+
+
+def load_history_page(cursor=None, page_size=50, order="DESC", **filters):
+    """
+    The function fetches one page of the History table, merging in the
+    rows of archived years (see archive.py).
+    Returns the page as a DataFrame with the History columns and the
+    cursor of the next page, or ``None`` on the last page.
+    """
+    sql, params = build_history_page(cursor, page_size, order, **filters)
+    if sql is None:
+        return pd.DataFrame(columns=HISTORY_COLUMNS), None
+    with get_connection() as conn, conn.cursor(dictionary=True) as db_cursor:
+        db_cursor.execute(sql, params)
+        rows = db_cursor.fetchall()
+    archived = archive.history_page(cursor, page_size, order, **filters)
+    if archived:
+        rows = _merge_page(rows, archived, order)
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = (last["created_at"], last["Type"], last["id"])
+    return pd.DataFrame(rows, columns=HISTORY_COLUMNS + ["id"])[HISTORY_COLUMNS], next_cursor
+
+
+def load_history_totals(**filters):
+    """
+    The function counts the rows matching the History filters and sums
+    their amounts, per transaction type, with one aggregate query per side
+    plus the archived rows. Returns ``{Type: {"count": rows, "amount_kobo": total}}``.
+    """
+    totals = {txn: {"count": 0, "amount_kobo": 0} for txn in SIDES}
+    sides = _history_sides(**filters)
+    if not sides:
+        return totals
+    with get_connection() as conn, conn.cursor() as cursor:
+        for txn, joins, where, params in sides:
+            alias, _, _, tables = SIDES[txn]
+            cursor.execute(_compose(f"\n    SELECT COUNT(*), COALESCE(SUM({alias}.amount), 0){tables}", joins, where), params)
+            count, amount = cursor.fetchone()
+            totals[txn] = {"count": int(count), "amount_kobo": int(round(Decimal(str(amount)) * 100))}
+    for txn, archived in archive.history_totals(**filters).items():
+        totals[txn] = {name: totals[txn][name] + archived[name] for name in ("count", "amount_kobo")}
+    return totals
+
+
+def fetch_history_df(cursor, **filters):
+    """
+    The function runs the history query on ``cursor`` and returns
+    the matching rows, archived years included, as a DataFrame with the
+    History table columns
+    """
+    sql, params = build_history_query(**filters)
+    if sql is None:
+        return pd.DataFrame(columns=HISTORY_COLUMNS)
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+    column_names = [i[0] for i in cursor.description]
+    frame = pd.DataFrame(rows, columns=column_names)
+    archived = archive.history_rows(**{name: value for name, value in filters.items() if name in FILTERS})
+    if archived is None:
+        return frame
+    return _by_created_at(frame, archived, ascending=filters.get("order", "DESC").upper() == "ASC")
+
+
+def _by_created_at(frame, archived, ascending=False):
+    """
+    The function merges archived History rows into live ones by timestamp.
+    Live timestamps are compared as parsed, since drivers return them as
+    datetimes or strings.
+    """
+    keys = pd.concat([pd.to_datetime(frame["created_at"]), archived["created_at"]], ignore_index=True)
+    merged = pd.concat([frame, archived[HISTORY_COLUMNS]], ignore_index=True)
+    return merged.iloc[keys.sort_values(ascending=ascending, kind="stable").index].reset_index(drop=True)
+
+
+def load_history_df(**filters):
+    """The function runs fetch_history_df on a pooled connection."""
+    with get_connection() as conn, conn.cursor(dictionary=True) as cursor:
+        return fetch_history_df(cursor, **filters)
+
+
+def iter_history_csv(conn, chunk_size=5000, **filters):
+    """
+    The function streams the history query as CSV text, one chunk of
+    ``chunk_size`` rows at a time, from an unbuffered cursor so that memory
+    stays flat regardless of the size of the export. Archived rows are
+    streamed from their partitions alongside and merged into the chunks by
+    timestamp, reading ahead only as far as the current live chunk.
+
+    The concatenated chunks equal ``fetch_history_df(...).to_csv(index=False)``.
+    """
+    sql, params = build_history_query(**filters)
+    if sql is None:
+        yield pd.DataFrame(columns=HISTORY_COLUMNS).to_csv(index=False)
+        return
+    archived = archive.iter_history(chunk_size, as_text=True, **filters)
+    # archived rows read ahead, newest first
+    pending = pd.DataFrame(columns=HISTORY_COLUMNS)
+
+    def read_ahead(stamp):
+        # until every archived row at or after ``stamp`` is pending
+        nonlocal pending, archived
+        while archived is not None and (not len(pending) or pending["created_at"].iloc[-1] >= stamp):
+            chunk = next(archived, None)
+            if chunk is None:
+                archived = None
+            else:
+                pending = pd.concat([pending, chunk], ignore_index=True) if len(pending) else chunk
+
+    cursor = conn.cursor(buffered=False)
+    unread = True
+    try:
+        cursor.execute(sql, params)
+        column_names = [i[0] for i in cursor.description]
+        header = True
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                unread = False
+                break
+            frame = pd.DataFrame(rows, columns=column_names)
+            stamp = pd.Timestamp(frame["created_at"].iloc[-1])
+            read_ahead(stamp)
+            # pending is newest first, so the rows due in this chunk are a prefix
+            due = int((pending["created_at"] >= stamp).sum()) if len(pending) else 0
+            if due:
+                frame = _by_created_at(frame, pending.iloc[:due])
+                pending = pending.iloc[due:].reset_index(drop=True)
+            yield frame.to_csv(index=False, header=header)
+            header = False
+        # archived rows older than every live one
+        while True:
+            if not len(pending):
+                read_ahead(pd.Timestamp.max)
+                if not len(pending):
+                    break
+            yield pending[HISTORY_COLUMNS].to_csv(index=False, header=header)
+            pending = pending.iloc[:0]
+            header = False
+        if header:
+            # no rows matched: emit the header line only, as to_csv does
+            yield pd.DataFrame(columns=column_names).to_csv(index=False)
+    finally:
+        archived = None
+        if unread:
+            # the download was aborted: the driver will not close a cursor with rows left unread
+            _discard_unread(conn)
+        try:
+            cursor.close()
+        except Exception:
+            # leave the connection in error; release() discards it when its rollback fails
+            logger.warning("Could not close the export cursor", exc_info=True)
+
+
+def _discard_unread(conn):
+    """
+    The function reads and drops what is left of an unbuffered result, so
+    the connection can be closed over or reused.
+    """
+    consume = getattr(conn, "consume_results", None)
+    if consume is None:
+        return
+    try:
+        consume()
+    except Exception:
+        logger.warning("Could not discard the rest of an aborted export", exc_info=True)
+
+
+def stream_history_csv(chunk_size=5000, **filters):
+    """
+    The function streams iter_history_csv on a pooled connection that is
+    held until the generator is exhausted or closed
+    """
+    with get_connection() as conn:
+        yield from iter_history_csv(conn, chunk_size=chunk_size, **filters)
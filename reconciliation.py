@@ -0,0 +1,260 @@
+#  --- Reconciliation of Expected Fees against Recorded Payments ---
+import logging
+from decimal import Decimal, ROUND_HALF_EVEN
+
+import numpy as np
+import pandas as pd
+
+import archive
+from db import get_connection
+from reference import MONTHS
+
+
+logger = logging.getLogger("ShinyAppLogger")
+
+SCHEDULE_COLUMNS = ["school", "fee_type", "month", "year", "amount"]
+
+DETAIL_COLUMNS = [
+    "Enrollee", "School", "Fee Type", "Period", "Expected", "Paid", "Outstanding", "Overpaid"
+]
+SUMMARY_COLUMNS = ["Enrollee", "School", "Expected", "Paid", "Outstanding", "Overpaid"]
+
+
+# float64 holds every two-decimal naira amount below this exactly enough to round to kobo
+EXACT_FLOAT_NAIRA = 2**53 // 1000
+
+
+def to_kobo(amounts):
+    """
+    The function converts naira amounts (Decimal, str or float) to integer kobo.
+    Amounts are rounded through float64, which is exact for two-decimal values
+    below EXACT_FLOAT_NAIRA; the rare larger amount is converted with Decimal.
+    """
+    values = pd.Series(amounts, dtype=object)
+    naira = pd.to_numeric(values, errors="coerce")
+    kobo = (naira * 100).round().fillna(0).astype("int64").to_numpy()
+    large = (naira.abs() >= EXACT_FLOAT_NAIRA).to_numpy()
+    if large.any():
+        kobo = kobo.copy()
+        kobo[large] = [
+            int((Decimal(str(v)) * 100).to_integral_value(ROUND_HALF_EVEN)) for v in values[large]
+        ]
+    return kobo
+
+
+def month_number(months):
+    """The function maps full month names to 1-12 (0 for anything unrecognised)."""
+    lookup = {name: i + 1 for i, name in enumerate(MONTHS)}
+    months = pd.Series(months, dtype=object)
+    numbers = months.map(lookup)
+    unmatched = numbers.isna()
+    if unmatched.any():
+        numbers[unmatched] = months[unmatched].astype(str).str.strip().str.title().map(lookup)
+    return numbers.fillna(0).astype("int16").to_numpy()
+
+
+def load_fee_schedule(cursor):
+    """
+    The function reads the fee schedule table. A NULL ``year_paid`` means
+    the fee recurs every year.
+    """
+    cursor.execute("""
+        SELECT st.school_name AS school, fs.fee_type, fs.month_paid AS month, fs.year_paid AS year, fs.amount
+        FROM fee_schedule fs
+        JOIN school_types st ON st.school_id = fs.school_id
+    """)
+    return pd.DataFrame(cursor.fetchall(), columns=SCHEDULE_COLUMNS)
+
+
+def read_fee_schedule(source):
+    """
+    The function reads a fee schedule from CSV with the columns
+    ``school, fee_type, month, year, amount`` (``year`` may be blank).
+    """
+    df = pd.read_csv(source, dtype=str).fillna("")
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    missing = [c for c in SCHEDULE_COLUMNS if c not in df.columns and c != "year"]
+    if missing:
+        raise ValueError(f"Fee schedule is missing column(s): {', '.join(missing)}")
+    if "year" not in df.columns:
+        df["year"] = ""
+    return df[SCHEDULE_COLUMNS]
+
+
+def load_enrollees(cursor, school=None):
+    if school is None:
+        cursor.execute("SELECT enrollee_id, CONCAT(first_name, ' ', last_name) AS name, school_name AS school FROM enrollees")
+    else:
+        cursor.execute("""
+            SELECT enrollee_id, CONCAT(first_name, ' ', last_name) AS name, school_name AS school
+            FROM enrollees
+            WHERE school_name = %s
+        """, (school,))
+    return pd.DataFrame(cursor.fetchall(), columns=["enrollee_id", "name", "school"])
+
+
+def load_payments(cursor, year_from, year_to):
+    """The function loads the payments for the year range, archived years included."""
+    cursor.execute("""
+        SELECT enrollee_id, fee_type, month_paid AS month, year_paid AS year, amount
+        FROM payments
+        WHERE year_paid BETWEEN %s AND %s
+    """, (year_from, year_to))
+    payments = pd.DataFrame(cursor.fetchall(), columns=["enrollee_id", "fee_type", "month", "year", "amount"])
+    archived = archive.load_payments(year_from, year_to)
+    if archived is None:
+        return payments
+    return pd.concat([payments, archived], ignore_index=True)
+
+
+def _expand_schedule(schedule, year_from, year_to):
+    """Normalise the schedule and repeat yearly rows (blank year) across the range."""
+    sched = pd.DataFrame({
+        "school": schedule["school"].astype(str).str.strip(),
+        "fee_type": schedule["fee_type"].astype(str).str.strip(),
+        "month": month_number(schedule["month"]),
+        "year": pd.to_numeric(schedule["year"], errors="coerce"),
+        "expected": to_kobo(schedule["amount"]),
+    })
+    sched = sched[sched["month"] > 0]
+
+    recurring = sched[sched["year"].isna()]
+    years = np.arange(year_from, year_to + 1, dtype="int16")
+    recurring = recurring.drop(columns="year").merge(pd.DataFrame({"year": years}), how="cross")
+
+    dated = sched[sched["year"].between(year_from, year_to)].astype({"year": "int16"})
+    sched = pd.concat([dated, recurring], ignore_index=True)
+    # a dated entry overrides the recurring one for the same school, fee type and month
+    return sched.drop_duplicates(["school", "fee_type", "year", "month"], keep="first")
+
+
+def _pack_keys(enrollee_id, fee_code, year, month):
+    """Pack enrollee, fee type, year and month into one int64 so joins and group-bys run on a single integer column."""
+    return (
+        (np.asarray(enrollee_id, dtype="int64") << 24)
+        | (np.asarray(fee_code, dtype="int64") << 16)
+        | (np.asarray(year, dtype="int64") << 4)
+        | np.asarray(month, dtype="int64")
+    )
+
+
+def reconcile(enrollees, schedule, payments, year_from, year_to):
+    """
+    The function compares the fees each enrollee is expected to pay with the
+    payments recorded against them, per fee type and month, in a single
+    vectorised pass (joins and group-bys, no per-enrollee loops).
+
+    ``enrollees`` has ``enrollee_id, name, school``; ``schedule`` has
+    ``school, fee_type, month, year, amount``; ``payments`` has
+    ``enrollee_id, fee_type, month, year, amount``. Amounts are returned in
+    naira; the arithmetic is done in integer kobo.
+    """
+    sched = _expand_schedule(schedule, year_from, year_to)
+    fee_types = pd.Index(pd.unique(pd.concat([sched["fee_type"], payments["fee_type"].astype(str)], ignore_index=True)))
+    schools = pd.Index(pd.unique(pd.concat([sched["school"], enrollees["school"].astype(str)], ignore_index=True)))
+
+    # every (enrollee, fee type, year, month) the schedule expects, joined on integer school codes
+    expected = pd.DataFrame({
+        "enrollee_id": enrollees["enrollee_id"].to_numpy(),
+        "school_code": schools.get_indexer(enrollees["school"].astype(str)),
+    }).merge(
+        pd.DataFrame({
+            "school_code": schools.get_indexer(sched["school"]),
+            "fee_code": fee_types.get_indexer(sched["fee_type"]),
+            "year": sched["year"].to_numpy(),
+            "month": sched["month"].to_numpy(),
+            "expected": sched["expected"].to_numpy(),
+        }),
+        on="school_code",
+        how="inner",
+    )
+    expected_keys = _pack_keys(expected["enrollee_id"], expected["fee_code"], expected["year"], expected["month"])
+
+    pay_year = pd.to_numeric(payments["year"], errors="coerce").fillna(0).astype("int64").to_numpy()
+    pay_month = month_number(payments["month"])
+    pay_ids = payments["enrollee_id"].to_numpy()
+    keep = (
+        np.isin(pay_ids, enrollees["enrollee_id"].to_numpy())
+        & (pay_year >= year_from) & (pay_year <= year_to) & (pay_month > 0)
+    )
+    paid_keys = _pack_keys(
+        pay_ids[keep], fee_types.get_indexer(payments["fee_type"].astype(str))[keep], pay_year[keep], pay_month[keep]
+    )
+
+    # outer join of expected and paid amounts as one group-by over the packed keys
+    combined = pd.DataFrame({
+        "key": np.concatenate([expected_keys, paid_keys]),
+        "expected": np.concatenate([expected["expected"].to_numpy(), np.zeros(len(paid_keys), dtype="int64")]),
+        "paid": np.concatenate([np.zeros(len(expected_keys), dtype="int64"), to_kobo(payments["amount"])[keep]]),
+    }).groupby("key", sort=False).sum()
+
+    keys = combined.index.to_numpy()
+    result = pd.DataFrame({
+        "enrollee_id": keys >> 24,
+        "fee_type": fee_types.to_numpy()[(keys >> 16) & 0xFF],
+        "year": ((keys >> 4) & 0xFFF).astype("int16"),
+        "month": (keys & 0xF).astype("int16"),
+        "expected": combined["expected"].to_numpy(),
+        "paid": combined["paid"].to_numpy(),
+    })
+    balance = result["expected"].to_numpy() - result["paid"].to_numpy()
+    result["outstanding"] = np.clip(balance, 0, None)
+    result["overpaid"] = np.clip(-balance, 0, None)
+
+    info = enrollees.drop_duplicates("enrollee_id").set_index("enrollee_id").reindex(result["enrollee_id"])
+    result["name"] = info["name"].to_numpy()
+    result["school"] = info["school"].to_numpy()
+    return result
+
+
+def detail_view(result):
+    """The function formats a reconcile() result as one row per enrollee, fee type and month."""
+    df = result.sort_values(["school", "name", "year", "month", "fee_type"])
+    month_names = np.array([""] + MONTHS, dtype=object)
+    return pd.DataFrame({
+        "Enrollee": df["name"].to_numpy(),
+        "School": df["school"].to_numpy(),
+        "Fee Type": df["fee_type"].to_numpy(),
+        "Period": month_names[df["month"].to_numpy()] + " " + df["year"].astype(str).to_numpy(),
+        "Expected": df["expected"].to_numpy() / 100,
+        "Paid": df["paid"].to_numpy() / 100,
+        "Outstanding": df["outstanding"].to_numpy() / 100,
+        "Overpaid": df["overpaid"].to_numpy() / 100,
+    }, columns=DETAIL_COLUMNS)
+
+
+def summary_view(result):
+    """The function totals a reconcile() result per enrollee."""
+    totals = result.groupby(["enrollee_id", "name", "school"], as_index=False, sort=False)[
+        ["expected", "paid", "outstanding", "overpaid"]
+    ].sum().sort_values(["school", "name"])
+    return pd.DataFrame({
+        "Enrollee": totals["name"].to_numpy(),
+        "School": totals["school"].to_numpy(),
+        "Expected": totals["expected"].to_numpy() / 100,
+        "Paid": totals["paid"].to_numpy() / 100,
+        "Outstanding": totals["outstanding"].to_numpy() / 100,
+        "Overpaid": totals["overpaid"].to_numpy() / 100,
+    }, columns=SUMMARY_COLUMNS)
+
+
+def run_reconciliation(conn, year_from, year_to, school=None, schedule=None):
+    """
+    The function loads enrollees, the fee schedule (unless one is given)
+    and the payments for the year range, and reconciles them
+    """
+    with conn.cursor() as cursor:
+        enrollees = load_enrollees(cursor, school)
+        if schedule is None:
+            schedule = load_fee_schedule(cursor)
+        payments = load_payments(cursor, year_from, year_to)
+    logger.info(
+        f"Reconciling {len(enrollees)} enrollees against {len(payments)} payments for {year_from}-{year_to}"
+    )
+    return reconcile(enrollees, schedule, payments, year_from, year_to)
+
+
+def reconcile_years(year_from, year_to, school=None, schedule=None):
+    """The function runs run_reconciliation on a pooled connection."""
+    with get_connection() as conn:
+        return run_reconciliation(conn, year_from, year_to, school, schedule)
@@ -0,0 +1,295 @@
+#  --- Reference Data Cache ---
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from changes import changes
+from db import get_connection
+from metrics import registry
+
+
+logger = logging.getLogger("ShinyAppLogger")
+
+MONTHS = [
+    "January", "February", "March", "April", "May", "June",
+    "July", "August", "September", "October", "November", "December"
+]
+FEE_TYPES = ["Registration", "Feeding", "Handout"]
+
+
+class TTLCache:
+    """
+    A small thread-safe cache whose entries expire after ``ttl`` seconds.
+
+    At most ``maxsize`` entries are kept; the least recently used entry is
+    evicted first. Hits, misses and evictions are counted for ``stats()``.
+    """
+
+    def __init__(self, ttl=300.0, maxsize=128):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, loader):
+        """Return the cached value for ``key``, calling ``loader()`` on a miss."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        value = loader()
+
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def peek(self, key):
+        """Return the cached value for ``key`` without loading it, or None."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def invalidate(self, match=None):
+        """Drop every entry, or only the keys for which ``match(key)`` is true."""
+        with self._lock:
+            if match is None:
+                self._data.clear()
+                return
+            for key in [k for k in self._data if match(k)]:
+                del self._data[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+_cache = TTLCache(
+    ttl=float(os.getenv("REFERENCE_CACHE_TTL", "300")),
+    maxsize=int(os.getenv("REFERENCE_CACHE_SIZE", "128")),
+)
+
+_items_version = 0
+
+ENROLLEE_SEARCH_LIMIT = int(os.getenv("ENROLLEE_SEARCH_LIMIT", "20"))
+
+# typeahead results, one entry per school and typed prefix
+_search_cache = TTLCache(
+    ttl=float(os.getenv("REFERENCE_CACHE_TTL", "300")),
+    maxsize=int(os.getenv("ENROLLEE_SEARCH_CACHE_SIZE", "2048")),
+)
+
+
+def _fetch_all(query, params=()):
+    with get_connection() as conn, conn.cursor(dictionary=True) as cursor:
+        cursor.execute(query, params)
+        return cursor.fetchall()
+
+
+def get_enrollees(school=None):
+    """
+    The function returns ``(enrollee_id, name)`` pairs for every enrollee,
+    or only those of ``school`` when one is given
+    """
+    def load():
+        if school is None:
+            rows = _fetch_all("SELECT enrollee_id, CONCAT(first_name, ' ', last_name) AS name FROM enrollees")
+        else:
+            rows = _fetch_all("""
+                SELECT enrollee_id, CONCAT(first_name, ' ', last_name) AS name
+                FROM enrollees
+                WHERE school_name = %s
+            """, (school,))
+        return tuple((row["enrollee_id"], row["name"]) for row in rows)
+
+    return _cache.get(("enrollees", school), load)
+
+
+def _like_prefix(text):
+    return text.replace("!", "!!").replace("%", "!%").replace("_", "!_") + "%"
+
+
+def _normalise(query):
+    return " ".join((query or "").lower().split())
+
+
+def _matches(first_name, last_name, query):
+    """The Python twin of the WHERE clause in _query_enrollees."""
+    return (
+        f"{first_name} {last_name}".lower().startswith(query)
+        or f"{last_name} {first_name}".lower().startswith(query)
+    )
+
+
+def _query_enrollees(school, query, limit):
+    sql = "SELECT enrollee_id, first_name, last_name FROM enrollees WHERE school_name = %s"
+    params = [school]
+    if query and " " not in query:
+        # each branch is a range scan on one of the (school_name, name) indexes
+        sql += " AND (first_name LIKE %s ESCAPE '!' OR last_name LIKE %s ESCAPE '!')"
+        params += [_like_prefix(query)] * 2
+    elif query:
+        # the first word picks the index range, the full name filters within it
+        head = _like_prefix(query.split(" ", 1)[0])
+        sql += """ AND ((first_name LIKE %s ESCAPE '!' AND CONCAT(first_name, ' ', last_name) LIKE %s ESCAPE '!')
+                     OR (last_name LIKE %s ESCAPE '!' AND CONCAT(last_name, ' ', first_name) LIKE %s ESCAPE '!'))"""
+        params += [head, _like_prefix(query)] * 2
+    sql += " ORDER BY last_name, first_name, enrollee_id LIMIT %s"
+    rows = _fetch_all(sql, (*params, limit))
+    return tuple((row["enrollee_id"], row["first_name"], row["last_name"]) for row in rows)
+
+
+def search_enrollees(school, query, limit=None):
+    """
+    The function returns up to ``limit`` ``(enrollee_id, name)`` pairs for
+    the enrollees of ``school`` whose name, written first or last name
+    first, starts with the typed ``query`` ("ada o" finds both Ada Obi and
+    Oluchi Ada), ordered by last name.
+
+    Results are cached per school and prefix. A cached result for a shorter
+    prefix that held fewer than ``limit`` rows already contains every match
+    of the longer one, so typing on after a narrow prefix needs no query.
+    """
+    limit = limit or ENROLLEE_SEARCH_LIMIT
+    query = _normalise(query)
+
+    def load():
+        for size in range(len(query) - 1, -1, -1):
+            if query[size - 1:size] == " ":
+                continue
+            cached = _search_cache.peek(("enrollees", school, query[:size], limit))
+            if cached is not None and len(cached) < limit:
+                return tuple(row for row in cached if _matches(row[1], row[2], query))
+        return _query_enrollees(school, query, limit)
+
+    rows = _search_cache.get(("enrollees", school, query, limit), load)
+    return [(enrollee_id, f"{first_name} {last_name}") for enrollee_id, first_name, last_name in rows]
+
+
+def get_items():
+    """The function returns ``(item_id, item_name)`` pairs for every item."""
+    def load():
+        rows = _fetch_all("SELECT item_id, item_name FROM items")
+        return tuple((row["item_id"], row["item_name"]) for row in rows)
+
+    return _cache.get(("items",), load)
+
+
+def get_schools():
+    """The function returns ``(school_id, school_name)`` pairs for every school."""
+    def load():
+        rows = _fetch_all("SELECT school_id, school_name FROM school_types ORDER BY school_id")
+        return tuple((row["school_id"], row["school_name"]) for row in rows)
+
+    return _cache.get(("school_types",), load)
+
+
+def get_school_name(school_id):
+    """The function returns the name of the school with ``school_id``, or None."""
+    return dict(get_schools()).get(school_id)
+
+
+def add_enrollee(cursor, first_name, last_name, school):
+    """
+    The function inserts a new enrollee on ``cursor`` and returns its id.
+    Call ``invalidate_enrollees()`` once the transaction is committed.
+    """
+    cursor.execute(
+        "INSERT INTO enrollees (first_name, last_name, school_name) VALUES (%s, %s, %s)",
+        (first_name, last_name, school),
+    )
+    return cursor.lastrowid
+
+
+def add_item(cursor, item_name):
+    """
+    The function inserts a new item on ``cursor`` and returns its id.
+    Call ``invalidate_items()`` once the transaction is committed.
+    """
+    cursor.execute("INSERT INTO items (item_name) VALUES (%s)", (item_name,))
+    return cursor.lastrowid
+
+
+def invalidate_enrollees(broadcast=True):
+    """
+    The function drops the cached enrollee lists and searches, and with
+    ``broadcast`` tells the other workers to drop theirs
+    """
+    _cache.invalidate(lambda key: key[0] == "enrollees")
+    _search_cache.invalidate()
+    if broadcast:
+        changes.publish("enrollees")
+    logger.debug("Enrollee reference data invalidated")
+
+
+def items_version():
+    """
+    The function returns a counter that moves whenever the item list is
+    invalidated, here or by another process, so open forms can reload it
+    """
+    return _items_version
+
+
+def invalidate_items(broadcast=True):
+    global _items_version
+    _cache.invalidate(lambda key: key[0] == "items")
+    _items_version += 1
+    if broadcast:
+        changes.publish("items")
+    logger.debug("Item reference data invalidated")
+
+
+def invalidate_all(broadcast=True):
+    global _items_version
+    _cache.invalidate()
+    _items_version += 1
+    _search_cache.invalidate()
+    if broadcast:
+        changes.publish("reference")
+
+
+changes.subscribe("enrollees", lambda: invalidate_enrollees(broadcast=False))
+changes.subscribe("items", lambda: invalidate_items(broadcast=False))
+changes.subscribe("reference", lambda: invalidate_all(broadcast=False))
+
+
+def cache_stats():
+    return _cache.stats()
+
+
+def _cache_metrics():
+    stats = cache_stats()
+    yield "recon_reference_cache_entries", "Entries held in the reference-data cache.", "gauge", {(): stats["size"]}
+    for name in ("hits", "misses", "evictions"):
+        yield f"recon_reference_cache_{name}_total", f"Reference-data cache {name}.", "counter", {(): stats[name]}
+    stats = _search_cache.stats()
+    yield "recon_enrollee_search_cache_entries", "Typed prefixes held in the enrollee search cache.", "gauge", {(): stats["size"]}
+    for name in ("hits", "misses"):
+        yield f"recon_enrollee_search_cache_{name}_total", f"Enrollee search cache {name}.", "counter", {(): stats[name]}
+
+
+registry.add_collector(_cache_metrics)
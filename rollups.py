@@ -0,0 +1,225 @@
+#  --- Monthly Rollups of Payments and Purchases ---
+import sys
+import time
+import logging
+import argparse
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from db import get_connection
+from reference import MONTHS
+
+
+logger = logging.getLogger("ShinyAppLogger")
+
+PAYMENT_UPSERT = """
+    INSERT INTO payment_totals (school_id, fee_type, year_paid, month_no, payment_count, amount)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE payment_count = payment_count + VALUES(payment_count), amount = amount + VALUES(amount)
+"""
+
+PURCHASE_UPSERT = """
+    INSERT INTO purchase_totals (item_id, school_id, year_paid, month_no, purchase_count, amount)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE purchase_count = purchase_count + VALUES(purchase_count), amount = amount + VALUES(amount)
+"""
+
+_MONTH_FIELD = "FIELD(month_paid, " + ", ".join(f"'{month}'" for month in MONTHS) + ")"
+
+# archived years are no longer in the ledger tables, so their totals are kept as they are
+_OPEN_YEARS = "year_paid NOT IN (SELECT year_paid FROM archive_files)"
+
+REBUILD_SQL = [
+    f"DELETE FROM payment_totals WHERE {_OPEN_YEARS}",
+    f"""
+    INSERT INTO payment_totals (school_id, fee_type, year_paid, month_no, payment_count, amount)
+    SELECT school_id, fee_type, year_paid, {_MONTH_FIELD}, COUNT(*), SUM(amount)
+    FROM payments
+    WHERE {_OPEN_YEARS}
+    GROUP BY school_id, fee_type, year_paid, {_MONTH_FIELD}
+    """,
+    f"DELETE FROM purchase_totals WHERE {_OPEN_YEARS}",
+    f"""
+    INSERT INTO purchase_totals (item_id, school_id, year_paid, month_no, purchase_count, amount)
+    SELECT item_id, school_id, year_paid, {_MONTH_FIELD}, COUNT(*), SUM(amount)
+    FROM purchases
+    WHERE {_OPEN_YEARS}
+    GROUP BY item_id, school_id, year_paid, {_MONTH_FIELD}
+    """,
+]
+
+PAYMENT_REPORT_SQL = """
+    SELECT st.school_name AS school, t.fee_type, t.year_paid AS year, t.month_no AS month,
+           t.payment_count AS payments, t.amount
+    FROM payment_totals t
+    JOIN school_types st ON st.school_id = t.school_id
+"""
+
+PURCHASE_REPORT_SQL = """
+    SELECT i.item_name AS item, st.school_name AS school, t.year_paid AS year, t.month_no AS month,
+           t.purchase_count AS purchases, t.amount
+    FROM purchase_totals t
+    JOIN items i ON i.item_id = t.item_id
+    JOIN school_types st ON st.school_id = t.school_id
+"""
+
+VERSION_SQL = """
+    SELECT (SELECT COUNT(*) FROM payment_totals), (SELECT COALESCE(SUM(payment_count), 0) FROM payment_totals),
+           (SELECT COALESCE(SUM(amount), 0) FROM payment_totals),
+           (SELECT COUNT(*) FROM purchase_totals), (SELECT COALESCE(SUM(purchase_count), 0) FROM purchase_totals),
+           (SELECT COALESCE(SUM(amount), 0) FROM purchase_totals)
+"""
+
+
+def _month_no(month):
+    try:
+        return MONTHS.index(month) + 1
+    except ValueError:
+        return 0
+
+
+def _upsert(cursor, sql, rows):
+    """Add ``(key..., amount)`` rows to a rollup, one upsert per distinct key."""
+    totals = {}
+    for *key, amount in rows:
+        count, total = totals.get(tuple(key), (0, Decimal(0)))
+        totals[tuple(key)] = (count + 1, total + Decimal(str(amount)))
+    if totals:
+        cursor.executemany(sql, [(*key, count, total) for key, (count, total) in totals.items()])
+
+
+# --- Write Path ---
+def add_payments(cursor, payments):
+    """
+    The function adds payments, given as ``(school_id, fee_type, month,
+    year, amount)`` tuples, to payment_totals. It does not commit: call it
+    on the cursor that inserted the payments, before their commit.
+    """
+    _upsert(cursor, PAYMENT_UPSERT, (
+        (int(school_id), fee_type, int(year), _month_no(month), amount)
+        for school_id, fee_type, month, year, amount in payments
+    ))
+
+
+def add_purchases(cursor, purchases):
+    """
+    The function adds purchases, given as ``(item_id, school_id, month,
+    year, amount)`` tuples, to purchase_totals. Like add_payments it does
+    not commit.
+    """
+    _upsert(cursor, PURCHASE_UPSERT, (
+        (int(item_id), int(school_id), int(year), _month_no(month), amount)
+        for item_id, school_id, month, year, amount in purchases
+    ))
+
+
+def rebuild(conn):
+    """
+    The function recomputes both rollup tables from the ledger in one
+    transaction, after ledger rows are edited or deleted by hand (schema.py
+    creates and backfills the tables). Years moved to the archive keep their
+    totals. Run it when writes are paused: a payment committed while it runs
+    may be counted twice or not at all.
+    """
+    with conn.cursor() as cursor:
+        for sql in REBUILD_SQL:
+            cursor.execute(sql)
+    conn.commit()
+
+
+# --- Reports ---
+def rollup_version():
+    """
+    The function returns a cheap fingerprint of both rollup tables (row
+    counts and totals) that changes whenever a transaction is recorded
+    """
+    with get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(VERSION_SQL)
+        return tuple(str(value) for value in cursor.fetchone())
+
+
+def _load(sql, columns):
+    with get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(sql)
+        rows = cursor.fetchall()
+    df = pd.DataFrame(rows, columns=columns)
+    df["year"] = df["year"].astype("int16")
+    df["month"] = df["month"].astype("int8")
+    df["amount"] = pd.to_numeric(df["amount"]).astype(float)
+    return df
+
+
+def load_rollups():
+    """
+    The function reads both rollup tables. Returns a dict with a
+    ``payments`` frame (school, fee_type, year, month, payments, amount) and
+    a ``purchases`` frame (item, school, year, month, purchases, amount),
+    amounts in naira.
+    """
+    return {
+        "payments": _load(PAYMENT_REPORT_SQL, ["school", "fee_type", "year", "month", "payments", "amount"]),
+        "purchases": _load(PURCHASE_REPORT_SQL, ["item", "school", "year", "month", "purchases", "amount"]),
+    }
+
+
+def select_totals(df, year_from, year_to, school=None):
+    """The function keeps the rollup rows for a year range and, optionally, one school."""
+    mask = (df["year"] >= year_from) & (df["year"] <= year_to)
+    if school is not None:
+        mask &= df["school"] == school
+    return df[mask]
+
+
+def fees_by_school_view(payments):
+    """The function pivots payment totals into one row per school and one column per fee type."""
+    pivot = payments.pivot_table(index="school", columns="fee_type", values="amount", aggfunc="sum", fill_value=0)
+    pivot.columns.name = None
+    pivot["Total"] = pivot.sum(axis=1)
+    return pivot.reset_index().rename(columns={"school": "School"})
+
+
+def monthly_view(payments, purchases):
+    """
+    The function pivots payment and purchase totals into one row per month
+    and one column per year and kind, for year-over-year comparison
+    """
+    frames = []
+    for kind, df in (("Payments", payments), ("Purchases", purchases)):
+        if len(df):
+            frames.append(df.assign(kind=kind)[["kind", "year", "month", "amount"]])
+    if not frames:
+        return pd.DataFrame(columns=["Month"])
+    pivot = pd.concat(frames).pivot_table(
+        index="month", columns=["year", "kind"], values="amount", aggfunc="sum", fill_value=0
+    ).reindex(range(1, 13), fill_value=0)
+    pivot.columns = [f"{kind} {year}" for year, kind in pivot.columns]
+    pivot.insert(0, "Month", np.array(MONTHS, dtype=object))
+    return pivot.reset_index(drop=True)
+
+
+def items_view(purchases, top=20):
+    """The function totals purchases per item and year, largest items first."""
+    pivot = purchases.pivot_table(index="item", columns="year", values="amount", aggfunc="sum", fill_value=0)
+    pivot.columns = [str(year) for year in pivot.columns]
+    pivot["Total"] = pivot.sum(axis=1)
+    pivot = pivot.sort_values("Total", ascending=False).head(top)
+    return pivot.reset_index().rename(columns={"item": "Item"})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the payment and purchase rollup tables.")
+    parser.add_argument("command", choices=["rebuild"], help="recompute the tables from the ledger")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    started = time.perf_counter()
+    with get_connection() as conn:
+        rebuild(conn)
+    print(f"Rollup tables rebuilt in {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
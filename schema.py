@@ -0,0 +1,269 @@
+#  --- Versioned Database Schema ---
+import sys
+import logging
+import sqlite3
+import argparse
+
+import mysql.connector
+from mysql.connector import errorcode
+
+from db import get_connection
+from reference import MONTHS
+
+
+logger = logging.getLogger("ShinyAppLogger")
+
+_MONTH_FIELD = "FIELD(month_paid, " + ", ".join(f"'{month}'" for month in MONTHS) + ")"
+
+MIGRATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INT NOT NULL PRIMARY KEY,
+        description VARCHAR(255) NOT NULL,
+        applied_at DATETIME NOT NULL
+    )
+"""
+
+# (version, description, statements), applied in order and recorded in
+# schema_migrations. Never edit a released migration: add a new one.
+MIGRATIONS = [
+    (1, "Base tables", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INT AUTO_INCREMENT PRIMARY KEY,
+            username VARCHAR(255) NOT NULL UNIQUE,
+            password_hash VARCHAR(255) NOT NULL
+        ) ENGINE=InnoDB
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS school_types (
+            school_id INT AUTO_INCREMENT PRIMARY KEY,
+            school_name VARCHAR(100) NOT NULL
+        ) ENGINE=InnoDB
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS enrollees (
+            enrollee_id INT AUTO_INCREMENT PRIMARY KEY,
+            first_name VARCHAR(100) NOT NULL,
+            last_name VARCHAR(100) NOT NULL,
+            school_name VARCHAR(100) NOT NULL
+        ) ENGINE=InnoDB
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS items (
+            item_id INT AUTO_INCREMENT PRIMARY KEY,
+            item_name VARCHAR(255) NOT NULL
+        ) ENGINE=InnoDB
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS payments (
+            payment_id INT AUTO_INCREMENT PRIMARY KEY,
+            enrollee_id INT NOT NULL,
+            fee_type VARCHAR(50) NOT NULL,
+            amount DECIMAL(12, 2) NOT NULL,
+            month_paid VARCHAR(20) NOT NULL,
+            year_paid SMALLINT NOT NULL,
+            school_id INT NOT NULL,
+            created_at DATETIME NOT NULL,
+            FOREIGN KEY (enrollee_id) REFERENCES enrollees (enrollee_id),
+            FOREIGN KEY (school_id) REFERENCES school_types (school_id)
+        ) ENGINE=InnoDB
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS purchases (
+            purchase_id INT AUTO_INCREMENT PRIMARY KEY,
+            item_id INT NOT NULL,
+            quantity VARCHAR(50),
+            amount DECIMAL(12, 2) NOT NULL,
+            school_id INT NOT NULL,
+            month_paid VARCHAR(20) NOT NULL,
+            year_paid SMALLINT NOT NULL,
+            created_at DATETIME NOT NULL,
+            FOREIGN KEY (item_id) REFERENCES items (item_id),
+            FOREIGN KEY (school_id) REFERENCES school_types (school_id)
+        ) ENGINE=InnoDB
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS fee_schedule (
+            school_id INT NOT NULL,
+            fee_type VARCHAR(50) NOT NULL,
+            month_paid VARCHAR(20) NOT NULL,
+            year_paid SMALLINT NULL,
+            amount DECIMAL(12, 2) NOT NULL,
+            FOREIGN KEY (school_id) REFERENCES school_types (school_id)
+        ) ENGINE=InnoDB
+        """,
+    ]),
+    (2, "Indexes for History, Reports and reference lookups", [
+        # History date filters, keyset pages and the delta refresh
+        "CREATE INDEX idx_payments_created_at ON payments (created_at)",
+        "CREATE INDEX idx_purchases_created_at ON purchases (created_at)",
+        # History school and fee type filters
+        "CREATE INDEX idx_payments_school_fee ON payments (school_id, fee_type)",
+        # the per-school enrollee list on the Task tab
+        "CREATE INDEX idx_enrollees_school ON enrollees (school_name, last_name, first_name)",
+        # names are what bulk imports resolve against, so they must be unambiguous
+        "CREATE UNIQUE INDEX uq_school_types_name ON school_types (school_name)",
+        "CREATE UNIQUE INDEX uq_items_name ON items (item_name)",
+    ]),
+    (3, "Monthly rollup tables", [
+        """
+        CREATE TABLE IF NOT EXISTS payment_totals (
+            school_id INT NOT NULL,
+            fee_type VARCHAR(50) NOT NULL,
+            year_paid SMALLINT NOT NULL,
+            month_no TINYINT NOT NULL,
+            payment_count INT NOT NULL,
+            amount DECIMAL(16, 2) NOT NULL,
+            PRIMARY KEY (school_id, fee_type, year_paid, month_no)
+        ) ENGINE=InnoDB
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS purchase_totals (
+            item_id INT NOT NULL,
+            school_id INT NOT NULL,
+            year_paid SMALLINT NOT NULL,
+            month_no TINYINT NOT NULL,
+            purchase_count INT NOT NULL,
+            amount DECIMAL(16, 2) NOT NULL,
+            PRIMARY KEY (item_id, school_id, year_paid, month_no)
+        ) ENGINE=InnoDB
+        """,
+        # the backfill, as rollups.REBUILD_SQL stood before the archive existed
+        "DELETE FROM payment_totals",
+        f"""
+        INSERT INTO payment_totals (school_id, fee_type, year_paid, month_no, payment_count, amount)
+        SELECT school_id, fee_type, year_paid, {_MONTH_FIELD}, COUNT(*), SUM(amount)
+        FROM payments
+        GROUP BY school_id, fee_type, year_paid, {_MONTH_FIELD}
+        """,
+        "DELETE FROM purchase_totals",
+        f"""
+        INSERT INTO purchase_totals (item_id, school_id, year_paid, month_no, purchase_count, amount)
+        SELECT item_id, school_id, year_paid, {_MONTH_FIELD}, COUNT(*), SUM(amount)
+        FROM purchases
+        GROUP BY item_id, school_id, year_paid, {_MONTH_FIELD}
+        """,
+    ]),
+    (4, "First-name index for the enrollee search", [
+        # last names are covered by idx_enrollees_school
+        "CREATE INDEX idx_enrollees_school_first ON enrollees (school_name, first_name, last_name)",
+    ]),
+    (5, "Keys of submissions written by the write-behind queue", [
+        """
+        CREATE TABLE IF NOT EXISTS write_queue_applied (
+            submission_key CHAR(32) NOT NULL PRIMARY KEY,
+            applied_at DATETIME NOT NULL
+        ) ENGINE=InnoDB
+        """,
+    ]),
+    (6, "Manifest of the Parquet archive of closed years", [
+        """
+        CREATE TABLE IF NOT EXISTS archive_files (
+            path VARCHAR(255) NOT NULL PRIMARY KEY,
+            ledger VARCHAR(20) NOT NULL,
+            year_paid SMALLINT NOT NULL,
+            school_id INT NOT NULL,
+            school_name VARCHAR(100) NOT NULL,
+            row_count INT NOT NULL,
+            amount DECIMAL(16, 2) NOT NULL,
+            archived_at DATETIME NOT NULL,
+            INDEX idx_archive_files_year (year_paid)
+        ) ENGINE=InnoDB
+        """,
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _no_such_table(error):
+    # sqlite3 for the benchmarks' stand-in database
+    if isinstance(error, mysql.connector.errors.ProgrammingError):
+        return error.errno == errorcode.ER_NO_SUCH_TABLE
+    return isinstance(error, sqlite3.OperationalError) and "no such table" in str(error)
+
+
+def applied_versions(conn):
+    """
+    The function returns the set of migration versions recorded in the
+    database. It only reads: a database without a schema_migrations table
+    has had none applied.
+    """
+    with conn.cursor() as cursor:
+        try:
+            cursor.execute("SELECT version FROM schema_migrations")
+        except (mysql.connector.errors.ProgrammingError, sqlite3.OperationalError) as e:
+            if not _no_such_table(e):
+                raise
+            return set()
+        return {int(row[0]) for row in cursor.fetchall()}
+
+
+def pending_migrations(conn):
+    applied = applied_versions(conn)
+    return [migration for migration in MIGRATIONS if migration[0] not in applied]
+
+
+def migrate(conn, target=None):
+    """
+    The function applies the pending migrations up to ``target`` (default:
+    all of them) in order and records each one in schema_migrations.
+
+    MySQL commits DDL implicitly, so a migration that fails part-way is not
+    rolled back: fix the cause, undo its partial changes if needed, and run
+    it again. Returns the versions applied.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(MIGRATIONS_TABLE)
+    applied = []
+    for version, description, statements in pending_migrations(conn):
+        if target is not None and version > target:
+            break
+        logger.info(f"Applying migration {version}: {description}")
+        with conn.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, description, applied_at) VALUES (%s, %s, NOW())",
+                (version, description),
+            )
+        conn.commit()
+        applied.append(version)
+    return applied
+
+
+def check_schema():
+    """
+    The function logs a warning when the database is behind this version
+    of the app. Returns the pending versions. It changes nothing: creating
+    or upgrading the schema is left to ``python schema.py migrate``.
+    """
+    with get_connection() as conn:
+        pending = [version for version, _, _ in pending_migrations(conn)]
+        conn.commit()
+    if pending:
+        logger.warning(f"Database schema is missing migrations {pending}; run `python schema.py migrate`")
+    return pending
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create or upgrade the app's database schema.")
+    parser.add_argument("command", choices=["migrate", "status"])
+    parser.add_argument("--target", type=int, help="migrate up to this version only")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    with get_connection() as conn:
+        if args.command == "migrate":
+            applied = migrate(conn, args.target)
+            print(f"Applied migrations {applied}" if applied else "Schema is up to date")
+        else:
+            applied = applied_versions(conn)
+            conn.commit()
+            for version, description, _ in MIGRATIONS:
+                print(f"{version:>4}  {'applied' if version in applied else 'pending':<8} {description}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
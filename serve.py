@@ -0,0 +1,170 @@
+#  --- Multi-Worker Launcher ---
+import os
+import sys
+import time
+import uuid
+import signal
+import logging
+import argparse
+import subprocess
+
+
+logger = logging.getLogger("ShinyAppLogger")
+
+WORKERS = int(os.getenv("WORKERS", str(os.cpu_count() or 1)))
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", "8001"))
+AFFINITY_COOKIE = "recon_affinity"
+
+# nginx picks the worker from the affinity cookie, so a browser's websocket
+# and its session's dynamic routes (the enrollee search) reach the worker
+# that holds the session. A first visit has no cookie yet; its page carries
+# no session state, and the cookie it sets is sent with the websocket.
+NGINX_TEMPLATE = """\
+upstream reconciliation_app {{
+    hash $cookie_{cookie} consistent;
+{servers}
+}}
+
+map $http_upgrade $connection_upgrade {{
+    default upgrade;
+    ''      close;
+}}
+
+server {{
+    listen {listen};
+    server_name {server_name};
+    client_max_body_size 50m;
+
+    # every request reaches the workers from 127.0.0.1, so keep the
+    # metrics off the proxy: scrape each worker's port directly
+    location = {metrics_path} {{
+        return 404;
+    }}
+
+    location / {{
+        proxy_pass http://reconciliation_app;
+        proxy_http_version 1.1;
+        proxy_set_header Upgrade $http_upgrade;
+        proxy_set_header Connection $connection_upgrade;
+        proxy_set_header Host $host;
+        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto $scheme;
+        proxy_buffering off;
+        proxy_read_timeout 1d;
+    }}
+}}
+"""
+
+
+def with_affinity_cookie(asgi_app):
+    """
+    The function wraps an ASGI app so that every HTTP response to a browser
+    without the affinity cookie sets one, a random id that nginx hashes to
+    choose the browser's worker
+    """
+    async def app(scope, receive, send):
+        if scope["type"] != "http" or _has_affinity_cookie(scope):
+            await asgi_app(scope, receive, send)
+            return
+        cookie = f"{AFFINITY_COOKIE}={uuid.uuid4().hex}; Path=/; HttpOnly; SameSite=Lax".encode()
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), (b"set-cookie", cookie)]}
+            await send(message)
+
+        await asgi_app(scope, receive, send_with_cookie)
+
+    return app
+
+
+def _has_affinity_cookie(scope):
+    prefix = f"{AFFINITY_COOKIE}=".encode()
+    for name, value in scope.get("headers", []):
+        if name == b"cookie" and any(part.strip().startswith(prefix) for part in value.split(b";")):
+            return True
+    return False
+
+
+def worker_ports(workers, base_port):
+    return [base_port + i for i in range(workers)]
+
+
+def nginx_config(workers, base_port, listen="80", server_name="_"):
+    """The function renders the nginx site that spreads browsers over the workers."""
+    from metrics import METRICS_PATH
+
+    servers = "\n".join(f"    server 127.0.0.1:{port};" for port in worker_ports(workers, base_port))
+    return NGINX_TEMPLATE.format(
+        cookie=AFFINITY_COOKIE, servers=servers, listen=listen, server_name=server_name, metrics_path=METRICS_PATH
+    )
+
+
+def run_workers(workers, base_port, host="127.0.0.1"):
+    """
+    The function starts one uvicorn process per worker, each on its own
+    port, restarts any that exits, and stops them all on SIGTERM or Ctrl-C.
+    Returns once every worker has exited.
+    """
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    def spawn(worker, port):
+        logger.info(f"Starting worker {worker} on {host}:{port}")
+        return subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app:app", "--host", host, "--port", str(port)],
+            env={**os.environ, "WORKER_ID": str(worker)},
+        )
+
+    ports = worker_ports(workers, base_port)
+    processes = {worker: (spawn(worker, port), time.monotonic()) for worker, port in enumerate(ports)}
+    while not stopping:
+        time.sleep(0.5)
+        for worker, (process, started) in list(processes.items()):
+            if stopping or process.poll() is None:
+                continue
+            logger.error(f"Worker {worker} exited with status {process.returncode}")
+            # a worker that dies at once (e.g. a bad setting) is not restarted in a tight loop
+            if time.monotonic() - started < 5:
+                time.sleep(5)
+            processes[worker] = (spawn(worker, ports[worker]), time.monotonic())
+
+    logger.info("Stopping workers")
+    for process, _ in processes.values():
+        if process.poll() is None:
+            process.terminate()
+    deadline = time.monotonic() + 15
+    for process, _ in processes.values():
+        try:
+            process.wait(max(deadline - time.monotonic(), 0))
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the app as several worker processes behind nginx.")
+    parser.add_argument("command", choices=["run", "nginx"], help="start the workers, or print the nginx site")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="worker processes (default: %(default)s)")
+    parser.add_argument("--base-port", type=int, default=WORKER_BASE_PORT,
+                        help="port of the first worker; the others follow (default: %(default)s)")
+    parser.add_argument("--host", default="127.0.0.1", help="address the workers listen on")
+    parser.add_argument("--listen", default="80", help="nginx listen directive (nginx only)")
+    parser.add_argument("--server-name", default="_", help="nginx server_name (nginx only)")
+    args = parser.parse_args(argv)
+
+    if args.command == "nginx":
+        print(nginx_config(args.workers, args.base_port, args.listen, args.server_name), end="")
+        return 0
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    return run_workers(args.workers, args.base_port, args.host)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+#  --- Test Fixtures ---
+"""
+The tests run the app's data paths against the SQLite stand-in of
+benchmarks/standin.py, loaded with a small generated ledger. Each test gets
+its own copy of the database and its own archive directory.
+"""
+import os
+import sys
+import shutil
+import tempfile
+from datetime import date
+
+import pytest
+
+# the modules read these at import, so set them before anything imports them
+_runtime = tempfile.mkdtemp(prefix="recon-tests-")
+os.environ.setdefault("CHANGES_PATH", os.path.join(_runtime, "changes.sqlite3"))
+os.environ.setdefault("WRITE_QUEUE_PATH", os.path.join(_runtime, "write_queue.sqlite3"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import archive
+import reference
+from benchmarks import generator, standin
+
+
+LEDGER_ROWS = 3000
+
+
+@pytest.fixture(scope="session")
+def ledger_file(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("ledger") / "ledger.sqlite3")
+    standin.create_schema(path)
+    conn = standin.connect(path)
+    try:
+        generator.load(conn, generator.generate(rows=LEDGER_ROWS, seed=11, years=3))
+    finally:
+        conn.close()
+    return path
+
+
+@pytest.fixture
+def ledger(ledger_file, tmp_path, monkeypatch):
+    """A private copy of the generated ledger, served by the connection pool."""
+    path = str(tmp_path / "ledger.sqlite3")
+    shutil.copyfile(ledger_file, path)
+    db.configure_pool(connect=lambda: standin.connect(path), size=2, max_overflow=2, timeout=5)
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    archive.invalidate(broadcast=False)
+    reference.invalidate_all(broadcast=False)
+    yield path
+    archive.invalidate(broadcast=False)
+    db.get_pool().dispose()
+
+
+@pytest.fixture
+def archived(ledger):
+    """The ledger with every closed year moved to the Parquet archive."""
+    years = list(range(date.today().year - 2, date.today().year))
+    with db.get_connection() as conn:
+        for year in years:
+            archive.archive_year(conn, year)
+    return years
@@ -0,0 +1,22 @@
+#  --- App Helpers ---
+import importlib
+
+import pytest
+
+
+@pytest.fixture
+def app(ledger, tmp_path, monkeypatch):
+    # the app writes app.log to the working directory on import
+    monkeypatch.chdir(tmp_path)
+    return importlib.import_module("app")
+
+
+def test_changing_school_clears_the_enrollee_selection(app):
+    message = app.enrollee_search_message("session/abc/dataobj/enrollee_search")
+    assert message == {"url": "session/abc/dataobj/enrollee_search", "value": ""}
+
+
+def test_selected_id_ignores_placeholder_choices(app):
+    assert app.selected_id("12") == 12
+    assert app.selected_id("add_new_enrollee") is None
+    assert app.selected_id("") is None
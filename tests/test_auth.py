@@ -0,0 +1,143 @@
+#  --- Authentication ---
+import asyncio
+
+import pytest
+
+import db
+import auth
+from auth import LOGIN_BUSY, LOGIN_INVALID, LOGIN_OK, LOGIN_RATE_LIMITED, TokenBuckets
+
+USERNAME = "bursar1@example.com"
+PASSWORD = b"benchmark"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(auth.time, "monotonic", clock)
+    return clock
+
+
+def test_bucket_allows_a_burst_then_refills_over_time(clock):
+    buckets = TokenBuckets(burst=3, per_minute=6)
+    assert [buckets.take("ada") for _ in range(4)] == [True, True, True, False]
+    assert buckets.take("tunde")
+    clock.now += 9
+    assert not buckets.take("ada")
+    clock.now += 1
+    assert buckets.take("ada")
+    assert not buckets.take("ada")
+
+
+def test_tokens_given_back_never_exceed_the_burst(clock):
+    buckets = TokenBuckets(burst=2, per_minute=1)
+    buckets.take("ada")
+    for _ in range(5):
+        buckets.give_back("ada")
+    assert [buckets.take("ada") for _ in range(3)] == [True, True, False]
+
+
+def test_full_buckets_are_pruned_first(clock):
+    buckets = TokenBuckets(burst=2, per_minute=60, maxsize=3)
+    for key in ("a", "b", "c"):
+        buckets.take(key)
+    clock.now += 5
+    buckets.take("d")
+    buckets.take("e")
+    # a, b and c had filled up again, so only they were dropped
+    assert sorted(buckets._buckets) == ["d", "e"]
+
+
+@pytest.fixture
+def logins(ledger, monkeypatch):
+    """Fresh login limits, with the generated users' 4-round hashes as current."""
+    monkeypatch.setattr(auth, "BCRYPT_ROUNDS", 4)
+    monkeypatch.setattr(auth, "_dummy_hash", None)
+    monkeypatch.setattr(auth, "_user_buckets", TokenBuckets(burst=3, per_minute=1))
+    monkeypatch.setattr(auth, "_ip_buckets", TokenBuckets(burst=5, per_minute=1))
+    auth.invalidate_users(broadcast=False)
+    yield
+    auth.invalidate_users(broadcast=False)
+
+
+def _login(username, password, client=None):
+    return asyncio.run(auth.authenticate(username, password, client))
+
+
+def _stored_hash(username=USERNAME):
+    with db.get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT password_hash FROM users WHERE username = %s", (username,))
+        return cursor.fetchone()[0]
+
+
+def test_login_checks_the_password(logins):
+    user, message = _login(f"  {USERNAME} ", PASSWORD)
+    assert (user["username"], message) == (USERNAME, LOGIN_OK)
+    assert _login(USERNAME, b"wrong") == (None, LOGIN_INVALID)
+    assert _login("nobody@example.com", PASSWORD) == (None, LOGIN_INVALID)
+    assert _login("", PASSWORD) == (None, LOGIN_INVALID)
+
+
+def test_failures_use_up_the_allowance_and_successes_refund_it(logins):
+    for _ in range(5):
+        assert _login(USERNAME, PASSWORD)[1] == LOGIN_OK
+    for _ in range(3):
+        assert _login(USERNAME.upper(), b"wrong") == (None, LOGIN_INVALID)
+    assert _login(USERNAME, PASSWORD) == (None, LOGIN_RATE_LIMITED)
+    # the limit is per username
+    assert _login("bursar2@example.com", PASSWORD)[1] == LOGIN_OK
+
+
+def test_attempts_are_limited_per_client_address(logins):
+    for i in range(5):
+        assert _login(f"bursar{i + 1}@example.com", b"wrong", "10.0.0.9") == (None, LOGIN_INVALID)
+    assert _login("bursar6@example.com", PASSWORD, "10.0.0.9") == (None, LOGIN_RATE_LIMITED)
+    # refused by the address, so the username keeps its tokens
+    assert _login("bursar6@example.com", PASSWORD, "10.0.0.10")[1] == LOGIN_OK
+
+
+def test_login_waiting_too_long_for_a_slot_is_turned_away(logins, monkeypatch):
+    monkeypatch.setattr(auth, "LOGIN_CONCURRENCY", 1)
+    monkeypatch.setattr(auth, "LOGIN_QUEUE_TIMEOUT", 0.05)
+
+    async def scenario():
+        slots = auth._login_slots()
+        await slots.acquire()
+        try:
+            busy = await auth.authenticate(USERNAME, PASSWORD)
+        finally:
+            slots.release()
+        return busy, await auth.authenticate(USERNAME, PASSWORD)
+
+    busy, after = asyncio.run(scenario())
+    assert busy == (None, LOGIN_BUSY)
+    assert after[1] == LOGIN_OK
+    # a turned-away attempt does not count against the user
+    assert auth._user_buckets.take(USERNAME) and auth._user_buckets.take(USERNAME)
+
+
+def test_hash_with_other_rounds_is_upgraded_at_login(logins, monkeypatch):
+    assert auth.hash_rounds(_stored_hash()) == 4
+    monkeypatch.setattr(auth, "BCRYPT_ROUNDS", 5)
+    assert _login(USERNAME, PASSWORD)[1] == LOGIN_OK
+    upgraded = _stored_hash()
+    assert auth.hash_rounds(upgraded) == 5
+    # the cached record was dropped, so the next login sees the new hash and leaves it
+    assert _login(USERNAME, PASSWORD)[1] == LOGIN_OK
+    assert _stored_hash() == upgraded
+    assert auth.hash_rounds("not a hash") is None
+
+
+def test_failed_login_does_not_rehash(logins, monkeypatch):
+    monkeypatch.setattr(auth, "BCRYPT_ROUNDS", 5)
+    before = _stored_hash()
+    assert _login(USERNAME, b"wrong") == (None, LOGIN_INVALID)
+    assert _stored_hash() == before
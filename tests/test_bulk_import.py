@@ -0,0 +1,97 @@
+#  --- Bulk Import ---
+import pandas as pd
+import pytest
+
+import db
+from bulk_import import import_frame, resolve_ids, validate
+from reference import FEE_TYPES
+
+
+def _payment(**overrides):
+    row = {"enrollee": "Ada Obi", "school": "Primary", "fee_type": FEE_TYPES[0],
+           "amount": "1,500.00", "month": "january", "year": "2024"}
+    row.update(overrides)
+    return row
+
+
+def _errors(rows, kind="payments"):
+    valid, errors = validate(pd.DataFrame(rows, dtype=str), kind)
+    return len(valid), dict(zip(errors["row"], errors["error"]))
+
+
+def test_valid_rows_are_cleaned():
+    valid, errors = validate(pd.DataFrame([_payment()]), "payments")
+    assert errors.empty
+    row = valid.iloc[0]
+    assert (row["amount"], row["month"], row["year"]) == ("1500.00", "January", 2024)
+
+
+@pytest.mark.parametrize("amount", ["", "abc", "-5", "inf", "-inf", "nan", "NaN"])
+def test_amounts_that_are_not_finite_non_negative_numbers_are_rejected(amount):
+    assert _errors([_payment(amount=amount)]) == (0, {1: "amount must be a non-negative number"})
+
+
+def test_every_problem_with_a_row_is_reported():
+    rows = [_payment(), _payment(school=" ", month="Janvier", year="1850"), _payment(fee_type="Bus")]
+    count, errors = _errors(rows)
+    assert count == 1
+    assert errors == {
+        2: "school is required; year must be a whole year; month must be a full month name",
+        3: f"fee_type must be one of {', '.join(FEE_TYPES)}",
+    }
+
+
+@pytest.mark.parametrize("quantity", ["0", "inf", "x"])
+def test_purchase_quantities_must_be_positive(quantity):
+    row = {"item": "Chalk", "school": "Primary", "quantity": quantity, "amount": "10", "month": "May", "year": "2024"}
+    assert _errors([row], "purchases") == (0, {1: "quantity must be a positive number"})
+
+
+def test_missing_columns_are_refused():
+    with pytest.raises(ValueError, match="amount"):
+        validate(pd.DataFrame([_payment()]).drop(columns="amount"), "payments")
+
+
+def _names():
+    with db.get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT first_name, last_name, school_name FROM enrollees ORDER BY enrollee_id LIMIT 2")
+        (first, last, school), twin = cursor.fetchall()
+        # a namesake of the second enrollee in the same school
+        cursor.execute("INSERT INTO enrollees (first_name, last_name, school_name) VALUES (%s, %s, %s)", twin)
+        conn.commit()
+        cursor.execute("SELECT item_name FROM items ORDER BY item_id LIMIT 1")
+        item = cursor.fetchone()[0]
+    return (f"{first} {last}", school), (f"{twin[0]} {twin[1]}", twin[2]), item
+
+
+def test_names_resolve_to_ids(ledger):
+    (name, school), (twin, twin_school), _ = _names()
+    rows = [_payment(enrollee=name, school=school), _payment(enrollee=name, school="No such school"),
+            _payment(enrollee="No Such Person", school=school), _payment(enrollee=twin, school=twin_school)]
+    valid, _ = validate(pd.DataFrame(rows), "payments")
+    with db.get_connection() as conn, conn.cursor() as cursor:
+        resolved, errors = resolve_ids(cursor, valid, "payments")
+    assert list(resolved.index) == [0]
+    assert dict(zip(errors["row"], errors["error"])) == {
+        2: "unknown school",
+        3: "enrollee not found in school",
+        4: "enrollee name is ambiguous within school",
+    }
+
+
+def test_import_inserts_the_good_rows_and_reports_the_rest(ledger):
+    (_, school), _, item = _names()
+    with db.get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM purchases")
+        before = cursor.fetchone()[0]
+    frame = pd.DataFrame([
+        {"item": item, "school": school, "quantity": "2", "amount": "40", "month": "March", "year": "2024"},
+        {"item": "No such item", "school": school, "quantity": "2", "amount": "40", "month": "March", "year": "2024"},
+        {"item": item, "school": school, "quantity": "2", "amount": "inf", "month": "March", "year": "2024"},
+    ])
+    result = import_frame(frame, "purchases")
+    assert (result["inserted"], result["rejected"]) == (1, 2)
+    assert list(result["errors"]["row"]) == [2, 3]
+    with db.get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM purchases")
+        assert cursor.fetchone()[0] == before + 1
@@ -0,0 +1,128 @@
+#  --- Connection Pool ---
+import threading
+import time
+
+import pytest
+
+from db import ConnectionPool, PoolTimeout
+
+
+class FakeConnection:
+    """A driver connection whose ping and rollback can be made to fail."""
+
+    opened = 0
+
+    def __init__(self):
+        FakeConnection.opened += 1
+        self.healthy = True
+        self.resettable = True
+        self.closed = False
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        if not self.healthy:
+            raise ConnectionError("gone away")
+
+    def rollback(self):
+        if not self.resettable:
+            raise ConnectionError("cannot reset")
+
+    def close(self):
+        self.closed = True
+
+
+def test_idle_connections_are_reused():
+    pool = ConnectionPool(connect=FakeConnection, size=2, max_overflow=0)
+    conn = pool.acquire()
+    pool.release(conn)
+    assert pool.acquire() is conn
+    assert pool.stats()["open"] == 1
+
+
+def test_overflow_connections_are_closed_on_release():
+    pool = ConnectionPool(connect=FakeConnection, size=1, max_overflow=2, timeout=0.1)
+    conns = [pool.acquire() for _ in range(3)]
+    assert pool.stats()["open"] == 3
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    for conn in conns:
+        pool.release(conn)
+    stats = pool.stats()
+    assert (stats["open"], stats["idle"], stats["in_use"], stats["timeouts"]) == (1, 1, 0, 1)
+    assert sum(conn.closed for conn in conns) == 2
+
+
+def test_waiter_is_woken_when_a_connection_is_closed():
+    pool = ConnectionPool(connect=FakeConnection, size=1, max_overflow=0, timeout=5)
+    conn = pool.acquire()
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(pool.acquire()))
+    waiter.start()
+    time.sleep(0.1)
+    # the connection cannot be reset, so it is closed rather than returned: the waiter opens a new one
+    conn.resettable = False
+    started = time.monotonic()
+    pool.release(conn)
+    waiter.join(5)
+    assert got and got[0] is not conn
+    assert time.monotonic() - started < 1
+    assert pool.stats()["open"] == 1
+
+
+def test_stale_connection_is_replaced_on_checkout():
+    pool = ConnectionPool(connect=FakeConnection, size=1, max_overflow=0)
+    conn = pool.acquire()
+    pool.release(conn)
+    conn.healthy = False
+    replacement = pool.acquire()
+    assert replacement is not conn and conn.closed
+    stats = pool.stats()
+    assert (stats["open"], stats["reconnects"]) == (1, 1)
+
+
+def test_connections_past_recycle_age_are_replaced():
+    pool = ConnectionPool(connect=FakeConnection, size=1, max_overflow=0, recycle=0.05)
+    conn = pool.acquire()
+    pool.release(conn)
+    time.sleep(0.1)
+    assert pool.acquire() is not conn
+
+
+def test_failed_connect_frees_its_place():
+    attempts = []
+
+    def connect():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ConnectionError("refused")
+        return FakeConnection()
+
+    pool = ConnectionPool(connect=connect, size=1, max_overflow=0, timeout=0.1)
+    with pytest.raises(ConnectionError):
+        pool.acquire()
+    assert pool.stats()["open"] == 0
+    assert isinstance(pool.acquire(), FakeConnection)
+
+
+def test_open_connections_stay_within_the_limit_under_contention():
+    pool = ConnectionPool(connect=FakeConnection, size=2, max_overflow=1, timeout=5)
+    peak = []
+    errors = []
+
+    def work():
+        try:
+            for _ in range(300):
+                conn = pool.acquire()
+                peak.append(pool.stats()["open"])
+                conn.resettable = len(peak) % 5 != 0
+                pool.release(conn)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert max(peak) <= 3
+    assert pool.stats()["in_use"] == 0
@@ -0,0 +1,104 @@
+#  --- History Reads ---
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from benchmarks import generator, standin
+from history_store import HistoryStore, filter_history, page_history
+from queries import HISTORY_COLUMNS, load_history_df, load_history_page, period_key, stream_history_csv
+from reference import FEE_TYPES
+
+
+FILTERS = [
+    {},
+    {"txn_type": "Payment"},
+    {"txn_type": "Purchase", "school": generator.SCHOOLS[0]},
+    {"fee_type": FEE_TYPES[0]},
+    {"start_date": date(date.today().year - 1, 3, 1), "end_date": date(date.today().year, 2, 1)},
+    {"period_start": period_key(date.today().year - 2, 6), "period_end": period_key(date.today().year - 1, 6)},
+]
+
+
+def _store():
+    store = HistoryStore(refresh_interval=0, resync_interval=float("inf"))
+    store.refresh()
+    return store
+
+
+def _all_pages(load, page_size, **filters):
+    pages, cursor = [], None
+    while True:
+        page, cursor = load(cursor=cursor, page_size=page_size, **filters)
+        pages.append(page)
+        if cursor is None:
+            return pd.concat(pages, ignore_index=True)
+
+
+def _normalised(frame):
+    # the stand-in returns timestamps as text and amounts as numbers; the store holds them typed
+    return pd.DataFrame({
+        "Type": frame["Type"].astype(str),
+        "Name": frame["Name"].astype(str),
+        "Amount": pd.to_numeric(frame["Amount"]).astype("float64").round(2),
+        "Category": frame["Category"].astype(str),
+        "Period": frame["Period"].astype(str),
+        "created_at": pd.to_datetime(frame["created_at"]),
+    }).reset_index(drop=True)
+
+
+def _check_pages(filters, order):
+    store = _store()
+    sql = _all_pages(load_history_page, 97, order=order, **filters)
+    memory = _all_pages(lambda **kwargs: page_history(store.frame, **kwargs), 97, order=order, **filters)
+    pd.testing.assert_frame_equal(_normalised(sql), _normalised(memory))
+    expected = filter_history(store.frame, **filters)
+    if order == "ASC":
+        expected = expected.iloc[::-1]
+    assert list(sql["created_at"].map(pd.Timestamp)) == list(expected["created_at"])
+
+
+@pytest.mark.parametrize("order", ["DESC", "ASC"])
+@pytest.mark.parametrize("filters", FILTERS)
+def test_keyset_pages_match_the_store(ledger, filters, order):
+    _check_pages(filters, order)
+
+
+@pytest.mark.parametrize("order", ["DESC", "ASC"])
+@pytest.mark.parametrize("filters", FILTERS[:3])
+def test_keyset_pages_match_the_store_with_archived_years(archived, filters, order):
+    _check_pages(filters, order)
+
+
+@pytest.mark.parametrize("chunk_size", [7, 250, 5000])
+@pytest.mark.parametrize("filters", FILTERS)
+def test_streamed_csv_matches_the_frame(ledger, filters, chunk_size):
+    streamed = "".join(stream_history_csv(chunk_size=chunk_size, **filters))
+    assert streamed == load_history_df(**filters).to_csv(index=False)
+
+
+@pytest.mark.parametrize("chunk_size", [7, 250, 5000])
+@pytest.mark.parametrize("filters", FILTERS)
+def test_streamed_csv_matches_the_frame_with_archived_years(archived, filters, chunk_size):
+    streamed = "".join(stream_history_csv(chunk_size=chunk_size, **filters))
+    assert streamed == load_history_df(**filters).to_csv(index=False)
+
+
+def test_streamed_csv_with_no_matches_is_the_header(ledger):
+    streamed = "".join(stream_history_csv(school="No such school"))
+    assert streamed == pd.DataFrame(columns=HISTORY_COLUMNS).to_csv(index=False)
+
+
+def test_aborted_export_discards_the_unread_rows(ledger, monkeypatch):
+    discarded = []
+    monkeypatch.setattr(standin.StandinConnection, "consume_results",
+                        lambda conn: discarded.append(conn), raising=False)
+    "".join(stream_history_csv(chunk_size=250))
+    assert discarded == []
+    export = stream_history_csv(chunk_size=7)
+    next(export)
+    export.close()
+    assert len(discarded) == 1
+    # the connection went back to the pool in a usable state
+    streamed = "".join(stream_history_csv(chunk_size=250))
+    assert streamed == load_history_df().to_csv(index=False)
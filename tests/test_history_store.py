@@ -0,0 +1,74 @@
+#  --- Shared History Store ---
+from datetime import timedelta
+
+import pandas as pd
+
+import db
+from history_store import HistoryStore, filter_history, page_history
+
+
+def _store():
+    store = HistoryStore(refresh_interval=0, resync_interval=float("inf"))
+    store.refresh()
+    return store
+
+
+def _count(table):
+    with db.get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        return cursor.fetchone()[0]
+
+
+def _latest(cursor, table, columns):
+    cursor.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY created_at DESC LIMIT 1")
+    return list(cursor.fetchone())
+
+
+PAYMENT = ["enrollee_id", "fee_type", "amount", "month_paid", "year_paid", "school_id", "created_at"]
+PURCHASE = ["item_id", "quantity", "amount", "school_id", "month_paid", "year_paid", "created_at"]
+
+
+def _insert(cursor, table, columns, row):
+    cursor.execute(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(row))})", row)
+
+
+def test_store_picks_up_batches_committed_below_the_high_water_mark(ledger):
+    store = _store()
+    with db.get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT MAX(payment_id) FROM payments")
+        top = cursor.fetchone()[0]
+        row = _latest(cursor, "payments", PAYMENT)
+        insert = (f"INSERT INTO payments (payment_id, {', '.join(PAYMENT)}) "
+                  "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)")
+        # a single insert commits first with an id above a batch still in flight
+        cursor.execute(insert, (top + 1001, *row))
+        conn.commit()
+        store.refresh(force=True)
+        cursor.executemany(insert, [(top + 1 + i, *row) for i in range(1000)])
+        conn.commit()
+    store.refresh(force=True)
+    assert (store.frame["Type"] == "Payment").sum() == _count("payments")
+
+
+def _stamp(start, seconds):
+    return (start + timedelta(seconds=seconds)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def test_delta_rows_arriving_out_of_order_are_sorted_into_the_frame(ledger):
+    store = _store()
+    with db.get_connection() as conn, conn.cursor() as cursor:
+        payment = _latest(cursor, "payments", PAYMENT)
+        purchase = _latest(cursor, "purchases", PURCHASE)
+        start = max(pd.Timestamp(payment[-1]), pd.Timestamp(purchase[-1])) + timedelta(minutes=1)
+        # newer than everything in the store, but the newest comes back first
+        _insert(cursor, "payments", PAYMENT, payment[:-1] + [_stamp(start, 11)])
+        _insert(cursor, "purchases", PURCHASE, purchase[:-1] + [_stamp(start, 10)])
+        conn.commit()
+    store.refresh(force=True)
+
+    frame = store.frame
+    assert frame["created_at"].is_monotonic_increasing
+    assert list(frame["Type"].iloc[-2:]) == ["Purchase", "Payment"]
+    newest, _ = page_history(frame, page_size=2)
+    assert list(newest["Type"]) == ["Payment", "Purchase"]
+    assert list(filter_history(frame)["Type"].iloc[:2]) == ["Payment", "Purchase"]
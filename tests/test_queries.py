@@ -0,0 +1,80 @@
+#  --- History Filters in SQL ---
+from datetime import date
+
+import pandas as pd
+import pytest
+
+import db
+from benchmarks import generator
+from queries import HISTORY_COLUMNS, build_history_query, load_history_df
+from reference import FEE_TYPES
+
+
+# the History query and pandas filters of the app before they moved into SQL
+BASELINE_SQL = """
+    SELECT 'Payment' as Type, CONCAT(first_name, ' ', last_name) AS Name, amount AS Amount, fee_type AS Category, CONCAT(month_paid, ' ', year_paid) AS Period, created_at, school_id FROM payments p
+    JOIN enrollees e ON p.enrollee_id = e.enrollee_id
+    UNION ALL
+    SELECT 'Purchase' as Type, item_name AS Item, amount AS Amount, quantity AS Quantity, CONCAT(month_paid, ' ', year_paid) AS Period, created_at, school_id FROM purchases pu
+    JOIN items e ON pu.item_id = e.item_id
+"""
+
+
+def baseline_history(start_date=None, end_date=None, school=None, txn_type=None, fee_type=None):
+    with db.get_connection() as conn, conn.cursor(dictionary=True) as cursor:
+        cursor.execute(BASELINE_SQL)
+        rows = cursor.fetchall()
+        column_names = [i[0] for i in cursor.description]
+        df = pd.DataFrame(rows, columns=column_names)
+        if start_date is not None:
+            end_date = pd.to_datetime(end_date) + pd.Timedelta(days=1)
+            df['created_at'] = pd.to_datetime(df['created_at'])
+            df = df[(df['created_at'] >= pd.to_datetime(start_date)) & (df['created_at'] <= pd.to_datetime(end_date))]
+        if fee_type is not None:
+            df = df[(df['Type'] == "Payment") & (df['Category'] == fee_type)]
+        if school is not None:
+            cursor.execute("SELECT school_id FROM school_types WHERE school_name = %s", (school,))
+            school_id = cursor.fetchone()['school_id']
+            df = df[df['school_id'] == school_id]
+        if txn_type is not None:
+            df = df[df['Type'] == txn_type]
+    return df.sort_values(by="created_at", ascending=False).drop(columns=['school_id'])
+
+
+def _rows(frame):
+    # compared as a multiset: rows sharing a timestamp may come in either order
+    frame = pd.DataFrame({
+        "Type": frame["Type"].astype(str),
+        "Name": frame["Name"].astype(str),
+        "Amount": pd.to_numeric(frame["Amount"]).astype("float64").round(2),
+        "Category": frame["Category"].astype(str),
+        "Period": frame["Period"].astype(str),
+        "created_at": pd.to_datetime(frame["created_at"]),
+    })
+    return frame.sort_values(list(frame.columns), kind="stable").reset_index(drop=True)
+
+
+THIS_YEAR = date.today().year
+
+
+@pytest.mark.parametrize("filters", [
+    {},
+    {"txn_type": "Payment"},
+    {"txn_type": "Purchase"},
+    {"school": generator.SCHOOLS[1]},
+    {"fee_type": FEE_TYPES[0]},
+    {"fee_type": FEE_TYPES[1], "school": generator.SCHOOLS[0]},
+    {"txn_type": "Purchase", "fee_type": FEE_TYPES[0]},
+    {"start_date": date(THIS_YEAR - 1, 3, 1), "end_date": date(THIS_YEAR - 1, 3, 31)},
+    {"start_date": date(THIS_YEAR - 2, 1, 1), "end_date": date(THIS_YEAR, 6, 30), "txn_type": "Purchase",
+     "school": generator.SCHOOLS[2]},
+])
+def test_sql_filters_match_the_pandas_filters(ledger, filters):
+    filtered = load_history_df(**filters)
+    assert list(filtered.columns) == HISTORY_COLUMNS
+    assert pd.to_datetime(filtered["created_at"]).is_monotonic_decreasing
+    pd.testing.assert_frame_equal(_rows(filtered), _rows(baseline_history(**filters)))
+
+
+def test_filters_that_exclude_both_sides_build_no_query():
+    assert build_history_query(txn_type="Purchase", fee_type=FEE_TYPES[0]) == (None, [])
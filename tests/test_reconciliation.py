@@ -0,0 +1,57 @@
+#  --- Reconciliation ---
+import numpy as np
+import pandas as pd
+
+from reconciliation import _pack_keys, reconcile
+from reference import MONTHS
+
+
+def test_packed_keys_round_trip():
+    rng = np.random.default_rng(3)
+    n = 10_000
+    enrollee_id = rng.integers(1, 2 ** 39, n)
+    fee_code = rng.integers(0, 256, n)
+    year = rng.integers(1900, 4096, n)
+    month = rng.integers(1, 13, n)
+    keys = _pack_keys(enrollee_id, fee_code, year, month)
+    # unpacked as reconcile does
+    assert (keys >> 24 == enrollee_id).all()
+    assert ((keys >> 16) & 0xFF == fee_code).all()
+    assert ((keys >> 4) & 0xFFF == year).all()
+    assert (keys & 0xF == month).all()
+
+
+def test_reconcile_unpacks_each_key():
+    enrollees = pd.DataFrame({
+        "enrollee_id": [7, 2 ** 35],
+        "name": ["Ada Obi", "Tunde Ade"],
+        "school": ["North", "South"],
+    })
+    schedule = pd.DataFrame({
+        "school": ["North", "South", "South"],
+        "fee_type": ["Tuition", "Tuition", "Bus"],
+        "month": ["December", "January", "January"],
+        "year": [2024, None, 2025],
+        "amount": ["1000.50", "2000", "300"],
+    })
+    payments = pd.DataFrame({
+        "enrollee_id": [7, 2 ** 35, 2 ** 35, 2 ** 35],
+        "fee_type": ["Tuition", "Tuition", "Bus", "Uniform"],
+        "month": ["December", "January", "January", "March"],
+        "year": [2024, 2025, 2025, 2025],
+        "amount": ["1000.50", "1500", "400", "50"],
+    })
+    result = reconcile(enrollees, schedule, payments, 2024, 2025)
+    rows = {
+        (row.enrollee_id, row.fee_type, row.year, row.month): (row.expected, row.paid, row.outstanding, row.overpaid)
+        for row in result.itertuples()
+    }
+    december, january, march = (MONTHS.index(name) + 1 for name in ("December", "January", "March"))
+    assert rows == {
+        (7, "Tuition", 2024, december): (100050, 100050, 0, 0),
+        (2 ** 35, "Tuition", 2024, january): (200000, 0, 200000, 0),
+        (2 ** 35, "Tuition", 2025, january): (200000, 150000, 50000, 0),
+        (2 ** 35, "Bus", 2025, january): (30000, 40000, 0, 10000),
+        (2 ** 35, "Uniform", 2025, march): (0, 5000, 0, 5000),
+    }
+    assert set(result.loc[result["enrollee_id"] == 7, "name"]) == {"Ada Obi"}
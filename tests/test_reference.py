@@ -0,0 +1,125 @@
+#  --- Reference Data Cache ---
+import time
+
+import db
+import reference
+from reference import TTLCache
+
+
+def test_entries_expire_after_the_ttl():
+    cache = TTLCache(ttl=0.05)
+    loads = []
+    load = lambda: loads.append(1) or len(loads)
+    assert cache.get("key", load) == 1
+    assert cache.get("key", load) == 1
+    time.sleep(0.1)
+    assert cache.peek("key") is None
+    assert cache.get("key", load) == 2
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 2)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(ttl=60, maxsize=2)
+    cache.get("a", lambda: "A")
+    cache.get("b", lambda: "B")
+    cache.get("a", lambda: "stale")
+    cache.get("c", lambda: "C")
+    assert cache.peek("b") is None
+    assert (cache.peek("a"), cache.peek("c")) == ("A", "C")
+    assert cache.stats()["evictions"] == 1
+
+
+def test_invalidate_drops_matching_keys_only():
+    cache = TTLCache(ttl=60)
+    for key in [("enrollees", None), ("enrollees", "North"), ("items",)]:
+        cache.get(key, lambda: "value")
+    cache.invalidate(lambda key: key[0] == "enrollees")
+    assert cache.stats()["size"] == 1 and cache.peek(("items",)) == "value"
+    cache.invalidate()
+    assert cache.stats()["size"] == 0
+
+
+def _execute(sql, params=()):
+    with db.get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(sql, params)
+        conn.commit()
+        return cursor.lastrowid
+
+
+def test_reference_lists_are_served_from_the_cache_until_invalidated(ledger):
+    school = reference.get_schools()[0][1]
+    enrollees = reference.get_enrollees(school)
+    items = reference.get_items()
+    enrollee_id = _execute("INSERT INTO enrollees (first_name, last_name, school_name) VALUES (%s, %s, %s)",
+                           ("Zainab", "Cached", school))
+    item_id = _execute("INSERT INTO items (item_name) VALUES (%s)", ("Cached item",))
+    assert reference.get_enrollees(school) == enrollees
+    assert reference.get_items() == items
+
+    reference.invalidate_items(broadcast=False)
+    assert (item_id, "Cached item") in reference.get_items()
+    assert reference.get_enrollees(school) == enrollees
+
+    reference.invalidate_enrollees(broadcast=False)
+    assert (enrollee_id, "Zainab Cached") in reference.get_enrollees(school)
+    assert (enrollee_id, "Zainab Cached") in reference.get_enrollees()
+
+
+def test_school_names_come_from_the_cached_list(ledger):
+    schools = reference.get_schools()
+    assert [school_id for school_id, _ in schools] == sorted(school_id for school_id, _ in schools)
+    assert reference.get_school_name(schools[0][0]) == schools[0][1]
+    assert reference.get_school_name(-1) is None
+
+
+def _school_enrollees():
+    with db.get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT school_name FROM enrollees GROUP BY school_name ORDER BY COUNT(*) DESC LIMIT 1")
+        school = cursor.fetchone()[0]
+        cursor.execute("SELECT enrollee_id, first_name, last_name FROM enrollees WHERE school_name = %s", (school,))
+        return school, cursor.fetchall()
+
+
+def _expected(rows, query, limit):
+    matches = sorted((r for r in rows if reference._matches(r[1], r[2], query)), key=lambda r: (r[2], r[1], r[0]))
+    return [(enrollee_id, f"{first} {last}") for enrollee_id, first, last in matches[:limit]]
+
+
+def test_search_matches_either_name_order(ledger):
+    school, rows = _school_enrollees()
+    first, last = rows[0][1], rows[0][2]
+    queries = ["", first[:1], first[:3].upper(), last[:2], f"{first} {last[:2]}", f"  {last}   {first[:1]} ", "%", "zz"]
+    for query in queries:
+        expected = _expected(rows, reference._normalise(query), 5)
+        assert reference.search_enrollees(school, query, limit=5) == expected, query
+
+
+def test_longer_prefixes_are_filtered_from_a_complete_shorter_result(ledger, monkeypatch):
+    school, rows = _school_enrollees()
+    queries = []
+    query_enrollees = reference._query_enrollees
+    monkeypatch.setattr(reference, "_query_enrollees",
+                        lambda *args: queries.append(args[1]) or query_enrollees(*args))
+    first = rows[0][1].lower()
+    # a prefix narrow enough to return fewer than the limit
+    narrow = next(first[:n] for n in range(1, len(first) + 1) if len(_expected(rows, first[:n], 1000)) < 20)
+    reference.search_enrollees(school, narrow)
+    reference.search_enrollees(school, first)
+    reference.search_enrollees(school, first + " ")
+    assert queries == [narrow]
+    assert reference.search_enrollees(school, first) == _expected(rows, first, 20)
+
+    # a full page may have left matches out, so it is queried again
+    reference.search_enrollees(school, "")
+    reference.search_enrollees(school, "q")
+    assert queries == [narrow, "", "q"]
+
+
+def test_searches_see_new_enrollees_once_invalidated(ledger):
+    school, _ = _school_enrollees()
+    assert reference.search_enrollees(school, "qwerty") == []
+    enrollee_id = _execute("INSERT INTO enrollees (first_name, last_name, school_name) VALUES (%s, %s, %s)",
+                           ("Qwerty", "Search", school))
+    assert reference.search_enrollees(school, "qwerty") == []
+    reference.invalidate_enrollees(broadcast=False)
+    assert reference.search_enrollees(school, "search qw") == [(enrollee_id, "Qwerty Search")]
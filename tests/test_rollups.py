@@ -0,0 +1,100 @@
+#  --- Monthly Rollups ---
+from datetime import date, datetime
+
+import pandas as pd
+
+import db
+import archive
+import rollups
+from bulk_import import import_frame
+from reference import MONTHS
+
+
+def _rebuilt():
+    with db.get_connection() as conn:
+        rollups.rebuild(conn)
+    return rollups.load_rollups()
+
+
+def _ledger_totals():
+    # the same totals, aggregated straight from the ledger tables
+    with db.get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT st.school_name, p.fee_type, p.year_paid, p.month_paid, COUNT(*), SUM(p.amount)
+            FROM payments p JOIN school_types st ON st.school_id = p.school_id
+            GROUP BY st.school_name, p.fee_type, p.year_paid, p.month_paid
+        """)
+        rows = cursor.fetchall()
+    frame = pd.DataFrame(rows, columns=["school", "fee_type", "year", "month", "payments", "amount"])
+    frame["month"] = frame["month"].map(lambda month: MONTHS.index(month) + 1)
+    return _keyed(frame)
+
+
+def _keyed(frame):
+    frame = frame.astype({"year": "int64", "month": "int64", "payments": "int64", "amount": "float64"})
+    frame["amount"] = frame["amount"].round(2)
+    return frame.sort_values(["school", "fee_type", "year", "month"]).reset_index(drop=True)
+
+
+def test_rebuild_matches_the_ledger(ledger):
+    totals = _rebuilt()
+    pd.testing.assert_frame_equal(_keyed(totals["payments"]), _ledger_totals())
+    with db.get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*), SUM(amount) FROM purchases")
+        count, amount = cursor.fetchone()
+    assert totals["purchases"]["purchases"].sum() == count
+    assert round(totals["purchases"]["amount"].sum(), 2) == round(float(amount), 2)
+
+
+def test_rebuild_twice_changes_nothing(ledger):
+    first = _rebuilt()
+    version = rollups.rollup_version()
+    second = _rebuilt()
+    assert rollups.rollup_version() == version
+    pd.testing.assert_frame_equal(_keyed(first["payments"]), _keyed(second["payments"]))
+
+
+def test_writes_maintain_the_totals_a_rebuild_would_give(ledger):
+    _rebuilt()
+    version = rollups.rollup_version()
+    with db.get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT item_name, school_name FROM items, school_types ORDER BY item_id, school_id LIMIT 1")
+        item, school = cursor.fetchone()
+        cursor.execute("""
+            SELECT enrollee_id, fee_type, month_paid, year_paid, school_id FROM payments ORDER BY payment_id LIMIT 1
+        """)
+        enrollee_id, fee_type, month, year, school_id = cursor.fetchone()
+        # payments recorded by hand, as the task form does
+        for amount in ("125.50", "0.25"):
+            cursor.execute("""
+                INSERT INTO payments (enrollee_id, fee_type, amount, month_paid, year_paid, school_id, created_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """, (enrollee_id, fee_type, amount, month, year, school_id, datetime.now()))
+        rollups.add_payments(cursor, [(school_id, fee_type, month, year, "125.50"),
+                                      (school_id, fee_type, month, year, "0.25")])
+        conn.commit()
+    purchases = pd.DataFrame([
+        {"item": item, "school": school, "quantity": "3", "amount": "90", "month": "May", "year": str(year)},
+        {"item": item, "school": school, "quantity": "1", "amount": "30.10", "month": "May", "year": str(year)},
+    ])
+    assert import_frame(purchases, "purchases")["inserted"] == 2
+    assert rollups.rollup_version() != version
+
+    maintained = rollups.load_rollups()
+    rebuilt = _rebuilt()
+    for kind in ("payments", "purchases"):
+        columns = list(maintained[kind].columns[:4])
+        pd.testing.assert_frame_equal(
+            maintained[kind].sort_values(columns).reset_index(drop=True),
+            rebuilt[kind].sort_values(columns).reset_index(drop=True),
+        )
+
+
+def test_rebuild_keeps_the_totals_of_archived_years(ledger):
+    before = _keyed(_rebuilt()["payments"])
+    year = date.today().year - 2
+    with db.get_connection() as conn:
+        archive.archive_year(conn, year)
+    after = _keyed(_rebuilt()["payments"])
+    assert (after["year"] == year).sum() > 0
+    pd.testing.assert_frame_equal(after, before)
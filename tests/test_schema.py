@@ -0,0 +1,86 @@
+#  --- Schema Migrations ---
+import logging
+
+import pytest
+
+import db
+import schema
+from benchmarks import standin
+
+
+def _tables(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        return {row[0] for row in cursor.fetchall()}
+
+
+@pytest.fixture
+def empty(tmp_path, monkeypatch):
+    """An empty database and three small migrations."""
+    monkeypatch.setattr(schema, "MIGRATIONS", [
+        (1, "First", ["CREATE TABLE first (x INT)"]),
+        (2, "Second", ["CREATE TABLE second (x INT)", "INSERT INTO second (x) SELECT 1"]),
+        (3, "Third", ["CREATE TABLE third (x INT)"]),
+    ])
+    conn = standin.connect(str(tmp_path / "empty.sqlite3"))
+    yield conn
+    conn.close()
+
+
+def test_migrations_are_numbered_in_order():
+    versions = [version for version, _, _ in schema.MIGRATIONS]
+    assert versions == sorted(set(versions))
+    assert schema.LATEST_VERSION == versions[-1]
+
+
+def test_migrate_applies_pending_versions_in_order(empty):
+    assert schema.applied_versions(empty) == set()
+    assert schema.migrate(empty, target=2) == [1, 2]
+    assert {"first", "second", "schema_migrations"} <= _tables(empty)
+    assert "third" not in _tables(empty)
+    assert schema.migrate(empty) == [3]
+    assert schema.migrate(empty) == []
+    assert schema.applied_versions(empty) == {1, 2, 3}
+
+
+def test_migrate_fills_in_a_skipped_version(empty):
+    schema.migrate(empty)
+    with empty.cursor() as cursor:
+        cursor.execute("DELETE FROM schema_migrations WHERE version = 2")
+        cursor.execute("DROP TABLE second")
+    empty.commit()
+    assert [version for version, _, _ in schema.pending_migrations(empty)] == [2]
+    assert schema.migrate(empty) == [2]
+
+
+def test_check_schema_is_quiet_when_up_to_date(ledger, caplog):
+    with caplog.at_level(logging.WARNING, logger="ShinyAppLogger"):
+        assert schema.check_schema() == []
+    assert not caplog.records
+
+
+def test_check_schema_warns_about_pending_migrations(ledger, caplog):
+    with db.get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute("DELETE FROM schema_migrations WHERE version = %s", (schema.LATEST_VERSION,))
+        conn.commit()
+    with caplog.at_level(logging.WARNING, logger="ShinyAppLogger"):
+        assert schema.check_schema() == [schema.LATEST_VERSION]
+    assert "python schema.py migrate" in caplog.text
+
+
+def test_check_schema_does_not_create_the_migrations_table(ledger):
+    with db.get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute("DROP TABLE schema_migrations")
+        conn.commit()
+    # a database never migrated: everything is pending, and nothing is written
+    assert schema.check_schema() == [version for version, _, _ in schema.MIGRATIONS]
+    with db.get_connection() as conn:
+        assert "schema_migrations" not in _tables(conn)
+
+
+def test_check_schema_raises_other_errors(ledger):
+    with db.get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute("ALTER TABLE schema_migrations RENAME COLUMN version TO release")
+        conn.commit()
+    with pytest.raises(Exception, match="version"):
+        schema.check_schema()
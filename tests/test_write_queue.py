@@ -0,0 +1,71 @@
+#  --- Write-Behind Queue ---
+import db
+import reference
+from write_queue import WriteQueue
+
+
+def _count(sql):
+    with db.get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(sql)
+        return cursor.fetchone()[0]
+
+
+def _ledger_counts():
+    return (
+        _count("SELECT COUNT(*) FROM payments"),
+        _count("SELECT COUNT(*) FROM purchases"),
+        _count("SELECT COALESCE(SUM(payment_count), 0) FROM payment_totals"),
+    )
+
+
+def _submit(queue, payments=5, purchases=3):
+    for i in range(payments):
+        queue.submit_payment(1, "Tuition", f"{1000 + i}.00", "January", 2025, 1)
+    for i in range(purchases):
+        queue.submit_purchase(1, "2", f"{50 + i}.00", 1, "January", 2025)
+
+
+def test_replayed_batch_is_written_once(ledger, tmp_path):
+    queue = WriteQueue(str(tmp_path / "journal.sqlite3"))
+    before = _ledger_counts()
+    _submit(queue)
+    journal = queue._execute("SELECT submission_key, kind, payload, enqueued_at FROM submissions ORDER BY id")
+    assert queue.drain() == 8
+    after = _ledger_counts()
+    assert after == (before[0] + 5, before[1] + 3, before[2] + 5)
+
+    # a drainer that died between the commit and clearing its journal replays the same submissions
+    for row in journal:
+        queue._execute("INSERT INTO submissions (submission_key, kind, payload, enqueued_at) VALUES (?, ?, ?, ?)", row)
+    assert queue.drain() == 8
+    assert _ledger_counts() == after
+    assert queue.stats()["depth"] == 0
+
+
+def test_submission_that_keeps_failing_is_set_aside(ledger, tmp_path):
+    queue = WriteQueue(str(tmp_path / "journal.sqlite3"), max_attempts=3)
+    before = _ledger_counts()
+    # a list cannot be bound as a parameter: neither a rejection nor an outage
+    queue.submit_payment(1, "Tuition", [1, 2], "January", 2025, 1)
+    _submit(queue, payments=4, purchases=0)
+    for _ in range(2):
+        try:
+            queue.drain()
+        except Exception:
+            pass
+    assert _ledger_counts() == before
+    assert queue.drain() == 5
+    assert _ledger_counts()[0] == before[0] + 4
+    assert queue.stats() == {"depth": 0, "failed": 1, "lag_seconds": 0.0}
+
+
+def test_new_item_is_listed_once_its_purchase_is_written(ledger, tmp_path):
+    queue = WriteQueue(str(tmp_path / "journal.sqlite3"))
+    version = reference.items_version()
+    queue.submit_purchase(None, "1", "75.00", 1, "January", 2025, new_item="Queued item")
+    # acknowledged but not yet written: the item list has nothing new to show
+    assert reference.items_version() == version
+    assert "Queued item" not in dict(reference.get_items()).values()
+    assert queue.drain() == 1
+    assert reference.items_version() != version
+    assert "Queued item" in dict(reference.get_items()).values()
@@ -0,0 +1,71 @@
+#  --- Payment and Purchase Write Path ---
+import logging
+
+import rollups
+import reference
+from db import get_connection
+from history_store import history_store
+
+
+logger = logging.getLogger("ShinyAppLogger")
+
+
+# created_at defaults to the database clock when the parameter is NULL
+PAYMENT_INSERT = """
+    INSERT INTO payments (enrollee_id, fee_type, amount, month_paid, year_paid, school_id, created_at)
+    VALUES (%s, %s, %s, %s, %s, %s, COALESCE(%s, NOW()))
+"""
+
+PURCHASE_INSERT = """
+    INSERT INTO purchases (item_id, quantity, amount, school_id, month_paid, year_paid, created_at)
+    VALUES (%s, %s, %s, %s, %s, %s, COALESCE(%s, NOW()))
+"""
+
+
+def insert_payment(cursor, enrollee_id, fee_type, amount, month, year, school_id, created_at=None):
+    cursor.execute(PAYMENT_INSERT, (enrollee_id, fee_type, amount, month, year, school_id, created_at))
+    return cursor.lastrowid
+
+
+def insert_purchase(cursor, item_id, quantity, amount, school_id, month, year, created_at=None):
+    cursor.execute(PURCHASE_INSERT, (item_id, quantity, amount, school_id, month, year, created_at))
+    return cursor.lastrowid
+
+
+def record_payment(enrollee_id, fee_type, amount, month, year, school_id, new_enrollee=None):
+    """
+    The function inserts and commits one payment, together with its
+    payment_totals rollup, on a pooled connection and returns the new
+    payment id. With ``new_enrollee`` given as ``(first_name, last_name,
+    school_name)`` the enrollee is created in the same transaction and
+    ``enrollee_id`` is ignored.
+    """
+    with get_connection() as conn, conn.cursor() as cursor:
+        if new_enrollee is not None:
+            enrollee_id = reference.add_enrollee(cursor, *new_enrollee)
+        payment_id = insert_payment(cursor, enrollee_id, fee_type, amount, month, year, school_id)
+        rollups.add_payments(cursor, [(school_id, fee_type, month, year, amount)])
+        conn.commit()
+    if new_enrollee is not None:
+        reference.invalidate_enrollees()
+    history_store.mark_dirty()
+    return payment_id
+
+
+def record_purchase(item_id, quantity, amount, school_id, month, year, new_item=None):
+    """
+    The function inserts and commits one purchase, together with its
+    purchase_totals rollup, on a pooled connection and returns the new
+    purchase id. With a ``new_item`` name the item is created in the same
+    transaction and ``item_id`` is ignored.
+    """
+    with get_connection() as conn, conn.cursor() as cursor:
+        if new_item is not None:
+            item_id = reference.add_item(cursor, new_item)
+        purchase_id = insert_purchase(cursor, item_id, quantity, amount, school_id, month, year)
+        rollups.add_purchases(cursor, [(item_id, school_id, month, year, amount)])
+        conn.commit()
+    if new_item is not None:
+        reference.invalidate_items()
+    history_store.mark_dirty()
+    return purchase_id
@@ -0,0 +1,89 @@
+#  --- Background Workers for Blocking Work ---
+import os
+import asyncio
+import logging
+import functools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import bcrypt
+
+
+logger = logging.getLogger("ShinyAppLogger")
+
+# Short lookups and writes run on DB_THREADS threads; long scans (history,
+# exports, imports, reconciliation) get their own DB_HEAVY_THREADS so that a
+# heavy query in one session cannot starve the quick ones of every other session.
+DB_THREADS = int(os.getenv("DB_THREADS", "8"))
+DB_HEAVY_THREADS = int(os.getenv("DB_HEAVY_THREADS", "2"))
+BCRYPT_PROCESSES = int(os.getenv("BCRYPT_PROCESSES", "2"))
+
+_db_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="db")
+_heavy_executor = ThreadPoolExecutor(max_workers=DB_HEAVY_THREADS, thread_name_prefix="db-heavy")
+_bcrypt_executor = None
+
+
+def _get_bcrypt_executor():
+    global _bcrypt_executor
+    if _bcrypt_executor is None:
+        _bcrypt_executor = ProcessPoolExecutor(
+            max_workers=BCRYPT_PROCESSES,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _bcrypt_executor
+
+
+async def run_db(fn, *args, heavy=False, **kwargs):
+    """
+    The function runs a blocking database call on the worker thread pool
+    and awaits its result, keeping the event loop free for other sessions
+    """
+    loop = asyncio.get_running_loop()
+    executor = _heavy_executor if heavy else _db_executor
+    return await loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+
+
+async def iterate_in_thread(iterator, heavy=True):
+    """
+    The function turns a blocking iterator (e.g. a streaming cursor) into an
+    async one by pulling each item on the worker thread pool
+    """
+    done = object()
+    try:
+        while True:
+            item = await run_db(next, iterator, done, heavy=heavy)
+            if item is done:
+                break
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            await run_db(close, heavy=heavy)
+
+
+def _checkpw(password, password_hash):
+    return bcrypt.checkpw(password, password_hash)
+
+
+async def check_password(password, password_hash):
+    """The function verifies a bcrypt hash in the process pool, off the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_bcrypt_executor(), _checkpw, password, password_hash)
+
+
+def _hashpw(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds))
+
+
+async def hash_password(password, rounds):
+    """The function hashes a password with ``rounds`` bcrypt rounds in the process pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_bcrypt_executor(), _hashpw, password, rounds)
+
+
+def shutdown():
+    """The function stops the pools taking new work; the app registers it to run at exit."""
+    _db_executor.shutdown(wait=False)
+    _heavy_executor.shutdown(wait=False)
+    if _bcrypt_executor is not None:
+        _bcrypt_executor.shutdown(wait=False)
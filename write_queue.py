@@ -0,0 +1,429 @@
+#  --- Write-Behind Submission Queue ---
+import os
+import sys
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta
+from decimal import InvalidOperation
+
+import mysql.connector
+
+import rollups
+import reference
+from db import PoolTimeout, get_connection
+from history_store import history_store
+from metrics import registry
+from transactions import PAYMENT_INSERT, PURCHASE_INSERT
+
+try:
+    import fcntl
+except ImportError:  # Windows: no drain lock, the applied-key check still prevents duplicates
+    fcntl = None
+
+
+logger = logging.getLogger("ShinyAppLogger")
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+JOURNAL_SQL = """
+    CREATE TABLE IF NOT EXISTS submissions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        submission_key TEXT NOT NULL UNIQUE,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        enqueued_at REAL NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT
+    )
+"""
+
+APPLIED_INSERT = "INSERT INTO write_queue_applied (submission_key, applied_at) VALUES (%s, NOW())"
+APPLIED_PRUNE = "DELETE FROM write_queue_applied WHERE applied_at < %s"
+
+# errors caused by the submission itself: the submission is set aside at once
+DATA_ERRORS = (
+    mysql.connector.errors.IntegrityError, mysql.connector.errors.DataError,
+    sqlite3.IntegrityError, ValueError, TypeError, KeyError, InvalidOperation,
+)
+
+# errors of an unreachable or overloaded database (a lost connection, a full
+# pool): retried until the database is back, without counting attempts.
+# Any other error (a ProgrammingError, a lock timeout) counts an attempt
+# against each submission of the batch, up to max_attempts.
+TRANSIENT_ERRORS = (
+    mysql.connector.errors.InterfaceError, mysql.connector.errors.OperationalError,
+    sqlite3.OperationalError, PoolTimeout, OSError,
+)
+
+applied_total = registry.counter(
+    "recon_write_queue_applied_total", "Queued submissions written to the database.", ["kind"]
+)
+retries_total = registry.counter(
+    "recon_write_queue_retries_total", "Drain attempts that failed and were retried."
+)
+batch_seconds = registry.histogram(
+    "recon_write_queue_batch_seconds", "Time to write one group-committed batch of queued submissions."
+)
+
+
+def _apply(cursor, rows):
+    """
+    The function writes journal rows ``(id, key, kind, payload)`` on
+    ``cursor`` without committing, skipping those already applied by an
+    earlier attempt. Returns the (payments, purchases, new enrollees, new
+    items) written.
+    """
+    keys = [row[1] for row in rows]
+    cursor.execute(
+        f"SELECT submission_key FROM write_queue_applied WHERE submission_key IN ({', '.join(['%s'] * len(keys))})",
+        keys,
+    )
+    done = {key for (key,) in cursor.fetchall()}
+
+    payments, purchases, applied = [], [], []
+    new_enrollees = new_items = 0
+    for _, key, kind, payload in rows:
+        if key in done:
+            continue
+        data = json.loads(payload)
+        created_at = datetime.strptime(data["created_at"], TIMESTAMP_FORMAT)
+        if kind == "payment":
+            enrollee_id = data["enrollee_id"]
+            if data.get("new_enrollee"):
+                enrollee_id = reference.add_enrollee(cursor, *data["new_enrollee"])
+                new_enrollees += 1
+            payments.append((enrollee_id, data["fee_type"], data["amount"], data["month"], data["year"],
+                             data["school_id"], created_at))
+        elif kind == "purchase":
+            item_id = data["item_id"]
+            if data.get("new_item"):
+                item_id = reference.add_item(cursor, data["new_item"])
+                new_items += 1
+            purchases.append((item_id, data["quantity"], data["amount"], data["school_id"], data["month"],
+                              data["year"], created_at))
+        else:
+            raise ValueError(f"Unknown submission kind: {kind}")
+        applied.append((key,))
+
+    if payments:
+        cursor.executemany(PAYMENT_INSERT, payments)
+        rollups.add_payments(cursor, [(p[5], p[1], p[3], p[4], p[2]) for p in payments])
+    if purchases:
+        cursor.executemany(PURCHASE_INSERT, purchases)
+        rollups.add_purchases(cursor, [(p[0], p[3], p[4], p[5], p[2]) for p in purchases])
+    if applied:
+        cursor.executemany(APPLIED_INSERT, applied)
+    return len(payments), len(purchases), new_enrollees, new_items
+
+
+class WriteQueue:
+    """
+    A durable local queue of confirmed payments and purchases.
+
+    Submissions are committed to an SQLite journal (fsynced) and
+    acknowledged at once; a background thread drains the journal into the
+    database in group-committed batches of up to ``batch_size``. Every
+    submission carries a key that is recorded in write_queue_applied in the
+    same transaction, so a batch that is retried after a crash or a lost
+    connection is never written twice. Batches failing for a database
+    outage are retried with exponential backoff up to ``retry_max``
+    seconds apart; a submission the database rejects, or that still fails
+    after ``max_attempts`` attempts for another reason, is kept in the
+    journal as failed, for ``python write_queue.py retry``, so the
+    submissions behind it keep moving. Applied keys older than
+    ``applied_retention`` seconds, the window in which a batch can be
+    replayed, are deleted every ``prune_interval`` seconds.
+    """
+
+    def __init__(self, path, batch_size=200, poll_interval=1.0, retry_max=30.0, max_attempts=8,
+                 applied_retention=7 * 86400, prune_interval=3600.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.retry_max = retry_max
+        self.max_attempts = max_attempts
+        self.applied_retention = applied_retention
+        self.prune_interval = prune_interval
+        self._conn = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock_file = None
+
+    def _journal(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.execute(JOURNAL_SQL)
+            self._conn = conn
+        return self._conn
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._journal().execute(sql, params).fetchall()
+
+    # --- Submitting ---
+    def enqueue(self, kind, payload):
+        """The method journals one submission and returns its key."""
+        key = uuid.uuid4().hex
+        payload = dict(payload, created_at=payload.get("created_at") or datetime.now().strftime(TIMESTAMP_FORMAT))
+        self._execute(
+            "INSERT INTO submissions (submission_key, kind, payload, enqueued_at) VALUES (?, ?, ?, ?)",
+            (key, kind, json.dumps(payload), time.time()),
+        )
+        self._wake.set()
+        return key
+
+    def submit_payment(self, enrollee_id, fee_type, amount, month, year, school_id, new_enrollee=None):
+        """The queued counterpart of transactions.record_payment."""
+        return self.enqueue("payment", {
+            "enrollee_id": enrollee_id, "fee_type": fee_type, "amount": amount, "month": month,
+            "year": year, "school_id": school_id, "new_enrollee": new_enrollee,
+        })
+
+    def submit_purchase(self, item_id, quantity, amount, school_id, month, year, new_item=None):
+        """The queued counterpart of transactions.record_purchase."""
+        return self.enqueue("purchase", {
+            "item_id": item_id, "quantity": quantity, "amount": amount, "school_id": school_id,
+            "month": month, "year": year, "new_item": new_item,
+        })
+
+    # --- Draining ---
+    def _write(self, rows):
+        started = time.perf_counter()
+        with get_connection() as conn, conn.cursor() as cursor:
+            payments, purchases, new_enrollees, new_items = _apply(cursor, rows)
+            conn.commit()
+        batch_seconds.observe(time.perf_counter() - started)
+        self._execute(f"DELETE FROM submissions WHERE id IN ({', '.join('?' * len(rows))})", [row[0] for row in rows])
+
+        applied_total.inc("payment", amount=payments)
+        applied_total.inc("purchase", amount=purchases)
+        if new_enrollees:
+            reference.invalidate_enrollees()
+        if new_items:
+            reference.invalidate_items()
+        history_store.mark_dirty()
+
+    def drain_once(self):
+        """
+        The method writes the oldest pending submissions as one transaction
+        and returns how many it took from the journal. If the batch is
+        rejected, or has failed ``max_attempts`` times, it writes them one
+        at a time to set the offending ones aside. Other errors propagate,
+        leaving the journal as it was apart from the attempts counted.
+        """
+        rows = self._execute(
+            "SELECT id, submission_key, kind, payload FROM submissions WHERE failed = 0 ORDER BY id LIMIT ?",
+            (self.batch_size,),
+        )
+        if not rows:
+            return 0
+        exhausted = False
+        try:
+            self._write(rows)
+            return len(rows)
+        except TRANSIENT_ERRORS:
+            raise
+        except DATA_ERRORS as e:
+            if len(rows) == 1:
+                self._set_aside(rows[0], e)
+                return 1
+            logger.warning(f"Queued batch of {len(rows)} rejected, writing its submissions one by one")
+        except Exception as e:
+            attempts = self._count_attempt(rows, e)
+            if attempts < self.max_attempts:
+                raise
+            exhausted = True
+            logger.warning(f"Queued batch of {len(rows)} failed {attempts} times, writing its submissions one by one")
+
+        for row in rows:
+            try:
+                self._write([row])
+            except TRANSIENT_ERRORS:
+                raise
+            except DATA_ERRORS as e:
+                self._set_aside(row, e)
+            except Exception as e:
+                if not exhausted:
+                    raise
+                self._set_aside(row, e)
+        return len(rows)
+
+    def _count_attempt(self, rows, error):
+        # returns the most attempts any submission of the batch has now had
+        ids = [row[0] for row in rows]
+        placeholders = ", ".join("?" * len(ids))
+        self._execute(
+            f"UPDATE submissions SET attempts = attempts + 1, last_error = ? WHERE id IN ({placeholders})",
+            [str(error), *ids],
+        )
+        return self._execute(f"SELECT MAX(attempts) FROM submissions WHERE id IN ({placeholders})", ids)[0][0]
+
+    def _set_aside(self, row, error):
+        logger.error(f"Queued {row[2]} {row[1]} rejected and set aside: {error}")
+        self._execute(
+            "UPDATE submissions SET failed = 1, attempts = attempts + 1, last_error = ? WHERE id = ?",
+            (str(error), row[0]),
+        )
+
+    def drain(self):
+        """The method drains every pending submission, returning how many it took."""
+        total = 0
+        while True:
+            taken = self.drain_once()
+            if not taken:
+                return total
+            total += taken
+
+    def prune_applied(self):
+        """
+        The method deletes the applied keys older than ``applied_retention``
+        seconds and returns how many. A submission is only replayed while it
+        is still in a journal, so keys past the window are never checked again.
+        """
+        cutoff = (datetime.now() - timedelta(seconds=self.applied_retention)).strftime(TIMESTAMP_FORMAT)
+        with get_connection() as conn, conn.cursor() as cursor:
+            cursor.execute(APPLIED_PRUNE, (cutoff,))
+            conn.commit()
+            pruned = cursor.rowcount
+        if pruned:
+            logger.info(f"Write queue pruned {pruned} applied keys older than {cutoff}")
+        return pruned
+
+    def _holds_drain_lock(self):
+        # one drainer per journal, however many workers submit to it
+        if fcntl is None or self._lock_file is not None:
+            return True
+        lock_file = open(self.path + ".lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _run(self):
+        failures = 0
+        pruned_at = 0.0
+        while not self._stop.is_set():
+            if not self._holds_drain_lock():
+                self._stop.wait(self.poll_interval)
+                continue
+            try:
+                self.drain()
+                failures = 0
+                delay = self.poll_interval
+                if time.monotonic() - pruned_at >= self.prune_interval:
+                    pruned_at = time.monotonic()
+                    self.prune_applied()
+            except Exception as e:
+                failures += 1
+                retries_total.inc()
+                delay = min(self.retry_max, 0.5 * 2 ** min(failures, 10))
+                if isinstance(e, TRANSIENT_ERRORS):
+                    # attempts count only failures that are not an outage
+                    self._execute(
+                        "UPDATE submissions SET last_error = ? "
+                        "WHERE id = (SELECT MIN(id) FROM submissions WHERE failed = 0)",
+                        (str(e),),
+                    )
+                logger.warning(f"Write queue could not write to the database ({e}); retrying in {delay:.1f}s")
+            self._wake.wait(delay)
+            self._wake.clear()
+
+    def start(self):
+        """The method starts the background drainer thread."""
+        if self._thread is None:
+            self._journal()
+            self._thread = threading.Thread(target=self._run, name="write-queue", daemon=True)
+            self._thread.start()
+            logger.info(f"Write-behind queue draining {self.path}")
+
+    def stop(self, timeout=10.0):
+        """The method stops the drainer after a last attempt to empty the journal."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self._thread = None
+        if self._holds_drain_lock():
+            try:
+                self.drain()
+            except Exception:
+                logger.exception("Write queue not empty at shutdown; it will be drained on the next start")
+
+    # --- Monitoring ---
+    def stats(self):
+        """
+        The method returns the journal's depth (pending submissions), the
+        number set aside as failed, and the lag: the age in seconds of the
+        oldest pending submission
+        """
+        depth, failed, oldest = self._execute(
+            "SELECT COALESCE(SUM(failed = 0), 0), COALESCE(SUM(failed), 0), MIN(CASE WHEN failed = 0 THEN enqueued_at END) "
+            "FROM submissions"
+        )[0]
+        return {"depth": depth, "failed": failed, "lag_seconds": time.time() - oldest if oldest else 0.0}
+
+    def retry_failed(self):
+        """The method returns the failed submissions to the queue and returns how many."""
+        count = self._execute("SELECT COUNT(*) FROM submissions WHERE failed = 1")[0][0]
+        self._execute("UPDATE submissions SET failed = 0 WHERE failed = 1")
+        self._wake.set()
+        return count
+
+
+write_queue = WriteQueue(
+    os.getenv("WRITE_QUEUE_PATH", "write_queue.sqlite3"),
+    batch_size=int(os.getenv("WRITE_QUEUE_BATCH_SIZE", "200")),
+    retry_max=float(os.getenv("WRITE_QUEUE_RETRY_MAX_SECONDS", "30")),
+    max_attempts=int(os.getenv("WRITE_QUEUE_MAX_ATTEMPTS", "8")),
+    applied_retention=float(os.getenv("WRITE_QUEUE_APPLIED_RETENTION_DAYS", "7")) * 86400,
+)
+
+
+def _queue_metrics():
+    if write_queue._conn is None:
+        return
+    stats = write_queue.stats()
+    yield "recon_write_queue_depth", "Submissions waiting in the write-behind journal.", "gauge", {(): stats["depth"]}
+    yield "recon_write_queue_failed", "Submissions the database rejected, kept in the journal.", "gauge", {(): stats["failed"]}
+    yield "recon_write_queue_lag_seconds", "Age of the oldest waiting submission.", "gauge", {(): stats["lag_seconds"]}
+
+
+registry.add_collector(_queue_metrics)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or drain the write-behind submission journal.")
+    parser.add_argument("command", choices=["status", "drain", "retry"],
+                        help="show depth, lag and failures; write everything pending now; requeue failed submissions")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if args.command == "retry":
+        print(f"Requeued {write_queue.retry_failed()} failed submissions")
+    elif args.command == "drain":
+        print(f"Wrote {write_queue.drain()} submissions")
+    stats = write_queue.stats()
+    print(f"Pending: {stats['depth']}, failed: {stats['failed']}, lag: {stats['lag_seconds']:.1f}s")
+    for key, kind, attempts, error in write_queue._execute(
+        "SELECT submission_key, kind, attempts, last_error FROM submissions WHERE failed = 1 ORDER BY id"
+    ):
+        print(f"  failed {kind} {key} after {attempts} attempts: {error}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())